@@ -19,7 +19,7 @@
 # Plugin base class will be in /models/plugin.py
 # Network object can be found in network.py
 
-__all__ = ["models", "waveapi", "plugins", "network", "websocket", "DNS",
+__all__ = ["models", "waveapi", "plugins", "network", "searchcache", "websocket", "DNS",
 "ConnectionFailure"]
 
 class ConnectionFailure(IOError):
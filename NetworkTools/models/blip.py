@@ -17,7 +17,7 @@
 #    limitations under the License.
 #
 
-from collections import deque
+import bisect
 
 import document
 
@@ -184,90 +184,120 @@ class Annotation(object):
 class Annotations(object):
     """A collection of Annotations.
 
-    Annotation objects are stored inside of a set, and the Annotations class
-    is simply a proxy to that set. There are 2 clear benefits of producing a
-    set.
-        1)  Identical Annotations are automatically removed.
-            * Annotations are deemed identical if all their attributes are the
-              same (start, end, name, value)
-        2)  The Annotations are unordered. This is a benefit because any order
-            would have to be constantly updated and changed for efficiency.
-
-    There are 
-        """
+    The annotations are kept as a run-length map: a sorted array of the
+    positions where the annotations change, and for each of these the
+    annotations (a dictionary of name:value pairs) that apply from there up
+    to the next change. The first run starts at 0 and the last one goes on
+    forever. This has 3 clear benefits:
+        1)  Looking up the annotations at a position is a binary search,
+            O(log n) for n changes, and those of a range of k runs take
+            O(log n + k).
+        2)  Overlapping or adjacent annotations with the same name and value
+            need no resolving: runs that end up with the same annotations
+            are merged as they are annotated.
+        3)  Annotating a range only touches the runs in that range.
+
+    Ranges are half open, like those of an Annotation: (1, 3) covers the
+    positions 1 and 2.
+    """
     def __init__(self):
-        """Creates a set to contain the annotations."""
-        self._data = set()
-
-
-    def _resolve_pair(self, annotation_1, annotation_2):
-        if annotation_2.end < annotation_1.end:
-            # If the annotations are in the wrong order, swap them.
-            a1 = annotation_2
-            annotation_2 = annotation_1
-            annotation_1 = a1
-            del a1
-
-        if annotation_2.start < annotation_1.end: #If there is an overlap
-            # test: end of 1 >= start of another. Simplest overlap.
-            if annotation_1.end >= annotation_2.start:
-                new_annotation = Annotation(start = annotation_1.start,
-                                            end = annotation_2.end,
-                                            name = annotation_1.name,
-                                            value = annotation_1.value)
-                self._data.symmetric_difference_update(set((annotation_1,
-                                                            annotation_2,
-                                                            new_annotation)))
-                return new_annotation
-            elif ((annotation_2.start <= annotation_1.start) and
-                  (annotation_1.end <= annotation_2.end)):
-                # If annotation 1 is completely contained by annotation 2:
-                self._data.remove(annotation_1)
-                return annotation_2
-        # If the 2 annotations do not match any scenarios, raise an exception
-        # If this exception is raised, report to me: nat.abbotts@gmail.com
-        # and I will update the code to account for the new situation.
-        # This is because I cannot see any other possibility.
-        raise Exception("Cannot resolve")
+        """Creates a map with no annotations."""
+        self._starts = [0]
+        self._values = [{}]
+
     def resolve(self):
         """Resolve all stored annotations.
 
-        If two annotations overlap, and hold the same name and value,
-            they are replaced with a single annotation.
+        Kept for compatibility: overlapping annotations with the same name and
+        value are merged as they are made, so there is nothing left to do.
         """
-        for annotation_1 in self._data:
-            for annotation_2 in self._data:
-                if annotation_1 == annotation_2:
+        pass
+
+    def annotate(self, start, end, name, value):
+        """Sets the annotation 'name' to 'value' from start up to end.
+
+        A value of None removes the annotation from the range instead. The
+        runs around the range are rebuilt in one go, so both arrays are only
+        spliced once per call, however many boundaries it adds or removes.
+        """
+        if start >= end:
+            return
+        first = bisect.bisect_right(self._starts, start) - 1
+        last = bisect.bisect_right(self._starts, end) - 1
+        # Rebuild the runs in the range and the ones on either side of it,
+        # merging the runs that end up with the same annotations.
+        low = max(first - 1, 0)
+        high = min(last + 2, len(self._starts))
+        starts = []
+        merged = []
+        for i in xrange(low, high):
+            run_start = self._starts[i]
+            run_end = None
+            if i + 1 < len(self._starts):
+                run_end = self._starts[i + 1]
+            cuts = [run_start]
+            for pos in (start, end):
+                if run_start < pos and (run_end is None or pos < run_end):
+                    cuts.append(pos)
+            for pos in cuts:
+                values = self._values[i]
+                if start <= pos < end:
+                    values = values.copy()
+                    if value is None:
+                        values.pop(name, None)
+                    else:
+                        values[name] = value
+                elif pos != run_start:
+                    values = values.copy()
+                if merged and merged[-1] == values:
                     continue
-                elif ((annotation_2.start < annotation_1.end) or
-                      (annotation_1.start < annotation_2.end)):
-                    self._resolve_pair(annotation_1, annotation_2)
+                starts.append(pos)
+                merged.append(values)
+        self._starts[low:high] = starts
+        self._values[low:high] = merged
 
+    def clear(self, start, end, name):
+        """Removes the annotation 'name' from start up to end."""
+        self.annotate(start, end, name, None)
 
+    def runs(self, start, end):
+        """Return a list of (start, end, annotations) tuples for a range.
+
+        The runs are clipped to the range, and 'annotations' is a dictionary
+        of name:value pairs. Runs without annotations are included, so the
+        runs cover the whole range.
+        """
+        output = []
+        i = bisect.bisect_right(self._starts, start) - 1
+        count = len(self._starts)
+        while i < count and self._starts[i] < end:
+            if i + 1 < count:
+                run_end = min(self._starts[i + 1], end)
+            else:
+                run_end = end
+            output.append((max(self._starts[i], start), run_end,
+                           dict(self._values[i])))
+            i += 1
+        return output
 
-    def _add_annotation(self, annotation):
-        for current_annotation in self._data:
-            if ((current_annotation.start < annotation.end) or
-                (annotation.start < current_annotation.end)):
-                annotation = self._resolve_pair(annotation, current_annotation)
-    def annotate(self, start, end, name, value):
-        self._add_annotation(Annotation(start = start,
-                                        end = end,
-                                        name = name,
-                                        value = value))
     # ------------------------ BoilerPlate Methods ----------------------------
     def copy(self):
-        return self._data.copy()
+        """Return an independent copy of the map."""
+        other = Annotations()
+        other._starts = list(self._starts)
+        other._values = [values.copy() for values in self._values]
+        return other
 
     def __getitem__(self, pos):
         """Return a list of tuples containing all the annotations at pos.
 
-        For instance, if our annotation list was:
+        For instance, if our annotations were:
         [(2,4, 'font', 'arial'),
          (2,5, 'color', 'red'),
          (1,3, 'size', '2em'),]
 
-        Then getitem() would return the following for each call:
+        Then getitem() would return the following for each call (in any
+        order):
         getitem(0)
             []
         getitem(1)
@@ -275,19 +305,13 @@ class Annotations(object):
         getitem(2)
             [('font', 'arial'), ('color', 'red'), ('size', '2em')]
         getitem(3)
-            [('font', 'arial'), ('color', 'red'), ('size', '2em')]
-        getitem(4)
             [('font', 'arial'), ('color', 'red')]
+        getitem(4)
+            [('color', 'red')]
         getitem(5)
-            [(2,5, 'color', 'red')]
-        getitem(6)
             []
         """
-        output = []
-        for i in self._data:
-            if i.start <= pos <= i.end:
-                output.append(i)
-        return output
+        return self._values[bisect.bisect_right(self._starts, pos) - 1].items()
     def __setitem__(self, pos, value):
         """Create an annotation at a single position.
 
@@ -299,47 +323,65 @@ class Annotations(object):
         if len(value) != 2:
             # raise exeption?
             return
-        self._data.append(Annotation(pos, pos, *value))
+        self.annotate(pos, pos + 1, *value)
     # delitem is not supported, because there is no apparent use-case for
     # deleting all annotations from a single position.
     # If you have a use case, please file an issue at
     # github.com/natabbotts/PyTide
 
     def __contains__(self, value):
-        if isinstance(value, Annotation): # If value is an annotation
-            return value in self._data
-        elif len(value) == 4: # If value can be turned into an annotation
+        """Return whether an annotation, or a (start, end, name, value) tuple,
+        applies to the whole of its range."""
+        if not isinstance(value, Annotation):
+            if len(value) != 4:
+                return False
             value = Annotation(*value)
-            return value in self._data
-        else:
-            return False
+        for start, end, values in self.runs(value.start, value.end):
+            if values.get(value.name) != value.value:
+                return False
+        return value.start < value.end
     def __iter__(self):
-        for ann in self._data:
-            yield ann
+        """Yield an Annotation for every range of an annotation name and value.
+
+        The ranges are as long as they can be, and come out ordered by their
+        end.
+        """
+        open_annotations = {}
+        for i in xrange(len(self._starts)):
+            values = self._values[i]
+            for name, value in open_annotations.items():
+                if values.get(name) != value[0]:
+                    del open_annotations[name]
+                    yield Annotation(value[1], self._starts[i], name, value[0])
+            for name, value in values.iteritems():
+                if name not in open_annotations:
+                    open_annotations[name] = (value, self._starts[i])
 
     def __getslice__(self, start, end):
-        x = []
-        for i in range(start, end):
-            x.append(self.__getitem__(i))
-        return list(set(x))
+        """Return the runs of annotations from start up to end, see runs()."""
+        return self.runs(start, end)
     def __setslice__(self, start, end, annotation):
-        # There is *technically* no need for the first if clause, but
-        # isinstance() is faster than "__iter__" in dir(annotation),
-        # and as a tuple is most likely what will be called, it was decided
-        # that two clauses are used.
-        if isinstance(annotation, tuple) and (len(annotation == 2)):
-            annotate(start, end, *annotation)
-            return
-        elif (len(annotation) == 2) and ("__iter__" in dir(annotation)):
-            annotate(start, end, *annotation)
+        """Annotate from start up to end with a (name, value) tuple."""
+        if len(annotation) == 2:
+            self.annotate(start, end, *annotation)
 
 
 
-class BlipDocument(deque):
+class BlipDocument(object):
     """Models the document section of a blip, containing all text and elements.
 
+    The document is a gap buffer: a cursor sits between two lists, one with
+    the items before the cursor in order, and one with the items after it in
+    reverse order. Operations work at the cursor, by moving items between the
+    ends of the two lists, so each costs time in proportion to the number of
+    items it covers, however long the document is.
+
+    Every item carries the annotations it was inserted with. These are kept
+    as runs of equal annotations alongside the items, and move with them.
+
     Methods:
-        retain(value) - Impliments the RETAIN operation, via the rotate method.
+        retain(value) - Impliments the RETAIN operation, moving the cursor
+            'value' items forward (or backward, if 'value' is negative).
 
             'value' should be a number.
 
@@ -367,36 +409,62 @@ class BlipDocument(deque):
             'value' should be a number.
 
 
-        fix_rotation() - Returns the blip to it's original order, so that text
-            and elements are in the right place.
+        fix_rotation() - Moves the cursor back to the start of the document.
 
         complete() - Calls 'fix_rotation()' then returns itself.
 
+        annotation_runs() - Returns a list of (start, end, annotations) tuples
+            covering the document, in order.
+
+    Iterating over the document yields all of its items in order, wherever
+    the cursor is.
     """
 
     def __init__(self):
         """Sets up the BlipDocument object. Do not pass values. """
-        super(BlipDocument, self).__init__()
-        self.annotations = Annotations()
-        self.rotation = 0
+        # The items before the cursor, and those after it, last one first.
+        self._before = []
+        self._after = []
+        # [annotations, length] runs of the items in the lists above, in the
+        # same order as the items.
+        self._before_runs = []
+        self._after_runs = []
 
     def __str__(self):
-        """Returns string form of the current rotation of itself."""
+        """Returns string form of the whole document."""
         return ''.join(self)
 
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    def __iter__(self):
+        for item in self._before:
+            yield item
+        for item in reversed(self._after):
+            yield item
+
+    @property
+    def position(self):
+        """The position of the cursor, as the number of items before it."""
+        return len(self._before)
+
     def fix_rotation(self):
-        """Corrects the rotation that was created by different operations,
-        so that the blip is now in readable form, with the first element first.
-        """
-        self.rotate(self.rotation)
-        self.annotations.rotate(self.rotation)
-        self.rotation = 0
+        """Moves the cursor back to the start of the document."""
+        self.retain(-len(self._before))
 
     def retain(self, value):
         """A retain operation. Value should be an integer."""
-        self.rotation += value
-        self.rotate(-value)
-        self.annotations.rotate(-value)
+        if value >= 0:
+            if value > len(self._after):
+                raise ValueError('Cannot retain past the end of the document')
+            self._move(value, self._after, self._after_runs,
+                       self._before, self._before_runs)
+        else:
+            if -value > len(self._before):
+                raise ValueError('Cannot retain past the start of the '
+                                 'document')
+            self._move(-value, self._before, self._before_runs,
+                       self._after, self._after_runs)
 
     def insert_characters(self, value, annotations = None):
         """An insert operation, to add characters.
@@ -408,10 +476,10 @@ class BlipDocument(deque):
         to be applied to all inserted characters. Alternatively, a list of
         2 item tuples "(key, value)" can be used.
         """
-        self.extend(value)
-        if self.rotation != 0:
-            self.rotation += len(value)
-        self.annotations.extend(len(value), annotations)
+        count = len(self._before)
+        self._before.extend(value)
+        self._add_run(self._before_runs, _annotation_key(annotations),
+                      len(self._before) - count)
 
     def insert(self, value, annotations = None):
         """Inserts a single element at the current position.
@@ -420,22 +488,82 @@ class BlipDocument(deque):
         'annotations' should be a dictionary of annotation key:value pairs.
         Alternatively, a list of 2 item tuples (key,value) can be used.
         """
-        self.append(value)
-        self.annotations.append(annotations)
-        if self.rotation != 0:
-            self.rotation += 1
+        self._before.append(value)
+        self._add_run(self._before_runs, _annotation_key(annotations), 1)
 
     def delete(self, value):
         """Delete 'value' items after the current position."""
-        for i in range(value):
-            self.popleft()
-        self.annotations.popleft()
-
-    def complete(self): #lol
+        if value > len(self._after):
+            raise ValueError('Cannot delete past the end of the document')
+        if value <= 0:
+            return
+        del self._after[-value:]
+        runs = self._after_runs
+        while value:
+            run = runs[-1]
+            if run[1] > value:
+                run[1] -= value
+                break
+            value -= run[1]
+            runs.pop()
+
+    def complete(self):
         """Calls 'fix_rotation()' then returns itself."""
         self.fix_rotation()
         return self
 
+    def annotation_runs(self):
+        """Returns a list of (start, end, annotations) tuples, in order.
+
+        Together the runs cover the whole document. 'annotations' is a
+        dictionary of the annotations of the items from start up to end.
+        """
+        runs = []
+        start = 0
+        for key, length in self._before_runs + self._after_runs[::-1]:
+            if runs and runs[-1][2] == key:
+                # A run split by the cursor.
+                runs[-1][1] += length
+            else:
+                runs.append([start, start + length, key])
+            start += length
+        return [(start, end, dict(key)) for start, end, key in runs]
+
+    def _move(self, count, source, source_runs, target, target_runs):
+        """Moves count items, and their runs, from the end of source to
+        the end of target."""
+        if not count:
+            return
+        target.extend(source[:-count - 1:-1])
+        del source[-count:]
+        while count:
+            run = source_runs[-1]
+            length = min(count, run[1])
+            self._add_run(target_runs, run[0], length)
+            if length == run[1]:
+                source_runs.pop()
+            else:
+                run[1] -= length
+            count -= length
+
+    def _add_run(self, runs, key, length):
+        if not length:
+            return
+        if runs and runs[-1][0] == key:
+            runs[-1][1] += length
+        else:
+            runs.append([key, length])
+
+
+def _annotation_key(annotations):
+    """Returns annotations, a dictionary or a list of (key, value) tuples, as
+    a sorted tuple that can be compared cheaply."""
+    if not annotations:
+        return ()
+    if isinstance(annotations, dict):
+        annotations = annotations.items()
+    return tuple(sorted(annotations))
+
 class Contributors(list):
     """A list containing users. Users cannot be removed or rearranged."""
     def __delitem__(self, arg):
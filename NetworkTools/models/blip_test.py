@@ -0,0 +1,169 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+"""Unit tests for the blip module."""
+
+import random
+import unittest
+
+import blip
+
+
+class TestBlipDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = blip.BlipDocument()
+
+    def testInsertAtCursor(self):
+        self.doc.insert_characters('held')
+        self.doc.retain(-2)
+        self.doc.insert_characters('llo wor')
+        self.assertEquals(9, self.doc.position)
+        self.assertEquals('hello world', str(self.doc.complete()))
+        self.assertEquals(0, self.doc.position)
+
+    def testNonAsciiContent(self):
+        self.doc.insert_characters(u'caf\xe9')
+        self.doc.retain(-1)
+        self.doc.insert_characters(u'\u2014')
+        self.assertEquals(u'caf\u2014\xe9', self.doc.__str__())
+        self.assertEquals(u'caf\u2014\xe9', unicode(self.doc))
+
+    def testDelete(self):
+        self.doc.insert_characters('hello world')
+        self.doc.retain(-11)
+        self.doc.retain(5)
+        self.doc.delete(6)
+        self.doc.insert('!')
+        self.assertEquals(['h', 'e', 'l', 'l', 'o', '!'],
+                          list(self.doc.complete()))
+        self.assertRaises(ValueError, self.doc.delete, 7)
+        self.assertRaises(ValueError, self.doc.retain, 7)
+        self.assertRaises(ValueError, self.doc.retain, -1)
+
+    def testAnnotationRunsMoveWithItems(self):
+        self.doc.insert_characters('plain ')
+        self.doc.insert_characters('bold', {'style/fontWeight': 'bold'})
+        self.doc.retain(-2)
+        self.doc.insert_characters('xx', [('style/fontWeight', 'bold')])
+        self.doc.retain(-5)
+        self.doc.delete(3)
+        self.assertEquals('plainxxld', str(self.doc))
+        self.assertEquals([(0, 5, {}),
+                           (5, 9, {'style/fontWeight': 'bold'})],
+                          self.doc.annotation_runs())
+
+    def testRandomOperationsMatchList(self):
+        rand = random.Random(42)
+        expected = []
+        expected_annotations = []
+        cursor = 0
+        for i in range(2000):
+            choice = rand.random()
+            if choice < 0.4:
+                text = 'abc'[:rand.randint(1, 3)]
+                annotations = rand.choice([None, {'a': '1'}, {'a': '2'}])
+                self.doc.insert_characters(text, annotations)
+                expected[cursor:cursor] = list(text)
+                expected_annotations[cursor:cursor] = (
+                    [annotations or {}] * len(text))
+                cursor += len(text)
+            elif choice < 0.7:
+                count = rand.randint(-cursor, len(expected) - cursor)
+                self.doc.retain(count)
+                cursor += count
+            else:
+                count = rand.randint(0, min(3, len(expected) - cursor))
+                self.doc.delete(count)
+                del expected[cursor:cursor + count]
+                del expected_annotations[cursor:cursor + count]
+            self.assertEquals(cursor, self.doc.position)
+        self.assertEquals(expected, list(self.doc))
+        annotations = []
+        for start, end, values in self.doc.annotation_runs():
+            annotations.extend([values] * (end - start))
+        self.assertEquals(expected_annotations, annotations)
+
+
+class TestAnnotations(unittest.TestCase):
+
+    def setUp(self):
+        self.annotations = blip.Annotations()
+
+    def testLookups(self):
+        self.annotations.annotate(2, 4, 'font', 'arial')
+        self.annotations.annotate(2, 5, 'color', 'red')
+        self.annotations.annotate(1, 3, 'size', '2em')
+        self.assertEquals([], self.annotations[0])
+        self.assertEquals([('size', '2em')], self.annotations[1])
+        self.assertEquals([('color', 'red'), ('font', 'arial'),
+                           ('size', '2em')], sorted(self.annotations[2]))
+        self.assertEquals([('color', 'red')], self.annotations[4])
+        self.assertEquals([], self.annotations[5])
+        self.assertEquals([(3, 4, {'font': 'arial', 'color': 'red'}),
+                           (4, 5, {'color': 'red'}),
+                           (5, 7, {})], self.annotations[3:7])
+        self.assertTrue((2, 5, 'color', 'red') in self.annotations)
+        self.assertFalse((2, 6, 'color', 'red') in self.annotations)
+
+    def testEqualRunsAreMerged(self):
+        self.annotations.annotate(0, 3, 'style', 'bold')
+        self.annotations.annotate(5, 8, 'style', 'bold')
+        self.annotations.annotate(2, 6, 'style', 'bold')
+        self.annotations[8] = ('style', 'bold')
+        self.assertEquals([0, 9], self.annotations._starts)
+        self.assertEquals(['Annotation((0 : 9) = "style", "bold")'],
+                          [repr(a) for a in self.annotations])
+        self.annotations.clear(0, 9, 'style')
+        self.assertEquals([0], self.annotations._starts)
+
+    def testSplitRunsDontShareAnnotations(self):
+        self.annotations.annotate(0, 10, 'style', 'bold')
+        self.annotations.annotate(3, 6, 'color', 'red')
+        self.assertEquals([0, 3, 6, 10], self.annotations._starts)
+        self.assertEquals(4, len(set(map(id, self.annotations._values))))
+        self.annotations.annotate(7, 8, 'size', '2em')
+        self.assertEquals([{'style': 'bold'}, {'style': 'bold', 'color': 'red'},
+                           {'style': 'bold'}, {'style': 'bold', 'size': '2em'},
+                           {'style': 'bold'}, {}], self.annotations._values)
+
+    def testRandomAnnotationsMatchList(self):
+        rand = random.Random(7)
+        expected = [{} for i in range(60)]
+        for i in range(500):
+            start = rand.randint(0, 59)
+            end = rand.randint(start, 60)
+            name = rand.choice('ab')
+            value = rand.choice(['1', '2', None])
+            self.annotations.annotate(start, end, name, value)
+            for pos in range(start, end):
+                if value is None:
+                    expected[pos].pop(name, None)
+                else:
+                    expected[pos][name] = value
+        self.assertEquals(expected,
+                          [dict(self.annotations[pos]) for pos in range(60)])
+        for start, end, values in self.annotations[0:60]:
+            self.assertEquals([values] * (end - start), expected[start:end])
+        for i in range(1, len(self.annotations._values)):
+            self.assertNotEqual(self.annotations._values[i - 1],
+                                self.annotations._values[i])
+        for annotation in self.annotations:
+            for pos in range(annotation.start, annotation.end):
+                self.assertEquals(annotation.value,
+                                  expected[pos][annotation.name])
+
+
+if __name__ == '__main__':
+    unittest.main()
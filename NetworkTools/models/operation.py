@@ -17,232 +17,622 @@
 #    limitations under the License.
 #
 
+import array
 import datetime
+import struct
+import sys
+import time
 from collections import deque
 # ---- Ops -----
-RETAIN = 'RETAIN'
-INSERT = 'INSERT'
-DELETE = 'DELETE'
+RETAIN = 'RETAIN'
+INSERT = 'INSERT'
+DELETE = 'DELETE'
 # --------------
+# Queued operations past which an OperationQueue composes them into one.
+COMPOSE_THRESHOLD = 64
 class Operation(object):
-	def __init__(self, timestamp = None):
-		if not timestamp:
-                        timestamp = datetime.datetime.now()
+    """A document operation.
+
+    An operation is a list of components that walk over a document from its
+    start to its end. Each component is a tuple of its type and argument:
+        (RETAIN, count) - skips 'count' items, leaving them as they are.
+        (INSERT, text)  - inserts 'text', a string or a list of items.
+        (DELETE, count) - deletes the next 'count' items.
+
+    The components are kept normalized: there are no empty components,
+    neighbouring components of the same type are merged, and an insert never
+    directly follows a delete. Operations with the same effect therefore have
+    the same components, and compare equal.
+
+    base_length is the length of the documents the operation applies to, and
+    target_length the length of the documents it makes.
+    """
+    def __init__(self, components = None, timestamp = None):
+        if not timestamp:
+            timestamp = datetime.datetime.now()
+        self.timestamp = timestamp
+        self.components = []
+        self.base_length = 0
+        self.target_length = 0
+        if components:
+            for type, arg in components:
+                self.add(type, arg)
+
+    def __repr__(self):
+        return 'Operation(%r)' % (self.components,)
+
+    def __eq__(self, other):
+        return (isinstance(other, Operation) and
+                self.components == other.components)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def retain(self, count):
+        """Adds a retain of 'count' items, and returns the operation."""
+        return self.add(RETAIN, count)
+
+    def insert(self, text):
+        """Adds an insert of 'text', and returns the operation."""
+        return self.add(INSERT, text)
+
+    def delete(self, count):
+        """Adds a delete of 'count' items, and returns the operation."""
+        return self.add(DELETE, count)
+
+    def add(self, type, arg):
+        """Adds a component to the end of the operation, keeping the
+        components normalized. Returns the operation."""
+        if type == INSERT:
+            if not len(arg):
+                return self
+            self.target_length += len(arg)
+            components = self.components
+            if components and components[-1][0] == DELETE:
+                # Inserts go before deletes, which has the same effect.
+                if len(components) > 1 and components[-2][0] == INSERT:
+                    components[-2] = (INSERT, components[-2][1] + arg)
+                else:
+                    components.insert(len(components) - 1, (INSERT, arg))
+                return self
+        elif type == RETAIN or type == DELETE:
+            if arg < 0:
+                raise ValueError('Negative %s count: %d' % (type, arg))
+            if not arg:
+                return self
+            self.base_length += arg
+            if type == RETAIN:
+                self.target_length += arg
+        else:
+            raise ValueError('Unknown component type: %r' % (type,))
+        if self.components and self.components[-1][0] == type:
+            self.components[-1] = (type, self.components[-1][1] + arg)
+        else:
+            self.components.append((type, arg))
+        return self
+
+    def apply(self, document):
+        """Applies the operation to a blip.BlipDocument, from its start.
+
+        Raises:
+            ValueError: if the document isn't base_length items long.
+        """
+        if len(document) != self.base_length:
+            raise ValueError('Operation applies to %d items, not %d' %
+                             (self.base_length, len(document)))
+        document.fix_rotation()
+        for type, arg in self.components:
+            if type == RETAIN:
+                document.retain(arg)
+            elif type == INSERT:
+                document.insert_characters(arg)
+            else:
+                document.delete(arg)
+        return document.complete()
+
+    def apply_text(self, text):
+        """Returns the string, or list, that the operation makes of 'text'.
+
+        Raises:
+            ValueError: if 'text' isn't base_length items long.
+        """
+        if len(text) != self.base_length:
+            raise ValueError('Operation applies to %d items, not %d' %
+                             (self.base_length, len(text)))
+        pieces = []
+        pos = 0
+        for type, arg in self.components:
+            if type == RETAIN:
+                pieces.append(text[pos:pos + arg])
+                pos += arg
+            elif type == INSERT:
+                pieces.append(arg)
+            else:
+                pos += arg
+        if isinstance(text, basestring):
+            return text[:0].join(pieces)
+        output = []
+        for piece in pieces:
+            output.extend(piece)
+        return output
+
+
+def transform(op1, op2):
+    """Transforms two concurrent operations against each other.
+
+    op1 and op2 apply to the same document. Returns a tuple (op1', op2') of
+    new operations, such that applying op1 then op2' gives the same document
+    as applying op2 then op1'. When both insert at the same place, the text
+    of op1 ends up first, so op1 should be the one the server saw first.
+
+    The components of both operations are zipped in one pass, so this takes
+    time in proportion to the number of components. op1 and op2 are left as
+    they are.
+
+    Raises:
+        ValueError: if the operations don't apply to documents of the same
+            length.
+    """
+    if op1.base_length != op2.base_length:
+        raise ValueError('Cannot transform operations on %d and %d items' %
+                         (op1.base_length, op2.base_length))
+    out1 = Operation()
+    out2 = Operation()
+    components1 = op1.components
+    components2 = op2.components
+    i = j = 0
+    # The component each operation is at, and how much of it is left.
+    type1 = arg1 = type2 = arg2 = None
+    while True:
+        if type1 is None and i < len(components1):
+            type1, arg1 = components1[i]
+            i += 1
+        if type2 is None and j < len(components2):
+            type2, arg2 = components2[j]
+            j += 1
+        if type1 is None and type2 is None:
+            break
+        if type1 == INSERT:
+            out1.insert(arg1)
+            out2.retain(len(arg1))
+            type1 = None
+            continue
+        if type2 == INSERT:
+            out1.retain(len(arg2))
+            out2.insert(arg2)
+            type2 = None
+            continue
+        # Both retain or delete the same items, as far as the shorter goes.
+        count = min(arg1, arg2)
+        if type1 == RETAIN:
+            if type2 == RETAIN:
+                out1.retain(count)
+                out2.retain(count)
+            else:
+                out2.delete(count)
+        elif type2 == RETAIN:
+            out1.delete(count)
+        # Items both delete are gone from both documents already.
+        arg1 -= count
+        arg2 -= count
+        if not arg1:
+            type1 = None
+        if not arg2:
+            type2 = None
+    return out1, out2
+
+def compose(op1, op2):
+    """Composes two consecutive operations into one.
+
+    op2 applies to the documents op1 makes. Returns a new operation that
+    makes the same document of what op1 applies to as applying op1, then
+    op2. Like transform, this zips the components of both operations in one
+    pass and leaves them as they are.
+
+    Raises:
+        ValueError: if op2 doesn't apply to the documents op1 makes.
+    """
+    if op1.target_length != op2.base_length:
+        raise ValueError('Cannot compose an operation making %d items with '
+                         'one on %d items' %
+                         (op1.target_length, op2.base_length))
+    out = Operation(timestamp = op2.timestamp)
+    components1 = op1.components
+    components2 = op2.components
+    i = j = 0
+    type1 = arg1 = type2 = arg2 = None
+    while True:
+        if type1 is None and i < len(components1):
+            type1, arg1 = components1[i]
+            i += 1
+        if type2 is None and j < len(components2):
+            type2, arg2 = components2[j]
+            j += 1
+        if type1 is None and type2 is None:
+            break
+        if type1 == DELETE:
+            # Deleted items are gone before op2 sees the document.
+            out.delete(arg1)
+            type1 = None
+            continue
+        if type2 == INSERT:
+            out.insert(arg2)
+            type2 = None
+            continue
+        # op2 retains or deletes what op1 retained or inserted.
+        if type1 == INSERT:
+            count = min(len(arg1), arg2)
+            if type2 == RETAIN:
+                out.insert(arg1[:count])
+            # An insert that is deleted again leaves nothing.
+            arg1 = arg1[count:]
+            if not len(arg1):
+                type1 = None
+        else:
+            count = min(arg1, arg2)
+            if type2 == RETAIN:
+                out.retain(count)
+            else:
+                out.delete(count)
+            arg1 -= count
+            if not arg1:
+                type1 = None
+        arg2 -= count
+        if not arg2:
+            type2 = None
+    return out
+
 
-	def apply(document):
-		pass
-	    
 class OperationQueue(deque):
     """A queue of Operation objects
 
     When instantiating, you can provide any number of Operation instances as
-    operations."""
-    def __init__(self, position = 0, *args): #(self, wavelet, *args, position)
+    operations.
+
+    Once more than 'compose_threshold' operations wait to be sent, appending
+    one composes them into a single operation, so a backlog of keystrokes
+    costs as much to transform and send as the change they make together.
+    Call mark_sent() when sending operations; the first 'sent' operations
+    of the queue wait for an ack, and are never composed with others.
+    Taking them off the queue with popleft() counts them as acked."""
+    def __init__(self, position = 0, *args, **kwargs): #(self, wavelet, *args, position)
         """Creates an Operation Queue.
         
         *args should all be Operation objects, which will be added to the queue
             in sequential order.
+        'compose_threshold' can be given as a keyword argument, None to never
+            compose automatically.
         """
-        super(OperationQueue, self).__init__(args)
+        super(OperationQueue, self).__init__()
         self.position = position
+        self.compose_threshold = kwargs.get('compose_threshold',
+                                            COMPOSE_THRESHOLD)
+        self.sent = 0
+        self.extend(args)
         # Note that this operation queue does not have a wavelet attribute - 
         # that is because I believe that a wavelet should have an opqueue, 
         # not the reverse. This will be discussed elsewhere though.
-    def append(self, position, operation, arg):
-        op = Operation(position, operation, arg)
-        super(self.__class__, self).append(op)
-
-
-
-
-# Just a note to anyone modifying this - unless you've fully tested any code
-# you put in the '- Transform against X -' sections, as it is really
-# important that no slip-ups happen with them, as it will be likely to go
-# unnoticed.
-#                                  --THANKS!--
-#
-# Note this will not apply once the testing code is written to check these :)
-
-class Transform(object):
-    """Transforms/Zips two operation queuesinto one, to be applied by the
+    def append(self, operation):
+        """Adds an Operation to the end of the queue."""
+        super(OperationQueue, self).append(operation)
+        if (self.compose_threshold is not None and
+            len(self) - self.sent > self.compose_threshold):
+            self.compose()
+    def extend(self, operations):
+        """Adds Operations to the end of the queue, in order."""
+        for operation in operations:
+            self.append(operation)
+    def popleft(self):
+        """Takes the first Operation off the queue, and returns it."""
+        operation = super(OperationQueue, self).popleft()
+        if self.sent:
+            self.sent -= 1
+        return operation
+    def clear(self):
+        """Removes all Operations from the queue."""
+        super(OperationQueue, self).clear()
+        self.sent = 0
+    def mark_sent(self, count = None):
+        """Marks the first 'count' Operations, all by default, as sent."""
+        if count is None:
+            count = len(self)
+        self.sent = max(self.sent, min(count, len(self)))
+    def compose(self):
+        """Composes the Operations that weren't sent into one, and returns it.
+
+        Returns None if there are no such Operations.
+        """
+        pending = []
+        while len(self) > self.sent:
+            pending.append(self.pop())
+        if not pending:
+            return None
+        composed = pending.pop()
+        while pending:
+            composed = compose(composed, pending.pop())
+        super(OperationQueue, self).append(composed)
+        return composed
+
+
+
+
+# Component types by their code in a PackedOperations, and the reverse.
+_PACKED_TYPES = (RETAIN, INSERT, DELETE)
+_PACKED_CODES = {RETAIN: 0, INSERT: 1, DELETE: 2}
+# A typecode for arrays of 4 byte integers, which all platforms have.
+_INT32 = [code for code in 'ilh' if array.array(code).itemsize == 4][0]
+# Magic, version, operations, components, pool strings, pool bytes.
+_PACKED_HEADER = struct.Struct('<4sBIIII')
+_PACKED_MAGIC = 'PKOP'
+_PACKED_VERSION = 1
+
+class PackedOperations(object):
+    """A compact, append only list of operations, e.g. a wavelet history.
+
+    Rather than an Operation object and a tuple per component, the
+    operations are kept in a few arrays: the type of every component in a
+    byte, and its count (or for inserts, the index of its text) in a 4 byte
+    integer, plus the index of the first component and the timestamp of
+    every operation. Inserted text is interned in a pool of strings, so
+    repeated keystrokes are stored once.
+
+    Indexing or iterating gives OperationView objects, which read the
+    components from the arrays as they are iterated. tostring() and write()
+    copy the arrays out as they are, and fromstring() and read() back in,
+    without building any Operation.
+
+    Only inserts of text can be packed. Text read back from a string comes
+    back as unicode, unless it is plain ASCII.
+    """
+    def __init__(self, operations = ()):
+        self._starts = array.array(_INT32)
+        self._timestamps = array.array('d')
+        self._types = array.array('B')
+        self._args = array.array(_INT32)
+        self._pool = []
+        self._pool_index = {}
+        self.extend(operations)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._starts)
+        if not 0 <= index < len(self._starts):
+            raise IndexError('PackedOperations index out of range')
+        return OperationView(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self._starts)):
+            yield OperationView(self, index)
+
+    def append(self, operation):
+        """Packs an Operation, or anything with components and a timestamp."""
+        components = list(operation.components)
+        # Check everything first, so a failed append leaves no trace.
+        for type, arg in components:
+            if type == INSERT and not isinstance(arg, basestring):
+                raise TypeError('Only inserts of text can be packed')
+        timestamp = _seconds(operation.timestamp)
+        types = self._types
+        args = self._args
+        self._starts.append(len(types))
+        self._timestamps.append(timestamp)
+        for type, arg in components:
+            if type == INSERT:
+                index = self._pool_index.get(arg)
+                if index is None:
+                    index = self._pool_index[arg] = len(self._pool)
+                    self._pool.append(arg)
+                arg = index
+            types.append(_PACKED_CODES[type])
+            args.append(arg)
+
+    def extend(self, operations):
+        """Packs Operations, in order."""
+        for operation in operations:
+            self.append(operation)
+
+    def component_count(self):
+        """Returns the number of components of all operations."""
+        return len(self._types)
+
+    def _components(self, index):
+        """Yields the components of the operation at index."""
+        start = self._starts[index]
+        if index + 1 < len(self._starts):
+            end = self._starts[index + 1]
+        else:
+            end = len(self._types)
+        types = self._types
+        args = self._args
+        pool = self._pool
+        for i in xrange(start, end):
+            code = types[i]
+            if code == 1:
+                yield INSERT, pool[args[i]]
+            else:
+                yield _PACKED_TYPES[code], args[i]
+
+    # ------------------------ Serialization ----------------------------------
+    def tostring(self):
+        """Returns the operations packed in a string, see fromstring."""
+        texts = []
+        for text in self._pool:
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            texts.append(text)
+        lengths = array.array(_INT32, [len(text) for text in texts])
+        pool = ''.join(texts)
+        arrays = [self._starts, self._timestamps, self._types, self._args,
+                  lengths]
+        if sys.byteorder == 'big':
+            arrays = [array.array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        return ''.join([_PACKED_HEADER.pack(_PACKED_MAGIC, _PACKED_VERSION,
+                                            len(self._starts),
+                                            len(self._types),
+                                            len(self._pool), len(pool))] +
+                       [a.tostring() for a in arrays] + [pool])
+
+    def write(self, file):
+        """Writes the operations to a file, see tostring."""
+        file.write(self.tostring())
+
+    @classmethod
+    def fromstring(cls, data):
+        """Returns the PackedOperations in a string made by tostring.
+
+        Raises:
+            ValueError: if data isn't such a string.
+        """
+        if len(data) < _PACKED_HEADER.size:
+            raise ValueError('Truncated packed operations')
+        (magic, version, operations, components, strings,
+         pool_size) = _PACKED_HEADER.unpack_from(data)
+        if magic != _PACKED_MAGIC or version != _PACKED_VERSION:
+            raise ValueError('Not packed operations, or an unknown version')
+        packed = cls()
+        pos = _PACKED_HEADER.size
+        lengths = array.array(_INT32)
+        for a, count in ((packed._starts, operations),
+                         (packed._timestamps, operations),
+                         (packed._types, components),
+                         (packed._args, components),
+                         (lengths, strings)):
+            end = pos + count * a.itemsize
+            if end > len(data):
+                raise ValueError('Truncated packed operations')
+            a.fromstring(data[pos:end])
+            if sys.byteorder == 'big':
+                a.byteswap()
+            pos = end
+        if pos + pool_size != len(data):
+            raise ValueError('Packed operations of the wrong size')
+        for length in lengths:
+            text = data[pos:pos + length].decode('utf-8')
+            try:
+                text = str(text)
+            except UnicodeError:
+                pass
+            packed._pool_index[text] = len(packed._pool)
+            packed._pool.append(text)
+            pos += length
+        return packed
+
+    @classmethod
+    def read(cls, file):
+        """Returns the PackedOperations read from a file, see fromstring."""
+        return cls.fromstring(file.read())
+
+class OperationView(object):
+    """An operation in a PackedOperations.
+
+    Has the components, base_length, target_length and timestamp of an
+    Operation, worked out from the arrays when asked for. to_operation()
+    makes a real Operation of it.
+    """
+    __slots__ = ('_packed', '_index')
+
+    def __init__(self, packed, index):
+        self._packed = packed
+        self._index = index
+
+    def __repr__(self):
+        return 'OperationView(%r)' % (self.components,)
+
+    def __iter__(self):
+        return self._packed._components(self._index)
+
+    @property
+    def components(self):
+        return list(self)
+
+    @property
+    def base_length(self):
+        length = 0
+        for type, arg in self:
+            if type != INSERT:
+                length += arg
+        return length
+
+    @property
+    def target_length(self):
+        length = 0
+        for type, arg in self:
+            if type == RETAIN:
+                length += arg
+            elif type == INSERT:
+                length += len(arg)
+        return length
+
+    @property
+    def timestamp(self):
+        return datetime.datetime.fromtimestamp(
+            self._packed._timestamps[self._index])
+
+    def to_operation(self):
+        """Returns the operation as an Operation."""
+        return Operation(self, self.timestamp)
+
+def _seconds(timestamp):
+    """Returns a datetime as seconds since the epoch, in local time."""
+    return time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1e6
+
+
+# Just a note to anyone modifying this - the convergence of transform() is
+# checked by the randomized tests in operation_test.py. Run them after any
+# change here, as a slip-up would likely go unnoticed otherwise.
+#                                  --THANKS!--
+
+class Transform(object):
+    """Transforms/Zips two operation queuesinto one, to be applied by the
     client.
-
-    Processes 2 operation queues, transforming them against each other, then
-    outputing two queues of transformed operations.
-
-    Note that all operations from the in queues should have already been
-    executed where they originated from, but nowhere else. 
-
-    Usage #1: When you have no out queues predefined.
-    trans1, trans2 = ot.Transform(in_queue_1, in_queue_2).transform()
-
-    Usage #2: When you have 2 out queues predefined.
-    ot.Transform(queue_server, queue_client, out_queue).transform()
-    """
-    def __init__(self, queue_server, queue_client, out_queue):
-        """Sets up instance variables"""
-        self.from_server = queue_server
-        self.from_client = queue_client
-        if out_queue:
-            self.out = out_queue
-        else:
-            self.out = OperationQueue()
-    def transform(self, num = -1):
-        if num < 0:
-            # Transform all code.
-            pass
-        else:
-            # Transform 'num' number of operations & no more.
-            pass
-        # TODO: Make sure op.copy() is used so that the original op remains
-        # unchanged, so that it can be transformed against another op too.
-    # ------------------- Transform against RETAIN ----------------------------
-    def retain_retain(self, op1, op2):
-        """Transforms a retain against (after) a retain
-
-        As a retain operation doesn't actually modify text, operations after it
-        do not require transformation."""
-        if op1.position == op2.position:
-            return op1, op2
-        elif op1.position < op2.position:
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    def retain_insert(self, op1, op2):
-        """Transforms an insert against (after) a retain
-        
-        As a retain operation doesn't actually modify text, operations after it
-        do not require transformation."""
-        if op1.position == op2.position:
-            return op1, op2
-        elif op1.position < op2.position:
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    def retain_delete(self, op1, op2):
-        """Transforms a delete against (after) a retain
-
-        As a retain operation doesn't actually modify text, operations after it
-        do not require transformation."""
-        if op1.position == op2.position:
-            return op1, op2
-        elif op1.position < op2.position:
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    # ------------------- Transform against INSERT ----------------------------
-    def insert_retain(self, op1, op2):
-        """Transforms a retain against (after) an insert
-
-        If positions are identical, retain does not need transformed.
-        
-        If the retain is at a position after the insert, it's position must be
-        increased by len(op1.param).
-
-        If the retain occurs before the insert, retain does not need transformed
-        """
-        # TODO: !
-        if op1.position == op2.position:
-            return op1, op2
-        elif op1.position < op2.position:
-            op2.param += len(op1.param)
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-        # TODO: FIX ^^^THIS^^^ as we need to work out the *new* position by
-        # doing op2.position + op2.param
-    def insert_insert(self, op1, op2):
-        """Transforms an insert against (after) an insert
-
-        If the positions are identical, ????
-
-        If the 2nd insert occurs at a position after the first, it requires
-        transformation by increasing it's position by len(op1.param).
-
-        If the 2nd insert occurs at a position before the first, it does not
-        require transformation."""
-        if op1.position == op2.position:
-            #TODO: What should be done here? Do we allow them to both add
-            # text at the same point? What algorithm should be used?
-            return op1, op2
-        elif op1.position < op2.position:
-            op2.position += len(op1.param)
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    def insert_delete(self, op1, op2):
-        """Transforms a delete against (after) an insert
-        
-        If the positions are identical, increase the delete position by
-        len(op1.param).
-
-        If the delete occurs after the insert, increase the delete position by
-        len(op1.param).
-
-        If the delete occurs before the insert, it does not require a
-        transformation.
-        """
-        if op1.position == op2.position:
-            op2.position += len(op1.param)
-            return op1, op2
-        elif op1.position < op2.position:
-            op2.position += len(op1.param)
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    # ------------------- Transform against DELETE ----------------------------
-    def delete_retain(self, op1, op2):
-        """Transforms a retain against (after) a delete"""
-        # TODO: !
-        if op1.position == op2.position:
-            pass
-        elif op1.position < op2.position:
-            pass
-        elif op1.position > op2.positon:
-            pass
-        # TODO: WRITE ^^^THIS^^^ as we need to work out the *new* position by
-        # doing op2.position + op2.param
-    def delete_insert(self, op1, op2):
-        """Transforms an insert against (after) a delete
-
-        If the insert occurs at the same position as the delete, no transform
-        is required.
-
-        If the insert occurs after the delete, it needs to be transformed by
-        reducing it's position by op1.param.
-
-        If the insert occurs before the delete, no transform is required."""
-        if op1.position == op2.position:
-            return op1, op2
-        elif op1.position < op2.position:
-            op2.position -= op1.param
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
-    def delete_delete(self, op1, op2):
-        """Transforms a delete against (after) a delete
-        
-        If the operations occur at the same position:
-            And they are the same length or the 2nd is shorter, discard the 2nd
-            (reduce param to 0).
-            If the 2nd is longer, reduce op2.param to the difference in length.
-
-        If the 2nd operation occurs after the first, transform it according to
-        the following:
-            Reduce op2.position by the amount op1.param.
-            Ajust for overlap (if op1 deletes some of what op2 was going to)
-            correct this by reducing op2.param accordingly.
-        
-        If the 2nd operation occurs before the first, no transform in required.
-        """
-        if op1.position == op2.position:
-            op2.param -= op1.param
-            if op2.param < 0: op2.param = 0
-            return op1, op2
-        elif op1.position < op2.position:
-            if op1.position + op1.param > op2.position:
-                op2.param -= op1.position + op1.param - op2.position
-            op2.position -= op1.param
-            return op1, op2
-        elif op1.position > op2.positon:
-            return op1, op2
+
+    Processes 2 operation queues, transforming them against each other, then
+    outputing two queues of transformed operations.
+
+    Note that all operations from the in queues should have already been
+    executed where they originated from, but nowhere else. 
+
+    Usage #1: When you have no out queues predefined.
+    trans1, trans2 = ot.Transform(in_queue_1, in_queue_2).transform()
+
+    Usage #2: When you have 2 out queues predefined.
+    ot.Transform(queue_server, queue_client, out_queue).transform()
+    """
+    def __init__(self, queue_server, queue_client, out_queue = None):
+        """Sets up instance variables"""
+        self.from_server = queue_server
+        self.from_client = queue_client
+        if out_queue is not None:
+            self.out = out_queue
+        else:
+            # Transformed operations are kept one for one.
+            self.out = OperationQueue(compose_threshold = None)
+    def transform(self, num = -1):
+        """Transforms server operations against the client operations.
+
+        The first 'num' operations from the server queue (all of them if
+        'num' is negative) are taken off it. Each is transformed against the
+        client queue, and added to the out queue, ready to be applied after
+        the client operations. The client queue is transformed in place, so
+        it can be sent after the server operations, and transformed against
+        later ones. The original operations aren't modified.
+
+        Returns the out queue and the client queue.
+        """
+        client = list(self.from_client)
+        count = 0
+        while self.from_server and (num < 0 or count < num):
+            server_op = self.from_server.popleft()
+            for i in xrange(len(client)):
+                server_op, client[i] = transform(server_op, client[i])
+            self.out.extend((server_op,))
+            count += 1
+        # Replaced in place, so the queue keeps its count of sent operations.
+        for i in xrange(len(client)):
+            self.from_client[i] = client[i]
+        return self.out, self.from_client
@@ -0,0 +1,311 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+"""Unit tests for the operation module.
+
+Besides a few fixed cases, the transform is checked on many random
+documents and operations for its convergence guarantee.
+"""
+
+import copy
+import datetime
+import random
+import StringIO
+import unittest
+
+import blip
+import operation
+from operation import RETAIN, INSERT, DELETE
+
+
+def random_operation(rand, length):
+    """Returns a random operation on a document of 'length' items."""
+    op = operation.Operation()
+    left = length
+    while left or rand.random() < 0.3:
+        choice = rand.random()
+        if choice < 0.3:
+            op.insert(''.join(rand.choice('xyz')
+                              for i in range(rand.randint(1, 4))))
+        elif not left:
+            continue
+        elif choice < 0.65:
+            count = rand.randint(1, left)
+            op.retain(count)
+            left -= count
+        else:
+            count = rand.randint(1, left)
+            op.delete(count)
+            left -= count
+    return op
+
+
+class TestOperation(unittest.TestCase):
+
+    def testNormalized(self):
+        op = operation.Operation().retain(2).retain(0).delete(1).insert('a')
+        op.delete(2).insert('b').insert('')
+        self.assertEquals([(RETAIN, 2), (INSERT, 'ab'), (DELETE, 3)],
+                          op.components)
+        self.assertEquals(5, op.base_length)
+        self.assertEquals(4, op.target_length)
+        self.assertEquals(op, operation.Operation(op.components))
+        self.assertRaises(ValueError, op.retain, -1)
+        self.assertRaises(ValueError, op.add, 'MOVE', 1)
+
+    def testApply(self):
+        op = operation.Operation().retain(6).delete(5).insert('there')
+        self.assertEquals('hello there', op.apply_text('hello world'))
+        self.assertEquals(list('hello there'),
+                          op.apply_text(list('hello world')))
+        document = blip.BlipDocument()
+        document.insert_characters('hello world')
+        self.assertEquals('hello there', str(op.apply(document)))
+        self.assertRaises(ValueError, op.apply_text, 'hello')
+
+    def testTransformInsertsAtSamePlace(self):
+        op1 = operation.Operation().retain(1).insert('a').retain(1)
+        op2 = operation.Operation().retain(1).insert('b').retain(1)
+        op1_prime, op2_prime = operation.transform(op1, op2)
+        self.assertEquals('xaby', op2_prime.apply_text(op1.apply_text('xy')))
+        self.assertEquals('xaby', op1_prime.apply_text(op2.apply_text('xy')))
+
+    def testTransformOverlappingDeletes(self):
+        op1 = operation.Operation().retain(1).delete(3).retain(2)
+        op2 = operation.Operation().retain(2).delete(3).retain(1)
+        op1_prime, op2_prime = operation.transform(op1, op2)
+        self.assertEquals([(RETAIN, 1), (DELETE, 1), (RETAIN, 1)],
+                          op1_prime.components)
+        self.assertEquals([(RETAIN, 1), (DELETE, 1), (RETAIN, 1)],
+                          op2_prime.components)
+        self.assertEquals('af', op2_prime.apply_text(op1.apply_text('abcdef')))
+
+    def testTransformLengthMismatch(self):
+        self.assertRaises(ValueError, operation.transform,
+                          operation.Operation().retain(1),
+                          operation.Operation().retain(2))
+
+    def testTransformConverges(self):
+        rand = random.Random(1)
+        for i in range(500):
+            text = ''.join(rand.choice('abcdef')
+                           for j in range(rand.randint(0, 12)))
+            op1 = random_operation(rand, len(text))
+            op2 = random_operation(rand, len(text))
+            originals = copy.deepcopy((op1.components, op2.components))
+            op1_prime, op2_prime = operation.transform(op1, op2)
+            self.assertEquals(originals, (op1.components, op2.components))
+            self.assertEquals(op2_prime.apply_text(op1.apply_text(text)),
+                              op1_prime.apply_text(op2.apply_text(text)))
+            # The transformed operations are normalized as well.
+            self.assertEquals(op1_prime,
+                              operation.Operation(op1_prime.components))
+            self.assertEquals(op2_prime,
+                              operation.Operation(op2_prime.components))
+
+    def testTransformQueuesConverge(self):
+        rand = random.Random(2)
+        for i in range(100):
+            text = 'abcdefgh'
+            server_text = client_text = text
+            server = operation.OperationQueue()
+            client = operation.OperationQueue()
+            for j in range(rand.randint(0, 4)):
+                op = random_operation(rand, len(server_text))
+                server_text = op.apply_text(server_text)
+                server.extend((op,))
+            for j in range(rand.randint(0, 4)):
+                op = random_operation(rand, len(client_text))
+                client_text = op.apply_text(client_text)
+                client.extend((op,))
+            count = len(server)
+            out, client = operation.Transform(server, client).transform()
+            self.assertEquals(count, len(out))
+            self.assertEquals(0, len(server))
+            for op in out:
+                client_text = op.apply_text(client_text)
+            for op in client:
+                server_text = op.apply_text(server_text)
+            self.assertEquals(server_text, client_text)
+
+
+class TestCompose(unittest.TestCase):
+
+    def testCompose(self):
+        op1 = operation.Operation().retain(2).insert('abc').delete(1)
+        op2 = operation.Operation().retain(3).delete(2).insert('z')
+        composed = operation.compose(op1, op2)
+        self.assertEquals([(RETAIN, 2), (INSERT, 'az'), (DELETE, 1)],
+                          composed.components)
+        self.assertEquals('xyaz', composed.apply_text('xyv'))
+        self.assertRaises(ValueError, operation.compose, op2, op1)
+
+    def testComposeMatchesApplyingInTurn(self):
+        rand = random.Random(3)
+        for i in range(500):
+            text = ''.join(rand.choice('abcdef')
+                           for j in range(rand.randint(0, 12)))
+            op1 = random_operation(rand, len(text))
+            op2 = random_operation(rand, op1.target_length)
+            originals = copy.deepcopy((op1.components, op2.components))
+            composed = operation.compose(op1, op2)
+            self.assertEquals(originals, (op1.components, op2.components))
+            self.assertEquals(op2.apply_text(op1.apply_text(text)),
+                              composed.apply_text(text))
+            self.assertEquals(composed,
+                              operation.Operation(composed.components))
+
+    def testComposeCommutesWithTransform(self):
+        rand = random.Random(4)
+        for i in range(300):
+            text = ''.join(rand.choice('abcdef')
+                           for j in range(rand.randint(0, 12)))
+            op1 = random_operation(rand, len(text))
+            op2 = random_operation(rand, op1.target_length)
+            other = random_operation(rand, len(text))
+            composed_prime, other_prime = operation.transform(
+                operation.compose(op1, op2), other)
+            self.assertEquals(
+                other_prime.apply_text(
+                    operation.compose(op1, op2).apply_text(text)),
+                composed_prime.apply_text(other.apply_text(text)))
+
+    def testQueueComposesBacklog(self):
+        queue = operation.OperationQueue(compose_threshold=8)
+        text = 'hello world'
+        typed = 'and goodbye '
+        for i, char in enumerate(typed):
+            op = operation.Operation().retain(6 + i).insert(char).retain(5)
+            queue.append(op)
+            self.assertTrue(len(queue) <= 8)
+        result = text
+        for op in queue:
+            result = op.apply_text(result)
+        self.assertEquals('hello and goodbye world', result)
+        composed = queue.compose()
+        self.assertEquals(1, len(queue))
+        self.assertEquals([(RETAIN, 6), (INSERT, typed), (RETAIN, 5)],
+                          composed.components)
+
+    def testQueueDoesNotComposeSentOperations(self):
+        queue = operation.OperationQueue(compose_threshold=4)
+        sent = [operation.Operation().insert('a'),
+                operation.Operation().retain(1).insert('b')]
+        queue.extend(sent)
+        queue.mark_sent()
+        for i in range(8):
+            queue.append(operation.Operation().retain(2 + i).insert('c'))
+        self.assertEquals(2, queue.sent)
+        self.assertEquals(sent, list(queue)[:2])
+        self.assertTrue(len(queue) <= 2 + 4)
+        self.assertEquals(sent[0], queue.popleft())
+        self.assertEquals(1, queue.sent)
+        composed = queue.compose()
+        self.assertEquals([sent[1], composed], list(queue))
+        self.assertEquals([(RETAIN, 2), (INSERT, 'cccccccc')],
+                          composed.components)
+
+    def testTransformKeepsEveryOperation(self):
+        server = operation.OperationQueue(compose_threshold=None)
+        server.extend([operation.Operation().retain(i).insert('s')
+                       for i in range(100)])
+        client = operation.OperationQueue(compose_threshold=2)
+        client.extend([operation.Operation().insert('x'),
+                       operation.Operation().retain(1).insert('y')])
+        client.mark_sent(1)
+        out, client = operation.Transform(server, client).transform()
+        self.assertEquals(100, len(out))
+        self.assertEquals(2, len(client))
+        self.assertEquals(1, client.sent)
+
+    def testQueueWithoutThreshold(self):
+        queue = operation.OperationQueue(compose_threshold=None)
+        queue.extend([operation.Operation().insert('a')] * 100)
+        self.assertEquals(100, len(queue))
+        self.assertEquals(None, operation.OperationQueue().compose())
+
+
+class TestPackedOperations(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(5)
+        self.operations = []
+        length = 0
+        for i in range(200):
+            op = random_operation(rand, length)
+            op.timestamp = datetime.datetime(2010, 6, 1, 12, 0, i % 60, 250000)
+            self.operations.append(op)
+            length = op.target_length
+        self.operations.append(
+            operation.Operation().insert(u'caf\xe9').retain(length))
+        self.packed = operation.PackedOperations(self.operations)
+
+    def testViews(self):
+        self.assertEquals(201, len(self.packed))
+        self.assertEquals(sum([len(op.components) for op in self.operations]),
+                          self.packed.component_count())
+        for op, view in zip(self.operations, self.packed):
+            self.assertEquals(op.components, view.components)
+            self.assertEquals(op.base_length, view.base_length)
+            self.assertEquals(op.target_length, view.target_length)
+            self.assertEquals(op.timestamp, view.timestamp)
+            self.assertEquals(op, view.to_operation())
+        self.assertEquals(self.operations[-1].components,
+                          self.packed[-1].components)
+        self.assertRaises(IndexError, self.packed.__getitem__, 201)
+
+    def testTextIsInterned(self):
+        texts = set()
+        for op in self.operations:
+            for type, arg in op.components:
+                if type == INSERT:
+                    texts.add(arg)
+        self.assertEquals(len(texts), len(self.packed._pool))
+
+    def testRoundTrip(self):
+        stream = StringIO.StringIO()
+        self.packed.write(stream)
+        stream.seek(0)
+        read = operation.PackedOperations.read(stream)
+        self.assertEquals([view.components for view in self.packed],
+                          [view.components for view in read])
+        self.assertEquals([view.timestamp for view in self.packed],
+                          [view.timestamp for view in read])
+        self.assertEquals(u'caf\xe9', read[-1].components[0][1])
+        self.assertEquals(self.packed.tostring(), read.tostring())
+
+    def testInvalidData(self):
+        data = self.packed.tostring()
+        self.assertRaises(ValueError, operation.PackedOperations.fromstring,
+                          data[:-1])
+        self.assertRaises(ValueError, operation.PackedOperations.fromstring,
+                          'XXXX' + data[4:])
+        self.assertRaises(ValueError, operation.PackedOperations.fromstring,
+                          data[:10])
+
+    def testOnlyTextInsertsArePacked(self):
+        count = len(self.packed)
+        components = self.packed.component_count()
+        data = self.packed.tostring()
+        self.assertRaises(TypeError, self.packed.append,
+                          operation.Operation().insert([object()]))
+        self.assertRaises(TypeError, self.packed.append,
+                          operation.Operation().retain(2).insert([1]))
+        self.assertEquals(count, len(self.packed))
+        self.assertEquals(components, self.packed.component_count())
+        self.assertEquals(data, self.packed.tostring())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,6 +21,7 @@ from multiprocessing import Process, Queue
 from Queue import Empty, Full
 from threading import Lock
 from threads import LoopingThread
+from digest import SearchResults
 
 class Responder(LoopingThread):
     ''' A class used by the Plugin core to process the outqueue '''
@@ -76,6 +77,10 @@ class Plugin(Process):
         try:
             if t == 'query':
                 self.output(data, self._query(data['query'],data['page']))
+            elif t == 'pages':
+                self.output(data, self._query_pages(data['query'],
+                                                    data['page'],
+                                                    data['pages']))
             elif t == 'contacts':
                 self.output(data, self._contacts())
             elif t == 'me':
@@ -88,6 +93,11 @@ class Plugin(Process):
     def output(self, data, result):
         self.outqueue.put((data['callback'], result))
 
+    def respond(self, callback, result):
+        ''' Pass result to callback on the Responder thread, like the
+        results of requests to the plugin. '''
+        self.outqueue.put((self.pushcallback(callback), result))
+
     def pushcallback(self, c):
         self.cblock.acquire()
         self.callbacks[self.maxcallback]=c
@@ -111,6 +121,18 @@ class Plugin(Process):
                 'ecallback':self.pushcallback(errorcallback),
                 })
 
+    def query_pages(self, query, startpage, pages, callback, errorcallback):
+        ''' Like query, for several pages starting at startpage. Callback
+        function takes a single models.digest.SearchResults with the
+        digests of all pages. '''
+        self.inqueue.put({'type':'pages',
+                'query':query,
+                'page':startpage,
+                'pages':pages,
+                'callback':self.pushcallback(callback),
+                'ecallback':self.pushcallback(errorcallback),
+                })
+
     def get_contacts(self, callback, errorcallback):
         ''' Callback function takes a list of models.user.User '''
         self.inqueue.put({'type':'contacts',
@@ -134,6 +156,23 @@ class Plugin(Process):
         ''' Override me! Return a models.digest.SearchResults '''
         pass
 
+    def _query_pages(self, query, startpage, pages):
+        ''' Override me to fetch the pages concurrently! Return a
+        models.digest.SearchResults. By default the pages are fetched
+        one at a time through _query, up to the last one there is. '''
+        digests = []
+        maxpage = startpage
+        for page in range(startpage, startpage+pages):
+            results = self._query(query, page)
+            if results is None:
+                raise NotImplementedError("%s does not support queries"
+                                          % type(self).__name__)
+            digests.extend(results.digests)
+            maxpage = results.maxpage
+            if maxpage <= page:
+                break
+        return SearchResults(query, startpage, digests, maxpage)
+
     def _contacts(self):
         ''' Override me! Return a list of models.user.User '''
         pass
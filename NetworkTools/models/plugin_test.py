@@ -0,0 +1,63 @@
+#
+# Copyright Notice:
+#
+# Copyright 2010    Nathanael Abbotts (nat.abbotts@gmail.com),
+#                   Philip Horger,
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+"""Unit tests for the plugin module."""
+
+import unittest
+
+import digest
+import plugin
+
+
+class PagelessPlugin(plugin.Plugin):
+    """A plugin that only answers single page queries."""
+    def __init__(self, lastpage):
+        self.lastpage = lastpage
+        self.queried = []
+
+    def _query(self, query, startpage):
+        self.queried.append(startpage)
+        maxpage = min(startpage+1, self.lastpage)
+        return digest.SearchResults(query, startpage,
+                                    ['%s%d' % (query, startpage)], maxpage)
+
+
+class TestPlugin(unittest.TestCase):
+
+    def testQueryPagesFallsBackToQuery(self):
+        p = PagelessPlugin(lastpage=5)
+        results = p._query_pages('q', 1, 3)
+        self.assertEquals([1, 2, 3], p.queried)
+        self.assertEquals(['q1', 'q2', 'q3'], results.digests)
+        self.assertEquals(1, results.page)
+        self.assertEquals(4, results.maxpage)
+
+    def testQueryPagesStopsAtLastPage(self):
+        p = PagelessPlugin(lastpage=2)
+        results = p._query_pages('q', 0, 10)
+        self.assertEquals([0, 1, 2], p.queried)
+        self.assertEquals(2, results.maxpage)
+
+    def testQueryPagesWithoutQuery(self):
+        p = plugin.Plugin.__new__(plugin.Plugin)
+        self.assertRaises(NotImplementedError, p._query_pages, 'q', 0, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,7 @@ from models import threads, operation
 import json
 
 import plugins
+from searchcache import SearchCache, next_key
 
 def connect(plugincls, **kwargs):
         if hasattr(plugincls, '_accepts'):
@@ -48,6 +49,8 @@ class Network(threads.LoopingThread):
 		super(Network, self).__init__(name="PyTideNetwork", speed=.1)
 		self.registry = reg
 		self.connection = None
+		self.account = None
+		self.searches = SearchCache()
 		self._status = "No connection"
 		self.wavelets = []
 		self.contacts = []
@@ -63,12 +66,56 @@ class Network(threads.LoopingThread):
 			#self.connection.sync()
 
 	def query(self, wlcallback, query, startpage=0, errcallback=None):
-		''' External function - send a query to the plugin '''
+		''' External function - send a query to the plugin.
+
+		Results are cached. Fresh ones are passed to wlcallback
+		without asking the plugin; stale ones are passed on right
+		away and again once they have been fetched anew. Meanwhile
+		the next page is prefetched. Cached results are passed on
+		through the plugin's Responder thread too, like fetched ones. '''
+		key = (self.account, query, startpage)
+		results, fresh = self.searches.get(key)
+		if results != None:
+			self.connection.respond(
+				lambda results: self._query(results, wlcallback), results)
+			if fresh:
+				self.prefetch(key, results)
+				return
+		self._fetch_query(key, (wlcallback, errcallback))
+
+	def prefetch(self, key, results):
+		''' Fetch the page after results, which were requested
+		with key, in the background unless it is cached already. '''
+		nextkey = next_key(key, results)
+		if nextkey != None and not self.searches.get(nextkey)[1]:
+			self._fetch_query(nextkey)
+
+	def _fetch_query(self, key, waiter=None):
+		if not self.searches.begin_fetch(key, waiter):
+			return
+		def callback(results):
+			waiters = self.searches.finish_fetch(key, results)
+			for wlcallback, errcallback in waiters:
+				self._query(results, wlcallback)
+			if waiters:
+				# Only for pages someone looks at, or every page
+				# would prefetch the one after it.
+				self.prefetch(key, results)
+		def err(e):
+			for wlcallback, errcallback in self.searches.fail_fetch(key):
+				self.plugin_error(e, errcallback)
+		self.connection.query(key[1], key[2], callback, err)
+
+	def query_pages(self, wlcallback, query, startpage=0, pages=1, errcallback=None):
+		''' External function - send a query for several pages at
+		once to the plugin. The pages are fetched concurrently and
+		passed to wlcallback as a single models.SearchResults; they
+		aren't cached. '''
 		def callback(results):
 			self._query(results, wlcallback)
 		def err(e):
 			self.plugin_error(e, errcallback)
-		self.connection.query(query, startpage, callback, err)
+		self.connection.query_pages(query, startpage, pages, callback, err)
 
 	def _query(self, results, wlcallback):
 		''' Expects a models.SearchResults from the plugin '''
@@ -88,6 +135,7 @@ class Network(threads.LoopingThread):
                                                           username=username,
                                                           password=password,
                                                           domain=domain)
+				self.account = username
 				self.status("Connected")
 				self.loginWindow.hide()
 				self.registry.newWaveList()
@@ -25,6 +25,7 @@ from ..waveapi import waveservice
 
 
 PYTIDE_LOGIN_URL = "http://pytidewave.appspot.com/account/remotelogin"
+PAGE_SIZE = 20
 
 class modelConverter:
     @staticmethod
@@ -39,6 +40,23 @@ class modelConverter:
                                     digests,
                                     maxpage)
 
+    @staticmethod
+    def MergedSearchResults(wspages, page, maxpage):
+        ''' Turns a list of consecutive Data API search result pages
+        into a single models.SearchResults object. Waves that moved
+        between pages while they were fetched are only listed once. '''
+        digests = []
+        seen = set()
+        for wsresults in wspages:
+            for i in wsresults.digests:
+                if i.wave_id not in seen:
+                    seen.add(i.wave_id)
+                    digests.append(modelConverter.Digest(i))
+        return digest.SearchResults(wspages[0].query,
+                                    page,
+                                    digests,
+                                    maxpage)
+
     @staticmethod
     def Digest(wsdigest):
         return digest.Digest(wsdigest.wave_id,
@@ -84,17 +102,39 @@ class GoogleWaveConnection(plugin.Plugin):
     def _query(self, query, startpage):
         try:
             results=self.service.search(query,
-                                        index=startpage*20,
-                                        num_results=21)
+                                        index=startpage*PAGE_SIZE,
+                                        num_results=PAGE_SIZE+1)
         except:
             raise NetworkTools.ConnectionFailure("Connection to Google Wave failed")
             return # Why do we need to return after a raise?
-        if results.num_results < 21:
+        if results.num_results <= PAGE_SIZE:
             maxpage = startpage
         else:
             maxpage = startpage+1 # more pages exist, we will just assume one more
         return modelConverter.SearchResults(results, startpage, maxpage)
 
+    def _query_pages(self, query, startpage, pages):
+        try:
+            results = self.service.search_pages(query,
+                                                index=startpage*PAGE_SIZE,
+                                                num_results=PAGE_SIZE,
+                                                num_pages=pages)
+        except:
+            raise NetworkTools.ConnectionFailure("Connection to Google Wave failed")
+        total = max([r.num_results or 0 for r in results])
+        if total > max([len(r.digests) for r in results]):
+            # The server told us how many results there are in all.
+            maxpage = max((total-1) // PAGE_SIZE, 0)
+        else:
+            filled = [i for i in range(pages) if results[i].digests]
+            if not filled:
+                maxpage = startpage
+            elif len(results[filled[-1]].digests) < PAGE_SIZE:
+                maxpage = startpage+filled[-1]
+            else:
+                maxpage = startpage+pages # assume one more, like _query
+        return modelConverter.MergedSearchResults(results, startpage, maxpage)
+
     def _me(self):
         return modelConverter.User(self.service.fetch_my_profile()['participantProfile'])
 
@@ -0,0 +1,114 @@
+#           Licensed to the Apache Software Foundation (ASF) under one
+#           or more contributor license agreements.  See the NOTICE file
+#           distributed with this work for additional information
+#           regarding copyright ownership.  The ASF licenses this file
+#           to you under the Apache License, Version 2.0 (the
+#           "License"); you may not use this file except in compliance
+#           with the License.  You may obtain a copy of the License at
+
+#             http://www.apache.org/licenses/LICENSE-2.0
+
+#           Unless required by applicable law or agreed to in writing,
+#           software distributed under the License is distributed on an
+#           "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#           KIND, either express or implied.  See the License for the
+#           specific language governing permissions and limitations
+#           under the License.
+
+import threading
+import time
+
+class SearchCache(object):
+	''' Search results by (account, query, page), kept in memory.
+
+	Results younger than ttl seconds are fresh and can be shown
+	as they are. Older results, up to maxstale seconds, are stale:
+	they can still be shown right away, but should be fetched again
+	in the background. Anything older is dropped.
+
+	The cache also keeps track of the fetches in flight, so two
+	requests for the same page only cause one fetch, and of
+	invalidations, so a fetch that was sent before an account was
+	invalidated doesn't put its outdated results back. '''
+
+	def __init__(self, ttl=15, maxstale=300, clock=time.time):
+		self.ttl = ttl
+		self.maxstale = maxstale
+		self.clock = clock
+		self.lock = threading.Lock()
+		self.entries = {}
+		self.fetches = {}
+		self.generations = {}
+
+	def get(self, key):
+		''' Return a (results, fresh) tuple, or (None, False) if
+		nothing usable is cached for key. '''
+		self.lock.acquire()
+		try:
+			if not key in self.entries:
+				return (None, False)
+			results, stored = self.entries[key]
+			age = self.clock() - stored
+			if age > self.maxstale:
+				del self.entries[key]
+				return (None, False)
+			return (results, age <= self.ttl)
+		finally:
+			self.lock.release()
+
+	def begin_fetch(self, key, waiter=None):
+		''' Register interest in the results for key. waiter, if
+		given, is a (callback, errcallback) tuple to be handed back
+		by finish_fetch or fail_fetch. Return True if the caller
+		should start the fetch, False if one is already running. '''
+		self.lock.acquire()
+		try:
+			if key in self.fetches:
+				start = False
+			else:
+				self.fetches[key] = (self.generations.get(key[0], 0), [])
+				start = True
+			if waiter != None:
+				self.fetches[key][1].append(waiter)
+			return start
+		finally:
+			self.lock.release()
+
+	def finish_fetch(self, key, results):
+		''' Store the results of a fetch and return its waiters. '''
+		self.lock.acquire()
+		try:
+			generation, waiters = self.fetches.pop(key, (None, []))
+			if generation == self.generations.get(key[0], 0):
+				self.entries[key] = (results, self.clock())
+			return waiters
+		finally:
+			self.lock.release()
+
+	def fail_fetch(self, key):
+		''' Forget a failed fetch and return its waiters. '''
+		self.lock.acquire()
+		try:
+			return self.fetches.pop(key, (None, []))[1]
+		finally:
+			self.lock.release()
+
+	def invalidate(self, account):
+		''' Drop everything cached for account. To be called after
+		a local change, like a submitted wavelet, that may show up
+		in its search results. '''
+		self.lock.acquire()
+		try:
+			for key in self.entries.keys():
+				if key[0] == account:
+					del self.entries[key]
+			self.generations[account] = self.generations.get(account, 0)+1
+		finally:
+			self.lock.release()
+
+def next_key(key, results):
+	''' Return the key of the page after results, which were
+	requested with key, or None if results is the last page. '''
+	if results.maxpage <= results.page:
+		return None
+	return (key[0], key[1], key[2]+1)
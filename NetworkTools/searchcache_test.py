@@ -0,0 +1,112 @@
+#           Licensed to the Apache Software Foundation (ASF) under one
+#           or more contributor license agreements.  See the NOTICE file
+#           distributed with this work for additional information
+#           regarding copyright ownership.  The ASF licenses this file
+#           to you under the Apache License, Version 2.0 (the
+#           "License"); you may not use this file except in compliance
+#           with the License.  You may obtain a copy of the License at
+
+#             http://www.apache.org/licenses/LICENSE-2.0
+
+#           Unless required by applicable law or agreed to in writing,
+#           software distributed under the License is distributed on an
+#           "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#           KIND, either express or implied.  See the License for the
+#           specific language governing permissions and limitations
+#           under the License.
+
+"""Unit tests for the searchcache module."""
+
+import unittest
+
+import searchcache
+
+KEY = ('me@example.com', 'in:inbox', 0)
+
+class FakeResults(object):
+	def __init__(self, page, maxpage):
+		self.page = page
+		self.maxpage = maxpage
+
+class TestSearchCache(unittest.TestCase):
+
+	def setUp(self):
+		self.now = 1000.0
+		self.cache = searchcache.SearchCache(ttl=15, maxstale=300,
+			clock=lambda: self.now)
+
+	def store(self, key, results):
+		self.assertTrue(self.cache.begin_fetch(key))
+		self.cache.finish_fetch(key, results)
+
+	def testMissing(self):
+		self.assertEquals((None, False), self.cache.get(KEY))
+
+	def testFreshUpToTtl(self):
+		self.store(KEY, 'results')
+		self.now += 15
+		self.assertEquals(('results', True), self.cache.get(KEY))
+
+	def testStaleAfterTtl(self):
+		self.store(KEY, 'results')
+		self.now += 15.5
+		self.assertEquals(('results', False), self.cache.get(KEY))
+
+	def testStaleUpToMaxstale(self):
+		self.store(KEY, 'results')
+		self.now += 300
+		self.assertEquals(('results', False), self.cache.get(KEY))
+
+	def testExpiredAfterMaxstale(self):
+		self.store(KEY, 'results')
+		self.now += 300.5
+		self.assertEquals((None, False), self.cache.get(KEY))
+		self.now -= 300.5
+		self.assertEquals((None, False), self.cache.get(KEY))
+
+	def testWaiterJoinsRunningFetch(self):
+		first, second = ('cb1', 'ecb1'), ('cb2', 'ecb2')
+		self.assertTrue(self.cache.begin_fetch(KEY, first))
+		self.assertFalse(self.cache.begin_fetch(KEY, second))
+		self.assertEquals([first, second],
+			self.cache.finish_fetch(KEY, 'results'))
+		self.assertEquals(('results', True), self.cache.get(KEY))
+		self.assertTrue(self.cache.begin_fetch(KEY))
+
+	def testFailedFetchReturnsWaiters(self):
+		first, second = ('cb1', 'ecb1'), ('cb2', 'ecb2')
+		self.cache.begin_fetch(KEY, first)
+		self.cache.begin_fetch(KEY, second)
+		self.assertEquals([first, second], self.cache.fail_fetch(KEY))
+		self.assertEquals((None, False), self.cache.get(KEY))
+		self.assertTrue(self.cache.begin_fetch(KEY))
+
+	def testInvalidate(self):
+		other = ('you@example.com', 'in:inbox', 0)
+		self.store(KEY, 'mine')
+		self.store(other, 'yours')
+		self.cache.invalidate(KEY[0])
+		self.assertEquals((None, False), self.cache.get(KEY))
+		self.assertEquals(('yours', True), self.cache.get(other))
+
+	def testInvalidateDiscardsFetchInFlight(self):
+		self.cache.begin_fetch(KEY)
+		self.cache.invalidate(KEY[0])
+		self.cache.finish_fetch(KEY, 'outdated')
+		self.assertEquals((None, False), self.cache.get(KEY))
+		self.store(KEY, 'results')
+		self.assertEquals(('results', True), self.cache.get(KEY))
+
+class TestNextKey(unittest.TestCase):
+
+	def testNextPage(self):
+		self.assertEquals(('me@example.com', 'in:inbox', 1),
+			searchcache.next_key(KEY, FakeResults(0, 3)))
+
+	def testLastPage(self):
+		self.assertEquals(None,
+			searchcache.next_key(('me@example.com', 'in:inbox', 3),
+				FakeResults(3, 3)))
+
+if __name__ == '__main__':
+	unittest.main()
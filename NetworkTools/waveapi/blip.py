@@ -14,13 +14,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
 import UserDict
 
 import element
 import errors
-
+import intervals
+import rope
+import textindex
 import util
 
+#: Edits hitting at least this many ranges rebuild the content, annotations
+#: and elements in one pass instead of applying the hits one by one.
+BULK_EDIT_THRESHOLD = 16
+
 class Annotation(object):
   """Models an annotation on a document.
 
@@ -72,13 +79,6 @@ class Annotation(object):
   def end(self):
     return self._end
 
-  def _shift(self, where, inc):
-    """Shift annotation by 'inc' if it (partly) overlaps with 'where'."""
-    if self._start >= where:
-      self._start += inc
-    if self._end >= where:
-      self._end += inc
-
   def serialize(self):
     """Serializes the annotation.
 
@@ -92,7 +92,12 @@ class Annotation(object):
 
 
 class Annotations(object, UserDict.DictMixin):
-  """A dictionary-like object containing the annotations, keyed by name."""
+  """A dictionary-like object containing the annotations, keyed by name.
+
+  The annotations for each name are kept in an intervals.IntervalIndex,
+  so adding, clearing and shifting them after an edit costs O(log n)
+  plus the number of annotations touched.
+  """
 
   def __init__(self, operation_queue, blip):
     self._operation_queue = operation_queue
@@ -106,29 +111,26 @@ class Annotations(object, UserDict.DictMixin):
 
   def _add_internal(self, name, value, start, end):
     """Internal add annotation does not send out operations."""
-    if name in self._store:
-      # TODO: use bisect to make this more efficient.
-      new_list = []
-      for existing in self._store[name]:
-        if start > existing.end or end < existing.start:
-          new_list.append(existing)
-        else:
-          if existing.value == value:
-            # merge the annotations:
-            start = min(existing.start, start)
-            end = max(existing.end, end)
-          else:
-            # chop the bits off the existing annotation
-            if existing.start < start:
-              new_list.append(Annotation(
-                  existing.name, existing.value, existing.start, start))
-            if existing.end > end:
-              new_list.append(Annotation(
-                  existing.name, existing.value, existing.end, end))
-      new_list.append(Annotation(name, value, start, end))
-      self._store[name] = new_list
-    else:
-      self._store[name] = [Annotation(name, value, start, end)]
+    index = self._store.get(name)
+    if index is None:
+      self._store[name] = intervals.IntervalIndex([(start, end, value)])
+      return
+    new_start, new_end = start, end
+    before = []
+    after = []
+    for existing_start, existing_end, existing_value in index.items(start,
+                                                                    end):
+      if existing_value == value:
+        # merge the annotations:
+        new_start = min(existing_start, new_start)
+        new_end = max(existing_end, new_end)
+      else:
+        # chop the bits off the existing annotation
+        if existing_start < start:
+          before.append((existing_start, start, existing_value))
+        if existing_end > end:
+          after.append((end, existing_end, existing_value))
+    index.replace(start, end, before + [(new_start, new_end, value)] + after)
 
   def _delete_internal(self, name, start=0, end=-1):
     """Remove the passed annotaion from the internal representation."""
@@ -137,85 +139,303 @@ class Annotations(object, UserDict.DictMixin):
     if end < 0:
       end = len(self._blip) + end
 
-    new_list = []
-    for a in self._store[name]:
-      if start > a.end or end < a.start:
-        new_list.append(a)
-      elif start < a.start and end > a.end:
-        continue
-      else:
-        if a.start < start:
-          new_list.append(Annotation(name, a.value, a.start, start))
-        if a.end > end:
-          new_list.append(Annotation(name, a.value, end, a.end))
-    if new_list:
-      self._store[name] = new_list
-    else:
+    index = self._store[name]
+    remaining = []
+    for a_start, a_end, a_value in index.items(start, end):
+      if a_start < start:
+        remaining.append((a_start, start, a_value))
+      if a_end > end:
+        remaining.append((end, a_end, a_value))
+    index.replace(start, end, _merge_contiguous(remaining))
+    if not index:
       del self._store[name]
 
   def _shift(self, where, inc):
     """Shift annotation by 'inc' if it (partly) overlaps with 'where'."""
-    for annotations in self._store.values():
-      for annotation in annotations:
-        annotation._shift(where, inc)
-
-    # Merge fragmented annotations that should be contiguous, for example:
-    # Annotation('foo', 'bar', 1, 2) and Annotation('foo', 'bar', 2, 3).
-    for name, annotations in self._store.items():
-      new_list = []
-      for i, annotation in enumerate(annotations):
-        name = annotation.name
-        value = annotation.value
-        start = annotation.start
-        end = annotation.end
-
-        # Find the last end index.
-        for j, next_annotation in enumerate(annotations[i + 1:]):
-          # Not contiguous, skip.
-          if (end < next_annotation.start):
-            break
-
-          # Contiguous, merge.
-          if (end == next_annotation.start and value == next_annotation.value):
-            end = next_annotation.end
-            del annotations[j]
-        new_list.append(Annotation(name, value, start, end))
-      self._store[name] = new_list
+    for index in self._store.values():
+      index.shift(where, inc)
+      if inc < 0:
+        # Merge fragmented annotations that should be contiguous, for
+        # example Annotation('foo', 'bar', 1, 2) and
+        # Annotation('foo', 'bar', 2, 3). Closing a gap can only make
+        # annotations meet at the start of the removed range.
+        touching = index.items(where + inc, where + inc)
+        merged = _merge_contiguous(touching)
+        if len(merged) != len(touching):
+          index.replace(where + inc, where + inc, merged)
+
+  def _remap(self, edits):
+    """Moves all annotations as the sorted edits passed in would.
+
+    Args:
+      edits: sorted (start, end, length) tuples, see _EditMap.
+    """
+    for name, index in self._store.items():
+      offsets = _EditMap(edits)
+      ranges = []
+      for start, end, value in index:
+        new_start = offsets.map(start)
+        new_end = offsets.map(end)
+        # Annotations that lay entirely in replaced text are gone.
+        if new_start == new_end and start != end:
+          continue
+        ranges.append((new_start, new_end, value))
+      if ranges:
+        self._store[name] = intervals.IntervalIndex(_merge_contiguous(ranges))
+      else:
+        del self._store[name]
 
   def __len__(self):
     return len(self._store)
 
   def __getitem__(self, key):
-    return self._store[key]
+    return [Annotation(key, value, start, end)
+            for start, end, value in self._store[key]]
 
   def __iter__(self):
-    for l in self._store.values():
-      for ann in l:
+    for name in self._store:
+      for ann in self[name]:
         yield ann
 
   def names(self):
     """Return the names of the annotations in the store."""
     return self._store.keys()
 
-  def serialize(self):
-    """Return a list of the serialized annotations."""
+  def overlapping(self, start, end, name=None):
+    """Returns the annotations covering part of the range start to end.
+
+    Args:
+      start: start of the range.
+      end: end of the range (exclusive).
+      name: if given, only return annotations with this name.
+    """
+    if name is None:
+      names = self._store.keys()
+    elif name in self._store:
+      names = [name]
+    else:
+      names = []
     res = []
-    for v in self._store.values():
-      res += [a.serialize() for a in v]
+    for name in names:
+      for a_start, a_end, value in self._store[name].items(start, end):
+        if a_start < end and a_end > start:
+          res.append(Annotation(name, value, a_start, a_end))
     return res
 
+  def serialize(self):
+    """Return a list of the serialized annotations."""
+    return [a.serialize() for a in self]
+
+
+class Elements(object, UserDict.DictMixin):
+  """A dictionary-like object containing the elements, keyed by offset.
+
+  Elements are kept in offset order in an intervals.IntervalIndex, with a
+  second index per element type, so shifting them after an edit costs
+  O(log n) and lookups by offset or type come back in document order.
+  """
+
+  def __init__(self, elements=None):
+    self._reset(sorted((elements or {}).items()))
+
+  def _reset(self, elements):
+    """Replaces all elements with the sorted (offset, element) pairs."""
+    self._index = intervals.IntervalIndex(
+        [(offset, offset, el) for offset, el in elements])
+    self._by_type = {}
+    for offset, el in elements:
+      self._type_index(el.type).replace(offset, offset,
+                                        [(offset, offset, el)])
+
+  def _type_index(self, element_type):
+    index = self._by_type.get(element_type)
+    if index is None:
+      index = self._by_type[element_type] = intervals.IntervalIndex()
+    return index
+
+  def __contains__(self, offset):
+    return self.get(offset) is not None
+
+  def __getitem__(self, offset):
+    for start, end, el in self._index.items(offset, offset):
+      if start == offset:
+        return el
+    raise KeyError(offset)
+
+  def __setitem__(self, offset, el):
+    if offset in self:
+      del self[offset]
+    self._index.replace(offset, offset, [(offset, offset, el)])
+    self._type_index(el.type).replace(offset, offset, [(offset, offset, el)])
+
+  def __delitem__(self, offset):
+    el = self[offset]
+    self._index.replace(offset, offset, [])
+    self._by_type[el.type].replace(offset, offset, [])
+
+  def __iter__(self):
+    for offset, end, el in self._index:
+      yield offset
+
+  def __len__(self):
+    return len(self._index)
+
+  def keys(self):
+    return list(self)
+
+  def items(self):
+    return [(offset, el) for offset, end, el in self._index]
+
+  def values(self):
+    return [el for offset, end, el in self._index]
+
+  def _shift(self, where, inc):
+    """Move elements at or after 'where' up by 'inc'."""
+    self._index.shift(where, inc)
+    for index in self._by_type.values():
+      index.shift(where, inc)
+
+  def _delete_range(self, start, end):
+    """Remove all elements between 'start' and 'end'."""
+    if end <= start:
+      return
+    for offset, unused_end, el in self._index.items(start, end - 1):
+      self._by_type[el.type].replace(offset, offset, [])
+    self._index.replace(start, end - 1, [])
+
+  def _remap(self, edits):
+    """Moves all elements as the sorted edits passed in would.
+
+    Elements within replaced text are removed.
+
+    Args:
+      edits: sorted (start, end, length) tuples, see _EditMap.
+    """
+    offsets = _EditMap(edits)
+    elements = []
+    for offset, end, el in self._index:
+      if not offsets.removes(offset):
+        elements.append((offsets.map(offset), el))
+    self._reset(elements)
+
+  def _find(self, element_class):
+    """Yields (offset, element) for instances of element_class in order."""
+    element_type = getattr(element_class, 'class_type', None)
+    if element_type is None:
+      ranges = self._index
+    else:
+      ranges = self._by_type.get(element_type, ())
+    for offset, end, el in ranges:
+      if isinstance(el, element_class):
+        yield offset, el
+
+  def _offset_of_inline_blip(self, blip_id):
+    """Return the offset of the inline blip with blip_id or -1."""
+    for offset, end, el in self._by_type.get(
+        element.Element.INLINE_BLIP_TYPE, ()):
+      if el.id == blip_id:
+        return offset
+    return -1
+
+
+def _merge_contiguous(ranges):
+  """Joins sorted (start, end, value) ranges that meet and share a value."""
+  res = []
+  for start, end, value in ranges:
+    if res and res[-1][1] == start and res[-1][2] == value:
+      res[-1] = (res[-1][0], end, value)
+    else:
+      res.append((start, end, value))
+  return res
+
+
+class _EditMap(object):
+  """Maps offsets in a document to where a batch of edits moves them.
+
+  The edits are sorted, non-overlapping (start, end, length) tuples in
+  the coordinates of the unedited document, each replacing the text
+  between start and end with length characters. Offsets have to be
+  mapped in non-decreasing order, so a sorted sequence of offsets costs
+  a single pass over the edits.
+  """
+
+  def __init__(self, edits):
+    self._edits = edits
+    self._next = 0
+    self._delta = 0
+
+  def _skip_to(self, offset):
+    edits = self._edits
+    while self._next < len(edits) and edits[self._next][1] <= offset:
+      start, end, length = edits[self._next]
+      self._delta += length + start - end
+      self._next += 1
+
+  def map(self, offset):
+    """Returns the new position of offset.
+
+    Offsets at or after the end of an edit move with it. Offsets inside
+    an edit stay put, except that they are clamped to the end of the
+    replacement text when it is shorter than what it replaced.
+    """
+    self._skip_to(offset)
+    if self._next < len(self._edits):
+      start, end, length = self._edits[self._next]
+      if start < offset:
+        return start + self._delta + min(offset - start, length)
+    return offset + self._delta
+
+  def removes(self, offset):
+    """Returns whether the character at offset is replaced by an edit."""
+    self._skip_to(offset)
+    return (self._next < len(self._edits) and
+            self._edits[self._next][0] <= offset)
+
+
+class _UnbuiltBlip(object):
+  """The JSON of a blip in a Blips collection, built on first access."""
+
+  __slots__ = ('json', 'operation_queue', 'thread', 'reply_threads')
+
+  def __init__(self, json, operation_queue, thread, reply_threads):
+    self.json = json
+    self.operation_queue = operation_queue
+    self.thread = thread
+    self.reply_threads = reply_threads
+
 
 class Blips(object, UserDict.DictMixin):
-  """A dictionary-like object containing the blips, keyed on blip ID."""
+  """A dictionary-like object containing the blips, keyed on blip ID.
+
+  Blips added with _add_json are kept as JSON until they are first
+  accessed, so a handler that only looks at a few blips of a large
+  wavelet doesn't pay for parsing all of them. Blips are built under a
+  lock, so handlers running on several threads share one Blip per id.
+  """
 
   def __init__(self, blips):
     self._blips = blips
+    self._build_lock = threading.Lock()
 
   def __contains__(self, blip_id):
     return blip_id in self._blips
 
   def __getitem__(self, blip_id):
-    return self._blips[blip_id]
+    res = self._blips[blip_id]
+    if isinstance(res, _UnbuiltBlip):
+      self._build_lock.acquire()
+      try:
+        res = self._blips[blip_id]
+        if isinstance(res, _UnbuiltBlip):
+          res = Blip(res.json, self, res.operation_queue, thread=res.thread,
+                     reply_threads=res.reply_threads)
+          self._blips[blip_id] = res
+      finally:
+        self._build_lock.release()
+    return res
+
+  def __setitem__(self, blip_id, ablip):
+    self._blips[blip_id] = ablip
 
   def __iter__(self):
     return self._blips.__iter__()
@@ -226,11 +446,21 @@ class Blips(object, UserDict.DictMixin):
   def _add(self, ablip):
     self._blips[ablip.blip_id] = ablip
 
+  def _add_json(self, blip_id, json, operation_queue, thread=None,
+                reply_threads=None):
+    """Adds a blip that is only built from json once it is accessed.
+
+    The arguments are passed on to the Blip constructor, with this object
+    as the other blips.
+    """
+    self._blips[blip_id] = _UnbuiltBlip(json, operation_queue, thread,
+                                        reply_threads)
+
   def _remove_with_id(self, blip_id):
-    del_blip = self._blips[blip_id]
+    del_blip = self[blip_id]
     if del_blip:
       # Remove the reference to this blip from its parent.
-      parent_blip = self._blips[blip_id].parent_blip
+      parent_blip = del_blip.parent_blip
       if parent_blip:
         parent_blip._child_blip_ids.remove(blip_id)
     del self._blips[blip_id]
@@ -242,7 +472,9 @@ class Blips(object, UserDict.DictMixin):
       A Blip object. If none found for the ID, it returns None,
       or if default_value is specified, it returns that.
     """
-    return self._blips.get(blip_id, default_value)
+    if blip_id in self._blips:
+      return self[blip_id]
+    return default_value
 
   def serialize(self):
     """Serializes the blips.
@@ -250,13 +482,13 @@ class Blips(object, UserDict.DictMixin):
       A dict of serialized blips.
     """
     res = {}
-    for blip_id, item in self._blips.items():
-      res[blip_id] = item.serialize()
+    for blip_id in self._blips.keys():
+      res[blip_id] = self[blip_id].serialize()
     return res
 
   def values(self):
     """Return the blips themselves."""
-    return self._blips.values()
+    return [self[blip_id] for blip_id in self._blips.keys()]
 
 
 class BlipRefs(object):
@@ -295,6 +527,10 @@ class BlipRefs(object):
     if findwhat is None:
       # No findWhat, take the entire blip
       obj._params = {}
+    elif (isinstance(findwhat, (list, tuple)) or
+          textindex.is_pattern(findwhat)):
+      # The server can't evaluate patterns, _execute sends the ranges.
+      obj._params = None
     else:
       query = {'maxRes': maxres}
       if isinstance(findwhat, basestring):
@@ -326,14 +562,18 @@ class BlipRefs(object):
   def _find(self, what, maxres=-1, **restrictions):
     """Iterates where 'what' occurs in the associated blip.
 
-    What can be either a string or a class reference.
+    What can be either a string, a compiled regular expression, a list of
+    strings and regular expressions or a class reference.
     Examples:
         self._find('hello') will return the first occurence of the word hello
+        self._find(['hello', re.compile('wor+ld')]) will return the first
+            occurence of either
         self._find(element.Gadget, url='http://example.com/gadget.xml')
             will return the first gadget that has as url example.com.
 
     Args:
-      what: what to search for. Can be a class or a string. The class
+      what: what to search for. Can be a class, a string, a compiled regular
+          expression or a list of strings and regular expressions. The class
           should be an element from element.py
       maxres: number of results to return at most, or <= 0 for all.
       restrictions: if what specifies a class, further restrictions
@@ -346,18 +586,14 @@ class BlipRefs(object):
     if what is None:
       yield 0, len(blip)
       raise StopIteration
-    if isinstance(what, basestring):
-      idx = blip._content.find(what)
-      count = 0
-      while idx != -1:
-        yield idx, idx + len(what)
-        count += 1
-        if count == maxres:
-          raise StopIteration
-        idx = blip._content.find(what, idx + len(what))
+    if isinstance(what, basestring) or textindex.is_pattern(what):
+      what = [what]
+    if isinstance(what, (list, tuple)):
+      for hit in blip._find_text(what, maxres):
+        yield hit
     else:
       count = 0
-      for idx, el in blip._elements.items():
+      for idx, el in blip._elements._find(what):
         if self._elem_matches(el, what, **restrictions):
           yield idx, idx + 1
           count += 1
@@ -396,10 +632,11 @@ class BlipRefs(object):
     
     # For now, if we find one markup, we'll use it everywhere.
     next = None
-    hit_found = False
 
+    # Collect all hits against the unmodified content first, so edits for
+    # one hit can't affect where the next one is found.
+    hits = []
     for start, end in self._hits():
-      hit_found = True
       if start < 0:
         start += len(blip)
         if end == 0:
@@ -411,14 +648,15 @@ class BlipRefs(object):
           raise IndexError('Start and end have to be 0 for empty document')
       elif start < 0 or end < 1 or start >= len(blip) or end > len(blip):
         raise IndexError('Position outside the document')
-      if modify_how == BlipRefs.DELETE:
-        for i in range(start, end):
-          if i in blip._elements:
-            del blip._elements[i]
-        blip._delete_annotations(start, end)
-        blip._shift(end, start - end)
-        blip._content = blip._content[:start] + blip._content[end:]
-      else:
+      hits.append((start, end))
+
+    # No match found, return immediately without generating op.
+    if not hits:
+      return
+
+    values = []
+    if modify_how != BlipRefs.DELETE:
+      for start, end in hits:
         if callable(what):
           next = what(blip._content, start, end)
           matched.append(next)
@@ -427,21 +665,31 @@ class BlipRefs(object):
           next_index = (next_index + 1) % len(what)
         if isinstance(next, str):
           next = util.force_unicode(next)
-        if modify_how == BlipRefs.ANNOTATE:
-          key, value = next
-          blip.annotations._add_internal(key, value, start, end)
-        elif modify_how == BlipRefs.CLEAR_ANNOTATION:
-          blip.annotations._delete_internal(next, start, end)
-        elif modify_how == BlipRefs.UPDATE_ELEMENT:
-          el = blip._elements.get(start)
-          if not el:
-            raise ValueError('No element found at index %s' % start)
-          # the passing around of types this way feels a bit dirty:
-          updated_elements.append(element.Element.from_json({'type': el.type,
-              'properties': next}))
-          for k, b in next.items():
-            setattr(el, k, b)
-        else:
+        values.append(next)
+
+    if modify_how == BlipRefs.ANNOTATE:
+      for (start, end), (key, value) in zip(hits, values):
+        blip.annotations._add_internal(key, value, start, end)
+    elif modify_how == BlipRefs.CLEAR_ANNOTATION:
+      for (start, end), name in zip(hits, values):
+        blip.annotations._delete_internal(name, start, end)
+    elif modify_how == BlipRefs.UPDATE_ELEMENT:
+      for (start, end), properties in zip(hits, values):
+        el = blip._elements.get(start)
+        if not el:
+          raise ValueError('No element found at index %s' % start)
+        # the passing around of types this way feels a bit dirty:
+        updated_elements.append(element.Element.from_json({'type': el.type,
+            'properties': properties}))
+        for k, b in properties.items():
+          setattr(el, k, b)
+    else:
+      edits = []
+      if modify_how == BlipRefs.DELETE:
+        for start, end in hits:
+          edits.append((start, end, u''))
+      else:
+        for (start, end), value in zip(hits, values):
           if modify_how == BlipRefs.INSERT:
             end = start
           elif modify_how == BlipRefs.INSERT_AFTER:
@@ -450,38 +698,68 @@ class BlipRefs(object):
             pass
           else:
             raise ValueError('Unexpected modify_how: ' + modify_how)
-
-          if isinstance(next, element.Element):
-            text = ' '
+          if isinstance(value, element.Element):
+            edits.append((start, end, ' '))
           else:
-            text = next
-
-          # in the case of a replace, and the replacement text is shorter,
-          # delete the delta.
-          if start != end and len(text) < end - start:
-            blip._delete_annotations(start + len(text), end)
-
-          blip._shift(end, len(text) + start - end)
-          blip._content = blip._content[:start] + text + blip._content[end:]
-          if bundled_annotations:
-            end_annotation = start + len(text)
-            blip._delete_annotations(start, end_annotation)
-            for key, value in bundled_annotations:
-              blip.annotations._add_internal(key, value, start, end_annotation)
+            edits.append((start, end, value))
 
-          if isinstance(next, element.Element):
-            blip._elements[start] = next
+      if len(edits) >= BULK_EDIT_THRESHOLD:
+        blip._replace_ranges(edits)
+      else:
+        delta = 0
+        for start, end, text in edits:
+          blip._replace_range(start + delta, end + delta, text)
+          delta += len(text) + start - end
+
+      # Bundled annotations and elements go in once all text is in place,
+      # at the offsets the edits ended up at.
+      delta = 0
+      for (start, end, text), replacement in zip(edits, values):
+        new_start = start + delta
+        delta += len(text) + start - end
+        if bundled_annotations:
+          end_annotation = new_start + len(text)
+          blip._delete_annotations(new_start, end_annotation)
+          for key, value in bundled_annotations:
+            blip.annotations._add_internal(key, value, new_start,
+                                           end_annotation)
+        if isinstance(replacement, element.Element):
+          blip._elements[new_start] = replacement
+
+    if callable(what):
+      what = matched
+    if self._params is not None:
+      self._add_operation(self._params, self._modify_action(
+          modify_how, what, next, updated_elements, bundled_annotations))
+    else:
+      # Send the hits of a pattern search as ranges, starting with the last
+      # so the server can apply them one by one without adjusting offsets.
+      for i in reversed(xrange(len(hits))):
+        start, end = hits[i]
+        value = None
+        if values:
+          value = values[i]
+        modify_action = self._modify_action(
+            modify_how, values[i:i + 1], value, updated_elements[i:i + 1],
+            bundled_annotations)
+        self._add_operation({'range': {'start': start, 'end': end}},
+                            modify_action)
 
-    # No match found, return immediately without generating op.
-    if not hit_found:
-      return
+    return self
 
+  def _add_operation(self, params, modify_action):
+    """Queues a document.modify operation for the blip."""
+    blip = self._blip
     operation = blip._operation_queue.document_modify(blip.wave_id,
                                                       blip.wavelet_id,
                                                       blip.blip_id)
-    for param, value in self._params.items():
+    for param, value in params.items():
       operation.set_param(param, value)
+    operation.set_param('modifyAction', modify_action)
 
+  def _modify_action(self, modify_how, what, next, updated_elements,
+                     bundled_annotations):
+    """Returns the modifyAction parameter describing an _execute call."""
     modify_action = {'modifyHow': modify_how}
     if modify_how == BlipRefs.DELETE:
       pass
@@ -490,8 +768,6 @@ class BlipRefs(object):
     elif (modify_how == BlipRefs.REPLACE or
           modify_how == BlipRefs.INSERT or
           modify_how == BlipRefs.INSERT_AFTER):
-      if callable(what):
-        what = matched
       if what:
         if not isinstance(next, element.Element):
           modify_action['values'] = [util.force_unicode(value) for value in what]
@@ -505,9 +781,7 @@ class BlipRefs(object):
     if bundled_annotations:
       modify_action['bundledAnnotations'] = [
           {'key': key, 'value': value} for key, value in bundled_annotations]
-    operation.set_param('modifyAction', modify_action)
-
-    return self
+    return modify_action
 
   def insert(self, what, bundled_annotations=None):
     """Inserts what at the matched positions."""
@@ -570,7 +844,7 @@ class BlipRefs(object):
       if end - start == 1 and start in self._blip._elements:
         return self._blip._elements[start]
       else:
-        return self._blip.text[start:end]
+        return self._blip._rope[start:end]
     raise ValueError('BlipRefs has no values')
 
   def __getattr__(self, attribute):
@@ -646,10 +920,11 @@ class Blip(object):
                                       annjson['value'],
                                       r['start'],
                                       r['end'])
-    self._elements = {}
     json_elements = json.get('elements', {})
-    for elem in json_elements:
-      self._elements[int(elem)] = element.Element.from_json(json_elements[elem])
+    self._elements = Elements(dict(
+        [(int(elem), element.Element.from_json(json_elements[elem]))
+         for elem in json_elements]))
+    self._search_index = None
     self.raw_data = json
 
   @property
@@ -738,10 +1013,7 @@ class Blip(object):
     parent = self.parent_blip
     if not parent:
       return -1
-    for offset, el in parent._elements.items():
-      if el.type == element.Element.INLINE_BLIP_TYPE and el.id == self.blip_id:
-        return offset
-    return -1
+    return parent._elements._offset_of_inline_blip(self.blip_id)
 
   def is_root(self):
     """Returns whether this is the root blip of a wavelet."""
@@ -764,7 +1036,7 @@ class Blip(object):
     return self._elements.values()
 
   def __len__(self):
-    return len(self._content)
+    return len(self._rope)
 
   def __getitem__(self, item):
     """returns a BlipRefs for the given slice."""
@@ -785,14 +1057,77 @@ class Blip(object):
 
   def _shift(self, where, inc):
     """Move element and annotations after 'where' up by 'inc'."""
-    new_elements = {}
-    for idx, el in self._elements.items():
-      if idx >= where:
-        idx += inc
-      new_elements[idx] = el
-    self._elements = new_elements
+    self._elements._shift(where, inc)
     self._annotations._shift(where, inc)
     
+  def _replace_range(self, start, end, text):
+    """Replaces the content between 'start' and 'end' with 'text'."""
+    self._elements._delete_range(start, end)
+    # in the case of a replace, and the replacement text is shorter,
+    # delete the delta.
+    if start != end and len(text) < end - start:
+      self._delete_annotations(start + len(text), end)
+    self._shift(end, len(text) + start - end)
+    self._rope.replace(start, end, text)
+
+  def _replace_ranges(self, edits):
+    """Applies a batch of replacements in a single pass.
+
+    Gives the same result as calling _replace_range for each edit in turn,
+    adjusting the offsets of later edits, but rebuilds the content,
+    elements and annotations once rather than once per edit.
+
+    Args:
+      edits: sorted, non-overlapping (start, end, text) tuples, in the
+          coordinates of the current content.
+    """
+    content = self._content
+    pieces = []
+    last = 0
+    for start, end, text in edits:
+      pieces.append(content[last:start])
+      pieces.append(text)
+      last = end
+    pieces.append(content[last:])
+    offsets = [(start, end, len(text)) for start, end, text in edits]
+    self._elements._remap(offsets)
+    self._annotations._remap(offsets)
+    self._content = content[:0].join(pieces)
+
+  def _text_index(self):
+    """Returns a textindex.TextIndex over the current content."""
+    text = self._rope.text
+    # The rope hands out the same string until the content is edited.
+    if self._search_index is None or self._search_index.text is not text:
+      self._search_index = textindex.TextIndex(text)
+    return self._search_index
+
+  def _find_text(self, patterns, maxres=-1):
+    """Returns or iterates the ranges where any of patterns occurs.
+
+    A lookup for the first few hits of a single string right after an
+    edit walks the pieces of the rope rather than joining the whole text
+    for a new index.
+    """
+    index = self._search_index
+    if (maxres > 0 and len(patterns) == 1 and
+        isinstance(patterns[0], basestring) and
+        (index is None or index.text is not self._rope.joined_text)):
+      return self._find_in_rope(patterns[0], maxres)
+    return self._text_index().find(patterns, maxres)
+
+  def _find_in_rope(self, what, maxres):
+    if not what:
+      return
+    count = 0
+    idx = self._rope.find(what)
+    while idx != -1:
+      yield idx, idx + len(what)
+      count += 1
+      if count == maxres:
+        return
+      idx = self._rope.find(what, idx + len(what))
+
   def _delete_annotations(self, start, end):
     """Delete all annotations between 'start' and 'end'."""
     for annotation_name in self._annotations.names():
@@ -802,6 +1137,8 @@ class Blip(object):
     """Returns a BlipRefs object representing all results for the search.
     If searching for an element, the restrictions can be used to specify
     additional element properties to filter on, like the url of a Gadget.
+    findwhat can also be a compiled regular expression or a list of strings
+    and regular expressions, which are all searched for in a single pass.
     """
     return BlipRefs.all(self, findwhat, maxres, **restrictions)
 
@@ -809,6 +1146,7 @@ class Blip(object):
     """Returns a BlipRefs object representing the first result for the search.
     If searching for an element, the restrictions can be used to specify
     additional element properties to filter on, like the url of a Gadget.
+    Like for all(), findwhat can also be a regular expression or a list.
     """
     return BlipRefs.all(self, findwhat, 1, **restrictions)
 
@@ -869,7 +1207,17 @@ class Blip(object):
   @property
   def text(self):
     """Returns the raw text content of this document."""
-    return self._content
+    return self._rope.text
+
+  def _get_content(self):
+    return self._rope.text
+
+  def _set_content(self, content):
+    self._rope = rope.Rope(content)
+
+  # The content is kept in a rope so edits don't copy the whole text;
+  # _content reads and replaces it as a plain string.
+  _content = property(_get_content, _set_content)
 
   def find(self, what, **restrictions):
     """Iterate to matching bits of contents.
@@ -881,7 +1229,7 @@ class Blip(object):
       if end - start == 1 and start in self._elements:
         yield self._elements[start]
       else:
-        yield self._content[start:end]
+        yield self._rope[start:end]
     raise StopIteration
 
   def append(self, what, bundled_annotations=None):
@@ -921,7 +1269,7 @@ class Blip(object):
                                                  self.wavelet_id,
                                                  self.blip_id,
                                                  markup)
-    self._content += util.parse_markup(markup)
+    self._rope.append(util.parse_markup(markup))
 
   def insert_inline_blip(self, position):
     """Inserts an inline blip into this blip at a specific position.
@@ -17,6 +17,8 @@
 """Unit tests for the blip module."""
 
 
+import random
+import re
 import unittest
 
 import blip
@@ -191,6 +193,26 @@ class TestBlip(unittest.TestCase):
     # getting to the key should now throw an exception
     self.assertRaises(KeyError, blip.annotations.__getitem__, key)
 
+  def testAnnotateInsideAnnotation(self):
+    key = 'style/fontWeight'
+    json = ('[{"range":{"start":1,"end":9},"name":"%s","value":"bold"}]'
+            % key)
+    blip = self.new_blip(blipId=ROOT_BLIP_ID,
+                         annotations=simplejson.loads(json))
+    blip.range(3, 5).annotate(key, 'normal')
+    self.assertEquals([(1, 3, 'bold'), (3, 5, 'normal'), (5, 9, 'bold')],
+                      [(a.start, a.end, a.value)
+                       for a in blip.annotations[key]])
+    self.assertEquals(['normal', 'bold'],
+                      [a.value for a in blip.annotations.overlapping(4, 6)])
+    self.assertEquals([], blip.annotations.overlapping(4, 6, 'style/color'))
+
+    # Deleting the middle part lets the two bold parts join again:
+    blip.range(3, 5).delete()
+    self.assertEquals([(1, 7, 'bold')],
+                      [(a.start, a.end, a.value)
+                       for a in blip.annotations[key]])
+
   def testBlipOperations(self):
     blip = self.new_blip(blipId=ROOT_BLIP_ID)
     self.assertEquals(1, len(self.all_blips))
@@ -376,5 +398,106 @@ class TestBlip(unittest.TestCase):
                           parentBlipId=ROOT_BLIP_ID)
     self.assertEqual(offset, child.inline_blip_offset)
 
+  def testElementsInDocumentOrder(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID,
+                         childBlipIds=[CHILD_BLIP_ID],
+                         elements={'20': {'type': 'IMAGE',
+                                          'properties': {'url': 'b'}},
+                                   '5': {'type': 'IMAGE',
+                                         'properties': {'url': 'a'}},
+                                   '14': {'type':
+                                              element.Element.INLINE_BLIP_TYPE,
+                                          'properties': {'id': CHILD_BLIP_ID}}})
+    child = self.new_blip(blipId=CHILD_BLIP_ID, parentBlipId=ROOT_BLIP_ID)
+    self.assertEquals(['a', 'b'],
+                      [img.url for img in blip.find(element.Image)])
+    self.assertEquals([5, 14, 20], blip._elements.keys())
+
+    blip.at(10).insert('xyz')
+    self.assertEquals([5, 17, 23], blip._elements.keys())
+    self.assertEquals(17, child.inline_blip_offset)
+    blip.range(4, 6).delete()
+    self.assertEquals([15, 21], blip._elements.keys())
+    self.assertEquals(['b'], [img.url for img in blip.find(element.Image)])
+
+  def testReplaceAllMatchesOriginalContent(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID, content='texttext text')
+    blip.all('text').replace('x')
+    self.assertEquals('xx x', blip.text)
+    # A replacement containing the search text is not searched again.
+    blip.all('x').replace('xx')
+    self.assertEquals('xxxx xx', blip.text)
+    self.assertEquals(2, len(self.operation_queue))
+
+  def testFindPatterns(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    digits = re.compile('[0-9]+')
+    self.assertEquals(['world', 'another'],
+                      list(blip.find(['another', 'world'])))
+    self.assertEquals('ll', blip.first(re.compile('l+')).value())
+    self.assertEquals([], list(blip.find(digits)))
+    blip.append('line 42')
+    self.assertEquals(['42'], list(blip.find(digits)))
+
+  def testSearchAfterEditDoesNotJoinContent(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID, content='\n' + 'ab' * 3000)
+    for i in xrange(3):
+      blip.first('ba').replace('xy')
+      self.assertEquals(None, blip._rope.joined_text)
+    self.assertEquals('\naxyxyxybab', blip.text[:11])
+    self.assertEquals((3, 5), blip.first('yx')._hits().next())
+    self.assertEquals(3, len(list(blip.find('xy'))))
+
+  def testPatternEditsSendRanges(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    blip.all(['world', re.compile('l+')]).replace(['W', 'L'])
+    self.assertEquals('\nheWo L!\nanother Wine', blip.text)
+    ops = self.operation_queue.serialize()[1:]
+    self.assertEquals([{'start': 22, 'end': 23}, {'start': 7, 'end': 12},
+                       {'start': 3, 'end': 5}],
+                      [op['params']['range'] for op in ops])
+    self.assertEquals([['W'], ['L'], ['W']],
+                      [op['params']['modifyAction']['values'] for op in ops])
+
+  def testBulkEditMatchesSingleEdits(self):
+    rnd = random.Random(3)
+    content = '\n' + ''.join(rnd.choice('ab c') for i in xrange(400))
+    elements = {}
+    for i in xrange(20):
+      elements[str(rnd.randint(1, len(content) - 1))] = {
+          'type': 'IMAGE', 'properties': {'url': str(i)}}
+    annotations = []
+    pos = 0
+    while pos < len(content) - 20:
+      start = pos + rnd.randint(0, 10)
+      pos = start + rnd.randint(1, 10)
+      annotations.append({'range': {'start': start, 'end': pos},
+                          'name': rnd.choice('kl'),
+                          'value': rnd.choice('xy')})
+    edits = [('replace', 'ab'), ('replace', 'a c'), ('replace', 'b'),
+             ('delete', 'ab'), ('insert', 'c'), ('insert_after', 'ba')]
+    for method, findwhat in edits:
+      results = []
+      for threshold in (1, 1000000):
+        self.setUp()
+        saved_threshold = blip.BULK_EDIT_THRESHOLD
+        blip.BULK_EDIT_THRESHOLD = threshold
+        try:
+          b = self.new_blip(blipId=ROOT_BLIP_ID, content=content,
+                            elements=elements, annotations=annotations)
+          refs = b.all(findwhat)
+          if method == 'delete':
+            refs.delete()
+          else:
+            getattr(refs, method)(['', 'xyzw', 'q'],
+                                  bundled_annotations=[('k', 'z')])
+        finally:
+          blip.BULK_EDIT_THRESHOLD = saved_threshold
+        results.append((b.text, sorted(b.annotations.serialize()),
+                        [(k, el.url) for k, el in b._elements.items()],
+                        [op['params'] for op in
+                         self.operation_queue.serialize()]))
+      self.assertEquals(results[0], results[1])
+
 if __name__ == '__main__':
   unittest.main()
@@ -10,60 +10,220 @@ json input from the std in and writes out the json output to stdout.
 for example
   cat events | commandline_robot_runner.py \
       --eventdef-blip_submitted="wavelet.title='title'"
+
+With --batch, every line of the input is a bundle of events. The bundles
+are processed by a pool of processes and the responses are written one per
+line, in the order of the bundles. Throughput and the latency of the
+bundles are reported on stderr. Ids in the responses start afresh for
+every bundle, so the responses of two runs can be diffed. This replays
+recorded bundles, e.g.
+  commandline_robot_runner.py --batch --processes=4 \
+      --eventdef-blip_submitted="wavelet.title='title'" \
+      < bundles.jsonl > responses.jsonl
 """
 
 __author__ = 'douwe@google.com (Douwe Osinga)'
 
+import multiprocessing
+import optparse
 import sys
+import time
+import traceback
 import urllib
 
-from google3.pyglib import app
-from google3.pyglib import flags
-
-from google3.walkabout.externalagents import api
-
-from google3.walkabout.externalagents.api import blip
-from google3.walkabout.externalagents.api import element
-from google3.walkabout.externalagents.api import errors
-from google3.walkabout.externalagents.api import events
-from google3.walkabout.externalagents.api import ops
-from google3.walkabout.externalagents.api import robot
-from google3.walkabout.externalagents.api import util
-
-FLAGS = flags.FLAGS
-
-for event in events.ALL:
-  flags.DEFINE_string('eventdef_' + event.type.lower(),
-                      '',
-                      'Event definition for the %s event' % event.type)
+import blip
+import element
+import errors
+import events
+import jsoncodec
+import ops
+import robot
+import util
 
 
 def handle_event(src, bot, e, w):
   """Handle an event by executing the source code src."""
-  globs = {'e': e, 'w': w, 'api': api, 'bot': bot,
+  globs = {'e': e, 'w': w, 'bot': bot,
            'blip': blip, 'element': element, 'errors': errors,
            'events': events, 'ops': ops, 'robot': robot,
            'util': util}
   exec src in globs
 
 
-def run_bot(input_file, output_file):
-  """Run a robot defined on the command line."""
+def make_bot(eventdefs):
+  """Returns a robot running the source code in eventdefs on events.
+
+  Args:
+    eventdefs: a dictionary from event type, like 'BLIP_SUBMITTED', to the
+        url quoted source code handling events of that type.
+  """
   cmdbot = robot.Robot('Commandline bot')
   for event in events.ALL:
-    src = getattr(FLAGS, 'eventdef_' + event.type.lower())
-    src = urllib.unquote_plus(src)
+    src = urllib.unquote_plus(eventdefs.get(event.type, ''))
     if src:
       cmdbot.register_handler(event,
           lambda event, wavelet, src=src, bot=cmdbot:
               handle_event(src, bot, event, wavelet))
+  return cmdbot
+
+
+def run_bot(input_file, output_file, eventdefs):
+  """Run a robot defined on the command line."""
+  cmdbot = make_bot(eventdefs)
   json_body = unicode(input_file.read(), 'utf8')
   json_response = cmdbot.process_events(json_body)
   output_file.write(json_response)
 
 
+# The robot of a batch worker process.
+_worker_bot = None
+
+
+def _init_worker(eventdefs):
+  global _worker_bot
+  _worker_bot = make_bot(eventdefs)
+
+
+def _reset_ids():
+  """Starts the operation ids and temporary ids of a bundle afresh.
+
+  Otherwise they'd depend on which bundles the process handled before,
+  and responses of runs with several processes couldn't be compared.
+  Only the generators of the ids are reset; the global random state,
+  which e.g. the OAuth nonces come from, is left alone.
+  """
+  ops.OperationQueue._operation_id_lock.acquire()
+  try:
+    ops.OperationQueue._next_operation_id = 1
+  finally:
+    ops.OperationQueue._operation_id_lock.release()
+  ops.OperationQueue._temp_id_random.seed(0)
+
+
+def _process_bundle(line):
+  """Returns the response to a bundle, whether it failed and how long it took.
+
+  A bundle that can't be processed is answered with a JSON object holding
+  the error, so the responses stay in line with the bundles.
+  """
+  start = time.time()
+  _reset_ids()
+  try:
+    response = _worker_bot.process_events(unicode(line, 'utf8'))
+    failed = False
+  except Exception, e:
+    response = jsoncodec.dumps({'error': '%s: %s' % (e.__class__.__name__, e),
+                                'traceback': traceback.format_exc()})
+    failed = True
+  return response, failed, time.time() - start
+
+
+def _percentile(sorted_values, fraction):
+  """Returns the value below which fraction of sorted_values lie."""
+  if not sorted_values:
+    return 0.0
+  index = int(round(fraction * (len(sorted_values) - 1)))
+  return sorted_values[index]
+
+
+def format_report(latencies, failures, elapsed):
+  """Returns a summary of a batch run.
+
+  Args:
+    latencies: seconds each bundle took to process.
+    failures: the number of bundles that couldn't be processed.
+    elapsed: seconds the whole batch took.
+  """
+  latencies = sorted(latencies)
+  if elapsed > 0:
+    throughput = len(latencies) / elapsed
+  else:
+    throughput = 0.0
+  lines = ['%d bundles (%d failed) in %.2f s, %.1f bundles/s' %
+           (len(latencies), failures, elapsed, throughput)]
+  if latencies:
+    lines.append('latency ms: mean %.2f, p50 %.2f, p90 %.2f, p99 %.2f, '
+                 'max %.2f' % (
+                     1000 * sum(latencies) / len(latencies),
+                     1000 * _percentile(latencies, 0.5),
+                     1000 * _percentile(latencies, 0.9),
+                     1000 * _percentile(latencies, 0.99),
+                     1000 * latencies[-1]))
+  return '\n'.join(lines) + '\n'
+
+
+def run_batch(input_file, output_file, eventdefs, processes=None,
+              chunksize=1, report_file=None):
+  """Runs a robot over a stream of bundles, one bundle per line.
+
+  Args:
+    input_file: the file to read the bundles from. Blank lines are skipped.
+    output_file: the file to write a line with the response to each bundle
+        to, in the order of the bundles.
+    eventdefs: the source code of the handlers, see make_bot.
+    processes: the number of processes to run the robot in, the number of
+        cpus by default. With 1, bundles are processed in this process.
+    chunksize: the number of bundles handed to a process at a time.
+    report_file: where to write the report of the run to, if anywhere.
+  Returns:
+    A (latencies, failures, elapsed) tuple as described in format_report.
+  """
+  lines = (line for line in input_file if line.strip())
+  start = time.time()
+  if processes == 1:
+    _init_worker(eventdefs)
+    pool = None
+    results = (_process_bundle(line) for line in lines)
+  else:
+    pool = multiprocessing.Pool(processes, _init_worker, (eventdefs,))
+    # imap hands out results in the order of the bundles, as they're done.
+    results = pool.imap(_process_bundle, lines, chunksize)
+  latencies = []
+  failures = 0
+  try:
+    for response, failed, latency in results:
+      output_file.write(response)
+      output_file.write('\n')
+      latencies.append(latency)
+      failures += failed
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+  elapsed = time.time() - start
+  if report_file is not None:
+    report_file.write(format_report(latencies, failures, elapsed))
+  return latencies, failures, elapsed
+
+
+def parse_args(argv):
+  """Returns the options and the event definitions given in argv."""
+  parser = optparse.OptionParser()
+  parser.add_option('--batch', action='store_true', default=False,
+                    help='Read a bundle of events per line')
+  parser.add_option('--processes', type='int', default=None,
+                    help='Processes to run a batch in, one per cpu by default')
+  parser.add_option('--chunksize', type='int', default=1,
+                    help='Bundles handed to a process at a time')
+  for event in events.ALL:
+    parser.add_option('--eventdef-' + event.type.lower(),
+                      '--eventdef_' + event.type.lower(),
+                      dest=event.type, default='',
+                      help='Event definition for the %s event' % event.type)
+  options, unused_args = parser.parse_args(argv[1:])
+  eventdefs = {}
+  for event in events.ALL:
+    eventdefs[event.type] = getattr(options, event.type)
+  return options, eventdefs
+
+
 def main(argv):
-  run_bot(sys.stdin, sys.stdout)
+  options, eventdefs = parse_args(argv)
+  if options.batch:
+    run_batch(sys.stdin, sys.stdout, eventdefs, processes=options.processes,
+              chunksize=options.chunksize, report_file=sys.stderr)
+  else:
+    run_bot(sys.stdin, sys.stdout, eventdefs)
 
 if __name__ == '__main__':
-  app.run()
+  main(sys.argv)
@@ -2,20 +2,17 @@
 #
 # Copyright 2009 Google Inc. All Rights Reserved.
 
-"""Tests for google3.walkabout.externalagents.api.commandline_robot_runner."""
+"""Tests for commandline_robot_runner."""
 
 __author__ = 'douwe@google.com (Douwe Osinga)'
 
+import random
 import StringIO
+import unittest
 
-from google3.pyglib import app
-from google3.pyglib import flags
-
-from google3.testing.pybase import googletest
-from google3.walkabout.externalagents.api import commandline_robot_runner
-from google3.walkabout.externalagents.api import events
-
-FLAGS = flags.FLAGS
+import commandline_robot_runner
+import events
+import simplejson
 
 
 BLIP_JSON = ('{"wdykLROk*13":'
@@ -56,23 +53,75 @@ EVENTS_JSON = ('[{"timestamp":1242079611003,'
 TEST_JSON = '{"blips":%s,"wavelet":%s,"events":%s}' % (
     BLIP_JSON, WAVELET_JSON, EVENTS_JSON)
 
+EVENTDEFS = {events.WaveletParticipantsChanged.type:
+             'w.title="New title %s" % w.title'}
+
 
-class CommandlineRobotRunnerTest(googletest.TestCase):
+class CommandlineRobotRunnerTest(unittest.TestCase):
 
   def testSimpleFlow(self):
-    FLAGS.eventdef_wavelet_participants_changed = 'x'
-    flag = 'eventdef_' + events.WaveletParticipantsChanged.type.lower()
-    setattr(FLAGS, flag, 'w.title="New title!"')
     input_stream = StringIO.StringIO(TEST_JSON)
     output_stream = StringIO.StringIO()
-    commandline_robot_runner.run_bot(input_stream, output_stream)
+    commandline_robot_runner.run_bot(input_stream, output_stream, EVENTDEFS)
     res = output_stream.getvalue()
     self.assertTrue('wavelet.setTitle' in res)
 
-
-def main(unused_argv):
-  googletest.main()
+  def testParseArgs(self):
+    options, eventdefs = commandline_robot_runner.parse_args(
+        ['runner', '--batch', '--processes=2',
+         '--eventdef-wavelet_participants_changed=w.title%3D%27x%27'])
+    self.assertTrue(options.batch)
+    self.assertEquals(2, options.processes)
+    self.assertEquals('w.title%3D%27x%27',
+                      eventdefs['WAVELET_PARTICIPANTS_CHANGED'])
+    self.assertEquals('', eventdefs['BLIP_SUBMITTED'])
+
+  def RunBatch(self, processes):
+    bundles = [TEST_JSON.replace('A title', 'Title %d' % i) for i in range(6)]
+    bundles.insert(3, '{not json')
+    input_stream = StringIO.StringIO('\n'.join(bundles) + '\n\n')
+    output_stream = StringIO.StringIO()
+    report = StringIO.StringIO()
+    latencies, failures, elapsed = commandline_robot_runner.run_batch(
+        input_stream, output_stream, EVENTDEFS, processes=processes,
+        chunksize=2, report_file=report)
+    self.assertEquals(7, len(latencies))
+    self.assertEquals(1, failures)
+    self.assertTrue(report.getvalue().startswith('7 bundles (1 failed) in '))
+
+    responses = [simplejson.loads(line)
+                 for line in output_stream.getvalue().splitlines()]
+    self.assertEquals(7, len(responses))
+    self.assertTrue('error' in responses.pop(3))
+    self.assertEquals(['New title Title %d' % i for i in range(6)],
+                      [response[1]['params']['waveletTitle']
+                       for response in responses])
+    # Ids don't depend on the bundles a process handled before.
+    self.assertEquals([['0', 'op1']] * 6,
+                      [[op['id'] for op in response]
+                       for response in responses])
+
+  def testBatchInProcess(self):
+    self.RunBatch(1)
+
+  def testBatchInProcessPool(self):
+    self.RunBatch(2)
+
+  def testBatchLeavesGlobalRandomAlone(self):
+    random.seed(5)
+    expected = [random.random() for i in range(2)]
+    random.seed(5)
+    random.random()
+    self.RunBatch(1)
+    self.assertEquals(expected[1], random.random())
+
+  def testFormatReport(self):
+    report = commandline_robot_runner.format_report([0.001, 0.003, 0.002],
+                                                    0, 0.5)
+    self.assertEquals('3 bundles (0 failed) in 0.50 s, 6.0 bundles/s\n'
+                      'latency ms: mean 2.00, p50 2.00, p90 3.00, p99 3.00, '
+                      'max 3.00\n', report)
 
 
 if __name__ == '__main__':
-  app.run()
+  unittest.main()
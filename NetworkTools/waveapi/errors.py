@@ -26,3 +26,18 @@ class Error(Exception):
 
 class RpcError(Error):
   """Wave rpc error."""
+
+
+class BatchRpcError(RpcError):
+  """Some batches of a split up rpc failed.
+
+  Attributes:
+    results: the merged results of the batches that did succeed.
+    failed_operation_ids: ids of the operations in batches that failed or
+        were not sent because an earlier batch they depend on failed.
+  """
+
+  def __init__(self, message, results, failed_operation_ids):
+    RpcError.__init__(self, message)
+    self.results = results
+    self.failed_operation_ids = failed_operation_ids
@@ -62,6 +62,10 @@ class Event(object):
     event.
   """
 
+  # The attribute a handler filter is matched against, for the events
+  # that support filters.
+  filter_property = None
+
   def __init__(self, json, wavelet):
     """Inits this event with JSON data.
 
@@ -220,6 +224,7 @@ class AnnotatedTextChanged(Event):
     value: The value of the annotation that changed.
   """
   type = 'ANNOTATED_TEXT_CHANGED'
+  filter_property = 'name'
 
   def __init__(self, json, wavelet):
     super(AnnotatedTextChanged, self).__init__(json, wavelet)
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A thread-safe pool of keep-alive HTTP connections.
+
+Opening a connection, and for https the TLS handshake on top of it,
+often takes longer than the request itself. The pool keeps connections
+open after a request and hands them out again for the next request to
+the same host.
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+
+def _is_stale(error):
+  """Returns whether error shows that the server closed an idle connection.
+
+  Only failures that leave no doubt the request wasn't answered qualify. A
+  request that timed out may well have been processed, so socket.timeout
+  never does, even though it is a socket.error.
+  """
+  if isinstance(error, socket.timeout):
+    return False
+  if isinstance(error, httplib.BadStatusLine):
+    # Raised when the connection ended before the status line.
+    return True
+  return (isinstance(error, socket.error) and bool(error.args) and
+          error.args[0] in (errno.ECONNRESET, errno.EPIPE))
+
+
+class ConnectionPool(object):
+  """Idle keep-alive connections, keyed by scheme, host and port.
+
+  A connection is only used by one request at a time. Requests made while
+  all idle connections to a host are busy open new ones, up to
+  max_connections per host, after which they wait for one to be done. At
+  most max_idle connections are kept once they are done, and connections
+  that have been idle for longer than idle_timeout seconds are closed. A
+  request on a reused connection that the server closed in the meantime
+  is retried once on a new connection.
+  """
+
+  def __init__(self, max_idle=4, idle_timeout=60, timeout=None,
+               max_connections=None):
+    """Initializes an empty pool.
+
+    Args:
+      max_idle: most idle connections kept per host.
+      idle_timeout: seconds an idle connection is kept.
+      timeout: socket timeout in seconds for new connections, or None for
+          the global default.
+      max_connections: most connections open per host, in use or idle, or
+          None for no limit.
+    """
+    self.max_idle = max_idle
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+    self.max_connections = max_connections
+    self._idle = {}
+    # The number of connections per host, whether in use or idle.
+    self._open = {}
+    self._lock = threading.Lock()
+    self._available = threading.Condition(self._lock)
+
+  def request(self, method, url, body=None, headers=None):
+    """Sends a request and reads the response.
+
+    Args:
+      method: the http method, like 'GET' or 'POST'.
+      url: the absolute url to send the request to.
+      body: the request body, if any.
+      headers: a dictionary of extra headers.
+    Returns:
+      A (status, headers, content) tuple. headers maps the lower cased
+      header names of the response to their values.
+    """
+    status, response_headers, response = self.open(method, url, body,
+                                                   headers)
+    try:
+      content = response.read()
+    finally:
+      response.close()
+    return status, response_headers, content
+
+  def open(self, method, url, body=None, headers=None):
+    """Sends a request and returns the response before reading its body.
+
+    The connection goes back to the pool once the body has been read to
+    the end and the response is closed. Closing it earlier closes the
+    connection.
+
+    Args:
+      method: the http method, like 'GET' or 'POST'.
+      url: the absolute url to send the request to.
+      body: the request body, if any.
+      headers: a dictionary of extra headers.
+    Returns:
+      A (status, headers, response) tuple. headers maps the lower cased
+      header names of the response to their values, and response is a
+      file-like object with read and close methods.
+    """
+    parsed = urlparse.urlsplit(url)
+    scheme = parsed[0].lower()
+    if scheme not in ('http', 'https'):
+      raise ValueError('Unsupported url: %s' % url)
+    key = (scheme, parsed[1].lower())
+    path = parsed[2] or '/'
+    if parsed[3]:
+      path += '?' + parsed[3]
+
+    conn, reused = self._acquire(key)
+    try:
+      try:
+        response = self._send(conn, method, path, body, headers or {})
+      except Exception, e:
+        if not reused or not _is_stale(e):
+          raise
+        # The server closed the connection while it was idle; the new one
+        # takes its place.
+        conn.close()
+        conn = self._connect(key)
+        response = self._send(conn, method, path, body, headers or {})
+    except:
+      self._discard(key, conn)
+      raise
+    return (response.status, dict(response.getheaders()),
+            PooledResponse(self, key, conn, response))
+
+  def close(self):
+    """Closes all idle connections."""
+    self._lock.acquire()
+    try:
+      idle = self._idle
+      self._idle = {}
+      for key, connections in idle.items():
+        self._forget(key, len(connections))
+    finally:
+      self._lock.release()
+    for connections in idle.values():
+      for conn, released in connections:
+        conn.close()
+
+  def idle_count(self, url=None):
+    """Returns the number of idle connections, to the host of url if given."""
+    self._lock.acquire()
+    try:
+      if url is None:
+        return sum([len(c) for c in self._idle.values()])
+      parsed = urlparse.urlsplit(url)
+      return len(self._idle.get((parsed[0].lower(), parsed[1].lower()), []))
+    finally:
+      self._lock.release()
+
+  def _send(self, conn, method, path, body, headers):
+    conn.request(method, path, body, headers)
+    return conn.getresponse()
+
+  def _connect(self, key):
+    scheme, host = key
+    if scheme == 'https':
+      connection_class = httplib.HTTPSConnection
+    else:
+      connection_class = httplib.HTTPConnection
+    if self.timeout is None:
+      return connection_class(host)
+    return connection_class(host, timeout=self.timeout)
+
+  def _acquire(self, key):
+    """Returns an idle connection for key or a new one, and if it is reused.
+
+    Waits for a connection to be done if max_connections are open.
+    """
+    expired = []
+    conn = None
+    self._lock.acquire()
+    try:
+      while True:
+        expired.extend(self._evict(time.time()))
+        connections = self._idle.get(key)
+        if connections:
+          # The most recently used connection is the least likely to be
+          # stale.
+          conn = connections.pop()[0]
+          break
+        count = self._open.get(key, 0)
+        if self.max_connections is None or count < self.max_connections:
+          self._open[key] = count + 1
+          break
+        self._available.wait()
+    finally:
+      self._lock.release()
+    for stale in expired:
+      stale.close()
+    if conn is not None:
+      return conn, True
+    return self._connect(key), False
+
+  def _release(self, key, conn):
+    """Returns conn to the pool, closing it if the pool is full."""
+    self._lock.acquire()
+    try:
+      connections = self._idle.setdefault(key, [])
+      if len(connections) < self.max_idle:
+        connections.append((conn, time.time()))
+        conn = None
+        self._available.notifyAll()
+      else:
+        self._forget(key, 1)
+    finally:
+      self._lock.release()
+    if conn is not None:
+      conn.close()
+
+  def _discard(self, key, conn):
+    """Closes conn, which is in use, making room for another connection."""
+    conn.close()
+    self._lock.acquire()
+    try:
+      self._forget(key, 1)
+    finally:
+      self._lock.release()
+
+  def _forget(self, key, count):
+    """Counts count connections for key as closed; call with the lock held."""
+    remaining = self._open.get(key, 0) - count
+    if remaining > 0:
+      self._open[key] = remaining
+    else:
+      self._open.pop(key, None)
+    self._available.notifyAll()
+
+  def _evict(self, now):
+    """Removes connections idle for too long; call with the lock held."""
+    expired = []
+    for key, connections in self._idle.items():
+      fresh = []
+      for conn, released in connections:
+        if now - released > self.idle_timeout:
+          expired.append(conn)
+        else:
+          fresh.append((conn, released))
+      if len(fresh) < len(connections):
+        self._forget(key, len(connections) - len(fresh))
+      if fresh:
+        self._idle[key] = fresh
+      else:
+        del self._idle[key]
+    return expired
+
+
+class PooledResponse(object):
+  """The body of a response, handing its connection back once read."""
+
+  def __init__(self, pool, key, conn, response):
+    self._pool = pool
+    self._key = key
+    self._conn = conn
+    self._response = response
+
+  def read(self, size=None):
+    """Reads up to size bytes of the body, or all of the rest."""
+    try:
+      if size is None:
+        return self._response.read()
+      return self._response.read(size)
+    except:
+      self._discard()
+      raise
+
+  def close(self):
+    """Releases the connection, or closes it if the body wasn't read."""
+    conn = self._conn
+    if conn is None:
+      return
+    self._conn = None
+    if self._response.isclosed() and not self._response.will_close:
+      self._pool._release(self._key, conn)
+    else:
+      self._pool._discard(self._key, conn)
+
+  def _discard(self):
+    if self._conn is not None:
+      self._pool._discard(self._key, self._conn)
+      self._conn = None
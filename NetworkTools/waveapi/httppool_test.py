@@ -0,0 +1,197 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the httppool module, run against a local http server."""
+
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import time
+import unittest
+
+import httppool
+import ops
+import simplejson
+import waveservice
+
+
+class EchoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers with the request body and the port the client connected from.
+
+  A request to /rpc is answered with just the request body. A request to
+  /drop is answered as usual, after which the connection is
+  closed without telling the client, like an idle timeout would. A
+  request to /slow is answered after half a second.
+  """
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.respond('')
+
+  def do_POST(self):
+    self.respond(self.rfile.read(int(self.headers['Content-Length'])))
+
+  def respond(self, body):
+    self.server.clients.add(self.client_address[1])
+    self.server.paths.append(self.path)
+    if self.path == '/slow':
+      time.sleep(0.5)
+    if self.path == '/rpc':
+      # Answers an rpc with the operations it was sent.
+      content = body
+    else:
+      content = '%s %s' % (self.client_address[1], body)
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(content)))
+    self.send_header('Location', 'http://example.com/')
+    self.end_headers()
+    self.wfile.write(content)
+    if self.path == '/drop':
+      self.close_connection = 1
+
+  def log_message(self, *args):
+    pass
+
+
+class EchoServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), EchoHandler)
+    self.clients = set()
+    self.paths = []
+
+
+class TestConnectionPool(unittest.TestCase):
+  """Tests connection reuse against a local http server."""
+
+  def setUp(self):
+    self.server = EchoServer()
+    self.thread = threading.Thread(target=self.server.serve_forever,
+                                   args=(0.01,))
+    self.thread.setDaemon(True)
+    self.thread.start()
+    self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+    self.pool = httppool.ConnectionPool(max_idle=2)
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def testReusesConnection(self):
+    status, headers, first = self.pool.request('POST', self.url + '/a', 'x')
+    self.assertEquals(200, status)
+    self.assertEquals('http://example.com/', headers['location'])
+    status, headers, second = self.pool.request('GET', self.url + '/b?c=d')
+    self.assertEquals(first.split()[0], second.split()[0])
+    self.assertEquals(1, len(self.server.clients))
+    self.assertEquals(1, self.pool.idle_count(self.url))
+
+  def testReconnectsStaleConnection(self):
+    self.pool.request('GET', self.url + '/drop')
+    time.sleep(0.05)
+    status, headers, content = self.pool.request('POST', self.url, 'again')
+    self.assertEquals(200, status)
+    self.assertTrue(content.endswith(' again'))
+    self.assertEquals(2, len(self.server.clients))
+
+  def testTimeoutIsNotRetried(self):
+    self.pool.timeout = 0.1
+    self.pool.request('GET', self.url)
+    self.assertRaises(socket.timeout, self.pool.request, 'POST',
+                      self.url + '/slow', 'once')
+    time.sleep(0.1)
+    self.assertEquals(['/', '/slow'], self.server.paths)
+    self.assertEquals(0, self.pool.idle_count())
+    self.assertEquals({}, self.pool._open)
+
+  def testEvictsIdleConnections(self):
+    self.pool.idle_timeout = 0.01
+    self.pool.request('GET', self.url)
+    time.sleep(0.05)
+    self.pool.request('GET', self.url)
+    self.assertEquals(2, len(self.server.clients))
+
+  def testConcurrentRequests(self):
+    results = []
+
+    def post(i):
+      results.append(self.pool.request('POST', self.url, str(i))[2])
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals(sorted([str(i) for i in range(8)]),
+                      sorted([content.split()[1] for content in results]))
+    self.assertTrue(self.pool.idle_count() <= 2)
+
+  def testMaxConnections(self):
+    self.pool.max_connections = 1
+    status, headers, response = self.pool.open('GET', self.url)
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(self.pool.request('GET', self.url)))
+    thread.start()
+    time.sleep(0.05)
+    # The second request waits for the connection of the first one.
+    self.assertEquals([], results)
+    response.read()
+    response.close()
+    thread.join()
+    self.assertEquals(200, results[0][0])
+    self.assertEquals(1, len(self.server.clients))
+    self.assertEquals(1, self.pool.idle_count())
+
+  def testWaveServicePostsThroughPool(self):
+    service = waveservice.WaveService(connection_pool=self.pool)
+    status, content = service.http_post(self.url, 'data', {})
+    self.assertEquals(200, status)
+    service.http_post(self.url, 'data', {})
+    self.assertEquals(1, len(self.server.clients))
+
+  def testOpenReleasesConnectionOnceRead(self):
+    status, headers, response = self.pool.open('POST', self.url, 'abc')
+    self.assertEquals(0, self.pool.idle_count())
+    self.assertTrue(response.read(3))
+    response.read()
+    response.close()
+    self.assertEquals(1, self.pool.idle_count())
+
+  def testOpenClosesConnectionOfUnreadResponse(self):
+    status, headers, response = self.pool.open('POST', self.url, 'x' * 1000)
+    response.read(10)
+    response.close()
+    self.assertEquals(0, self.pool.idle_count())
+    self.pool.request('GET', self.url)
+    self.assertEquals(2, len(self.server.clients))
+
+  def testWaveServiceStreamsRpc(self):
+    service = waveservice.WaveService(server_rpc_base=self.url + '/rpc',
+                                      connection_pool=self.pool)
+    queue = ops.OperationQueue()
+    queue.wavelet_modify_tag('w', 'wl', 'a' * 20000)
+    records = list(service.stream_rpc(queue))
+    self.assertEquals(simplejson.loads(simplejson.dumps(
+        queue.serialize(method_prefix='wave'))), records)
+    self.assertEquals(1, self.pool.idle_count())
+
+
+if __name__ == '__main__':
+  unittest.main()
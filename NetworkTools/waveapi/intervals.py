@@ -0,0 +1,201 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An index of sorted, non-overlapping ranges in a document.
+
+Ranges are stored in a treap in document order. Each node records the
+gap since the end of the previous range and its own length rather than
+absolute offsets, so shifting everything after an edit point only
+changes a single node and costs O(log n).
+"""
+
+import random
+
+# Private generator so priorities don't disturb the global random state.
+_random = random.Random()
+
+
+class _Node(object):
+  """A single range in the index."""
+
+  __slots__ = ('gap', 'length', 'value', 'priority', 'left', 'right',
+               'extent', 'count')
+
+  def __init__(self, gap, length, value):
+    self.gap = gap
+    self.length = length
+    self.value = value
+    self.priority = _random.random()
+    self.left = None
+    self.right = None
+    self.extent = gap + length
+    self.count = 1
+
+
+def _extent(node):
+  if node is None:
+    return 0
+  return node.extent
+
+
+def _count(node):
+  if node is None:
+    return 0
+  return node.count
+
+
+def _update(node):
+  node.extent = node.gap + node.length + _extent(node.left) + _extent(
+      node.right)
+  node.count = 1 + _count(node.left) + _count(node.right)
+
+
+def _merge(left, right):
+  """Concatenates two treaps, all of left preceding all of right."""
+  if left is None:
+    return right
+  if right is None:
+    return left
+  if left.priority > right.priority:
+    left.right = _merge(left.right, right)
+    _update(left)
+    return left
+  right.left = _merge(left, right.left)
+  _update(right)
+  return right
+
+
+def _split(node, count):
+  """Splits a treap into its first count ranges and the rest."""
+  if node is None:
+    return None, None
+  if count <= _count(node.left):
+    left, node.left = _split(node.left, count)
+    _update(node)
+    return left, node
+  node.right, right = _split(node.right, count - _count(node.left) - 1)
+  _update(node)
+  return node, right
+
+
+def _walk(root, lo):
+  """Yields (index, start, end, value) for all ranges ending at or after lo.
+
+  Subtrees that end before lo are skipped without being visited.
+  """
+  stack = []
+  node, base, index = root, 0, 0
+  while True:
+    while node is not None and base + node.extent >= lo:
+      stack.append((node, base, index))
+      node = node.left
+    if not stack:
+      return
+    node, base, index = stack.pop()
+    start = base + _extent(node.left) + node.gap
+    end = start + node.length
+    index += _count(node.left)
+    if end >= lo:
+      yield index, start, end, node.value
+    node, base, index = node.right, end, index + 1
+
+
+class IntervalIndex(object):
+  """Sorted, non-overlapping (start, end, value) ranges of a document.
+
+  Ranges may touch and may be empty, which makes the index usable for
+  single positions such as elements as well as for annotations.
+  """
+
+  def __init__(self, ranges=()):
+    self._root = None
+    self.replace(0, 0, ranges)
+
+  def __len__(self):
+    return _count(self._root)
+
+  def __iter__(self):
+    for index, start, end, value in _walk(self._root, 0):
+      yield start, end, value
+
+  def items(self, start, end):
+    """Returns the ranges that overlap or touch [start, end] in order."""
+    res = []
+    for index, item_start, item_end, value in _walk(self._root, start):
+      if item_start > end:
+        break
+      res.append((item_start, item_end, value))
+    return res
+
+  def replace(self, start, end, ranges):
+    """Replaces the ranges returned by items(start, end) with ranges.
+
+    The new ranges have to be sorted and fit between the ranges that
+    remain on either side.
+    """
+    first = len(self)
+    removed = 0
+    for index, item_start, item_end, value in _walk(self._root, start):
+      if removed == 0:
+        first = index
+      if item_start > end:
+        break
+      removed += 1
+    left, rest = _split(self._root, first)
+    middle, right = _split(rest, removed)
+    right_base = _extent(left) + _extent(middle)
+    prev = _extent(left)
+    for item_start, item_end, value in ranges:
+      left = _merge(left, _Node(item_start - prev, item_end - item_start,
+                                value))
+      prev = item_end
+    if right is not None and prev != right_base:
+      # The first remaining range is stored relative to what preceded it.
+      node = right
+      path = []
+      while node is not None:
+        path.append(node)
+        node = node.left
+      path[-1].gap += right_base - prev
+      for node in path:
+        node.extent += right_base - prev
+    self._root = _merge(left, right)
+
+  def shift(self, where, inc):
+    """Moves range boundaries at or after where by inc.
+
+    A range that starts before where but ends at or after it grows or
+    shrinks; ranges starting at or after where move as a whole.
+    """
+    node = self._root
+    base = 0
+    path = []
+    while node is not None:
+      path.append(node)
+      left_end = base + _extent(node.left)
+      if node.left is not None and left_end >= where:
+        node = node.left
+        continue
+      start = left_end + node.gap
+      end = start + node.length
+      if end >= where:
+        if start >= where:
+          node.gap += inc
+        else:
+          node.length += inc
+        for parent in path:
+          parent.extent += inc
+        return
+      base = end
+      node = node.right
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the intervals module."""
+
+
+import random
+import unittest
+
+import intervals
+
+
+def shift_list(ranges, where, inc):
+  """Reference implementation of IntervalIndex.shift on a plain list."""
+  res = []
+  for start, end, value in ranges:
+    if start >= where:
+      start += inc
+    if end >= where:
+      end += inc
+    res.append((start, end, value))
+  return res
+
+
+class TestIntervalIndex(unittest.TestCase):
+  """Tests the interval index against a plain list."""
+
+  def testItems(self):
+    index = intervals.IntervalIndex([(1, 3, 'a'), (5, 8, 'b'), (8, 9, 'c')])
+    self.assertEquals(3, len(index))
+    self.assertEquals([(1, 3, 'a')], index.items(0, 1))
+    self.assertEquals([(1, 3, 'a'), (5, 8, 'b')], index.items(3, 5))
+    self.assertEquals([(5, 8, 'b'), (8, 9, 'c')], index.items(8, 8))
+    self.assertEquals([], index.items(4, 4))
+    self.assertEquals([], index.items(10, 20))
+
+  def testReplace(self):
+    index = intervals.IntervalIndex([(1, 3, 'a'), (5, 8, 'b'), (10, 12, 'c')])
+    index.replace(4, 9, [(4, 6, 'x'), (7, 9, 'y')])
+    self.assertEquals([(1, 3, 'a'), (4, 6, 'x'), (7, 9, 'y'), (10, 12, 'c')],
+                      list(index))
+    index.replace(0, 20, [])
+    self.assertEquals(0, len(index))
+    self.assertEquals([], list(index))
+
+  def testShift(self):
+    index = intervals.IntervalIndex([(1, 3, 'a'), (5, 8, 'b'), (10, 12, 'c')])
+    index.shift(6, 4)
+    self.assertEquals([(1, 3, 'a'), (5, 12, 'b'), (14, 16, 'c')], list(index))
+    index.shift(3, -2)
+    self.assertEquals([(1, 1, 'a'), (3, 10, 'b'), (12, 14, 'c')], list(index))
+    index.shift(20, 5)
+    self.assertEquals([(1, 1, 'a'), (3, 10, 'b'), (12, 14, 'c')], list(index))
+
+  def testMatchesList(self):
+    rnd = random.Random(7)
+    expected = []
+    pos = 0
+    for i in xrange(300):
+      pos += rnd.randint(0, 5)
+      end = pos + rnd.randint(0, 5)
+      expected.append((pos, end, i))
+      pos = end
+    index = intervals.IntervalIndex(expected)
+    for i in xrange(500):
+      where = rnd.randint(0, pos)
+      if rnd.random() < 0.5:
+        inc = rnd.randint(1, 10)
+      else:
+        # Only shrink a gap or a range, as a delete would.
+        k = rnd.randint(1, len(expected) - 1)
+        if rnd.random() < 0.5:
+          where = expected[k][0]
+          inc = -rnd.randint(0, where - expected[k - 1][1])
+        else:
+          where = expected[k][1]
+          inc = -rnd.randint(0, where - expected[k][0])
+      expected = shift_list(expected, where, inc)
+      index.shift(where, inc)
+      self.assertEquals(expected, list(index))
+      lo = rnd.randint(0, pos)
+      hi = rnd.randint(lo, pos)
+      self.assertEquals([r for r in expected if r[1] >= lo and r[0] <= hi],
+                        index.items(lo, hi))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Routes JSON encoding and decoding to the fastest codec available.
+
+The bundled simplejson comes without its C speedups, so it scans and
+encodes in pure Python. The json module of Python 2.6 and later reads and
+writes the same JSON, and usually has C accelerators. dumps and loads use
+it when it has them, and simplejson otherwise or when they are passed an
+option that only simplejson knows.
+"""
+
+import inspect
+
+import simplejson
+
+try:
+  import json as _stdlib_json
+except ImportError:
+  _stdlib_json = None
+
+
+def _options(module):
+  """Returns the keyword arguments dumps and loads of module accept."""
+  return frozenset(inspect.getargspec(module.JSONEncoder.__init__)[0] +
+                   inspect.getargspec(module.JSONDecoder.__init__)[0] +
+                   ['cls'])
+
+
+_backends = {'simplejson': simplejson}
+if _stdlib_json is not None:
+  _backends['json'] = _stdlib_json
+  # Older json modules lack some options, like object_pairs_hook.
+  _simplejson_only_options = _options(simplejson) - _options(_stdlib_json)
+
+
+def is_accelerated(name):
+  """Returns whether the named backend has its C scanner and encoder."""
+  module = _backends.get(name)
+  if module is None:
+    return False
+  return (getattr(module.decoder, 'c_scanstring', None) is not None and
+          getattr(module.encoder, 'c_make_encoder', None) is not None)
+
+
+def _best_backend():
+  for name in ('simplejson', 'json'):
+    if is_accelerated(name):
+      return name
+  return 'simplejson'
+
+
+_backend_name = _best_backend()
+_backend = _backends[_backend_name]
+
+
+def backend():
+  """Returns the name of the backend in use, 'json' or 'simplejson'."""
+  return _backend_name
+
+
+def set_backend(name):
+  """Selects the backend to use by name, 'json' or 'simplejson'.
+
+  Raises:
+    ValueError: if the backend isn't available.
+  """
+  global _backend_name, _backend
+  if name not in _backends:
+    raise ValueError('Unavailable JSON backend: %s' % name)
+  _backend_name = name
+  _backend = _backends[name]
+
+
+def dumps(obj, **kw):
+  """Serializes obj to a JSON str, like simplejson.dumps."""
+  if kw and _backend is not simplejson and (
+      _simplejson_only_options.intersection(kw)):
+    return simplejson.dumps(obj, **kw)
+  return _backend.dumps(obj, **kw)
+
+
+def loads(s, **kw):
+  """Deserializes the JSON document s, like simplejson.loads."""
+  if kw and _backend is not simplejson and (
+      _simplejson_only_options.intersection(kw)):
+    return simplejson.loads(s, **kw)
+  return _backend.loads(s, **kw)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the jsoncodec module."""
+
+
+import unittest
+
+import jsoncodec
+import simplejson
+import testdata
+
+
+class TestJsonCodec(unittest.TestCase):
+  """Tests that every backend reads and writes the same JSON."""
+
+  def setUp(self):
+    self.saved_backend = jsoncodec.backend()
+
+  def tearDown(self):
+    jsoncodec.set_backend(self.saved_backend)
+
+  def testBackendsAgree(self):
+    data = simplejson.loads(testdata.json_string)
+    data['extra'] = {'text': u'caf\xe9 \u2603\n"quoted"', 'number': 1.5,
+                     'list': [None, True, False, -3]}
+    for name in ('json', 'simplejson'):
+      try:
+        jsoncodec.set_backend(name)
+      except ValueError:
+        continue
+      self.assertEquals(simplejson.dumps(data), jsoncodec.dumps(data))
+      self.assertEquals(data, jsoncodec.loads(simplejson.dumps(data)))
+
+  def testOptions(self):
+    data = {'b': [1, 2], 'a': {'d': 1, 'c': 2}}
+    for name in ('json', 'simplejson'):
+      try:
+        jsoncodec.set_backend(name)
+      except ValueError:
+        continue
+      self.assertEquals('{"a":{"c":2,"d":1},"b":[1,2]}',
+                        jsoncodec.dumps(data, sort_keys=True,
+                                        separators=(',', ':')))
+      pairs = jsoncodec.loads('{"b": 1, "a": 2}', object_pairs_hook=list)
+      self.assertEquals([('b', 1), ('a', 2)], pairs)
+
+  def testUnknownBackend(self):
+    self.assertRaises(ValueError, jsoncodec.set_backend, 'yaml')
+    self.assertEquals(self.saved_backend, jsoncodec.backend())
+
+  def testBadJson(self):
+    self.assertRaises(ValueError, jsoncodec.loads, '{"a": ')
+
+
+if __name__ == '__main__':
+  unittest.main()
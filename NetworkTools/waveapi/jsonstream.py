@@ -0,0 +1,178 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental decoding of a JSON array, one element at a time.
+
+The response to an rpc is a JSON array of result records. Rather than
+reading the whole body and decoding it in one go, ArrayDecoder is fed the
+body as it arrives and hands out each record as soon as its closing
+bracket has been read. Data of records that have been handed out is
+dropped, so a response never has to be held twice in memory, and every
+byte is scanned once however small the pieces it arrives in.
+"""
+
+import re
+
+import jsoncodec
+
+# Characters that matter outside and inside of strings.
+_STRUCTURE = re.compile(r'["\[\]{},]')
+_STRING_END = re.compile(r'["\\]')
+_NON_SPACE = re.compile(r'\S')
+
+
+class ArrayDecoder(object):
+  """Splits a JSON array fed in pieces into its decoded elements.
+
+  Only the boundaries of the elements are found here, by following
+  brackets and strings; each element is decoded with jsoncodec.loads.
+  simplejson.scanner isn't used for this: its scan_once can't stop in
+  the middle of a value and pick up there when more data arrives, so a
+  large element fed in small pieces would be scanned again from its
+  start for every piece. The bundled simplejson also has no C scanner,
+  while jsoncodec.loads uses the C decoder of the json module when it
+  is there.
+  """
+
+  def __init__(self, loads=None):
+    """Initializes a decoder that hasn't seen the array start yet.
+
+    Args:
+      loads: the function decoding a single element, jsoncodec.loads by
+          default.
+    """
+    self._loads = loads or jsoncodec.loads
+    # The pieces of the current element that arrived with earlier data.
+    self._pending = []
+    # 0 before the array, 1 between its elements, more inside of them.
+    self._depth = 0
+    self._in_string = False
+    # Whether the character after a backslash is still to come.
+    self._escape = False
+    self._count = 0
+    self._done = False
+
+  def feed(self, data):
+    """Adds data to the array read so far.
+
+    Only data is scanned, with the state left by the data before it, so
+    an element fed in many pieces is joined once, when it is complete.
+
+    Returns:
+      A list of the elements that were completed by data.
+    Raises:
+      ValueError: if data makes for invalid JSON.
+    """
+    if self._done:
+      if _NON_SPACE.search(data):
+        raise ValueError('Extra data after the JSON array')
+      return []
+    pos = 0
+    # Where the part of the current element held in data starts.
+    if self._depth:
+      start = 0
+    else:
+      start = None
+    res = []
+    while True:
+      if self._escape:
+        if pos == len(data):
+          break
+        self._escape = False
+        pos += 1
+      if self._in_string:
+        m = _STRING_END.search(data, pos)
+        if m is None:
+          break
+        pos = m.end()
+        if m.group() == '\\':
+          self._escape = True
+        else:
+          self._in_string = False
+        continue
+      if self._depth == 0:
+        m = _NON_SPACE.search(data, pos)
+        if m is None:
+          break
+        if m.group() != '[':
+          raise ValueError('Expected a JSON array, got %r' % m.group())
+        self._depth = 1
+        pos = start = m.end()
+        continue
+      m = _STRUCTURE.search(data, pos)
+      if m is None:
+        break
+      char = m.group()
+      pos = m.end()
+      if char == '"':
+        self._in_string = True
+      elif char in '[{':
+        self._depth += 1
+      elif self._depth > 1:
+        if char in ']}':
+          self._depth -= 1
+      elif char == '}':
+        raise ValueError('Unexpected } in JSON array')
+      else:
+        # A comma or the closing bracket ends an element.
+        self._pending.append(data[start:m.start()])
+        text = ''.join(self._pending)
+        self._pending = []
+        if text.strip():
+          res.append(self._loads(text))
+          self._count += 1
+        elif char == ',' or self._count:
+          # Only the empty array may close without an element.
+          raise ValueError('Missing element in JSON array')
+        start = pos
+        if char == ']':
+          self._done = True
+          if _NON_SPACE.search(data, pos):
+            raise ValueError('Extra data after the JSON array')
+          return res
+
+    if start is not None and start < len(data):
+      self._pending.append(data[start:])
+    return res
+
+  def close(self):
+    """Checks that the whole array has been fed.
+
+    Raises:
+      ValueError: if the array isn't complete.
+    """
+    if not self._done:
+      raise ValueError('Truncated JSON array')
+
+
+def iter_array(stream, chunk_size=8192, loads=None):
+  """Yields the elements of the JSON array read from stream.
+
+  Args:
+    stream: a file-like object with a read(size) method.
+    chunk_size: how many bytes to read at a time. Elements are yielded once
+        the chunk completing them has been read.
+    loads: the function decoding a single element, jsoncodec.loads by
+        default.
+  Raises:
+    ValueError: if stream doesn't hold a valid JSON array.
+  """
+  decoder = ArrayDecoder(loads)
+  while True:
+    chunk = stream.read(chunk_size)
+    if not chunk:
+      break
+    for element in decoder.feed(chunk):
+      yield element
+  decoder.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the jsonstream module."""
+
+
+import StringIO
+import time
+import unittest
+
+import jsonstream
+import simplejson
+import testdata
+
+
+class RecordingStream(StringIO.StringIO):
+  """A stream that remembers how much of it has been read."""
+
+  def read(self, size=-1):
+    data = StringIO.StringIO.read(self, size)
+    self.consumed = self.tell()
+    return data
+
+
+class TestIterArray(unittest.TestCase):
+  """Tests decoding arrays fed in pieces."""
+
+  def assertDecodes(self, text):
+    for chunk_size in (1, 2, 3, 7, 100000):
+      self.assertEquals(simplejson.loads(text),
+                        list(jsonstream.iter_array(StringIO.StringIO(text),
+                                                   chunk_size)))
+
+  def testElements(self):
+    self.assertDecodes('[]')
+    self.assertDecodes(' [ 1 , -2.5e3, true, null, "" ] ')
+    self.assertDecodes('[[1, [2]], {"a": {"b": [{}]}}, []]')
+
+  def testStrings(self):
+    self.assertDecodes(r'["a,]}", "\"[{", "\\", "\\\"", "\u00e9\n"]')
+    self.assertDecodes(r'[{"]": "\\\\\"}"}, "x"]')
+
+  def testRpcResponse(self):
+    data = simplejson.loads(testdata.json_string)
+    self.assertDecodes(simplejson.dumps(
+        [{'id': '0', 'data': {}}, {'id': 'op1', 'data': data},
+         {'id': 'op2', 'error': {'code': 404, 'message': 'gone'}}]))
+
+  def testInvalid(self):
+    for text in ('[1,]', '[,1]', '[1 2]', '[1', '{}', '[1]x', '[}]', ''):
+      self.assertRaises(ValueError, list,
+                        jsonstream.iter_array(StringIO.StringIO(text), 1))
+
+  def testElementsArriveEarly(self):
+    text = simplejson.dumps([{'id': 'first'}, 'x' * 10000])
+    stream = RecordingStream(text)
+    elements = jsonstream.iter_array(stream, 16)
+    self.assertEquals({'id': 'first'}, elements.next())
+    self.assertTrue(stream.consumed < 100)
+    self.assertEquals(['x' * 10000], list(elements))
+
+  def testDecodedDataIsDropped(self):
+    decoder = jsonstream.ArrayDecoder()
+    decoder.feed('[' + '"%s",' % ('x' * 1000) * 10)
+    self.assertEquals([], decoder._pending)
+    decoder.feed('"abc')
+    self.assertEquals(['"abc'], decoder._pending)
+    self.assertEquals(['abc', 1], decoder.feed('", 1]'))
+    decoder.close()
+
+  def testLargeElementInSmallChunks(self):
+    element = {'blips': ['x\\"y' + 'x' * 4000 + str(i) for i in range(1000)]}
+    text = simplejson.dumps([element, element])
+    self.assertTrue(len(text) > 4000000)
+    start = time.time()
+    self.assertEquals([element, element],
+                      list(jsonstream.iter_array(StringIO.StringIO(text),
+                                                 1024)))
+    # Joining the pieces again with every chunk took minutes.
+    self.assertTrue(time.time() - start < 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -5,6 +5,11 @@ import random
 import urlparse
 import hmac
 import base64
+try:
+    import hashlib # 2.5
+    _sha1 = hashlib.sha1
+except ImportError:
+    import sha as _sha1 # deprecated
 
 VERSION = '1.0' # Hi Blaine!
 HTTP_METHOD = 'GET'
@@ -32,7 +37,8 @@ def generate_timestamp():
 # util function: nonce
 # pseudorandom number
 def generate_nonce(length=8):
-    return ''.join(str(random.randint(0, 9)) for i in range(length))
+    # one draw of length digits, rather than a draw per digit
+    return '%0*d' % (length, random.randrange(10 ** length))
 
 # OAuthConsumer is a data type that represents the identity of the Consumer
 # via its shared secret with the Service Provider.
@@ -507,6 +513,64 @@ class OAuthSignatureMethod_HMAC_SHA1(OAuthSignatureMethod):
         # calculate the digest base 64
         return base64.b64encode(hashed.digest())
 
+# OAuthRequestSigner signs any number of requests with HMAC-SHA1 for one
+# consumer and token, and one http method and url. The result is the same
+# as building an OAuthRequest with from_consumer_and_token and signing it,
+# but the hmac key and the escaped parameters that don't change between
+# requests are only prepared once.
+class OAuthRequestSigner(object):
+
+    def __init__(self, consumer, token=None, http_method='POST', http_url=None):
+        key = '%s&' % escape(consumer.secret)
+        if token:
+            key += escape(token.secret)
+        self.hmac = hmac.new(key, digestmod=_sha1)
+        static = {
+            'oauth_consumer_key': consumer.key,
+            'oauth_version': OAuthRequest.version,
+            'oauth_signature_method': 'HMAC-SHA1',
+        }
+        if token:
+            static['oauth_token'] = token.key
+        request = OAuthRequest(http_method, http_url)
+        # the base string, split where the nonce and the timestamp go. they
+        # are made of digits, which escaping leaves alone.
+        self.base = []
+        text = '%s&%s&' % (escape(request.get_normalized_http_method()),
+                           escape(request.get_normalized_http_url()))
+        names = static.keys() + ['oauth_nonce', 'oauth_timestamp']
+        names.sort()
+        for i, name in enumerate(names):
+            if i:
+                text += escape('&')
+            text += escape('%s=' % escape(name))
+            if name in static:
+                text += escape(escape(str(static[name])))
+            else:
+                self.base.append(text)
+                text = ''
+        self.base.append(text)
+        self.header = 'OAuth realm=""' + ''.join(
+            ', %s="%s"' % (k, escape(str(v))) for k, v in static.iteritems())
+
+    # return the signature for a nonce and timestamp
+    def build_signature(self, nonce, timestamp):
+        hashed = self.hmac.copy()
+        hashed.update('%s%s%s%s%s' % (self.base[0], nonce, self.base[1],
+                                      timestamp, self.base[2]))
+        return base64.b64encode(hashed.digest())
+
+    # return the Authorization header of a new request, like to_header
+    def to_header(self, nonce=None, timestamp=None):
+        if nonce is None:
+            nonce = generate_nonce()
+        if timestamp is None:
+            timestamp = generate_timestamp()
+        signature = self.build_signature(nonce, timestamp)
+        return {'Authorization': '%s, oauth_nonce="%s", oauth_timestamp="%s", '
+                'oauth_signature="%s"' % (self.header, nonce, timestamp,
+                                          escape(signature))}
+
 class OAuthSignatureMethod_PLAINTEXT(OAuthSignatureMethod):
 
     def get_name(self):
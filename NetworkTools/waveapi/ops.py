@@ -22,6 +22,7 @@ applied on the server.
 
 import errors
 import random
+import threading
 import util
 import sys
 
@@ -112,6 +113,141 @@ class Operation(object):
       return self.set_param(param, value)
 
 
+def coalesce_operations(operations):
+  """Returns operations with the ones that can be sent as one merged.
+
+  The following is done, without changing the result of applying the
+  operations:
+    - document.modify and document.appendMarkup operations on a blip that
+      a later blip.delete removes are dropped.
+    - adjacent text inserts on a blip where each continues where the
+      previous one stopped, like appends or typing, become one insert.
+    - adjacent deletes of touching ranges, like repeated backspaces,
+      become one delete.
+    - adjacent annotations with the same key and value over overlapping
+      or touching ranges become one annotation.
+
+  A merged operation keeps the id of the first operation it replaces, and
+  operations that are not merged keep theirs, so the ids in errors
+  reported by the server still point at the operation that caused them.
+  The passed operations are not modified.
+
+  Args:
+    operations: list of Operation objects in the order they are applied.
+  Returns:
+    A new list of operations.
+  """
+  deleted = set()
+  kept = []
+  for op in reversed(operations):
+    if op.method == BLIP_DELETE:
+      deleted.add(_blip_key(op))
+    elif (op.method in (DOCUMENT_MODIFY, DOCUMENT_APPEND_MARKUP) and
+          _blip_key(op) in deleted):
+      continue
+    kept.append(op)
+  kept.reverse()
+
+  res = []
+  for op in kept:
+    if res:
+      merged = _merge_modify(res[-1], op)
+      if merged is not None:
+        res[-1] = merged
+        continue
+    res.append(op)
+  return res
+
+
+def _blip_key(op):
+  return (op.params.get('waveId'), op.params.get('waveletId'),
+          op.params.get('blipId'))
+
+
+def _merge_modify(first, second):
+  """Returns a document.modify doing what first and then second do, or None.
+
+  Only modifies of a single range, or appends to the whole blip, are
+  merged; modifyQuery operations can match anywhere.
+  """
+  if first.method != DOCUMENT_MODIFY or second.method != DOCUMENT_MODIFY:
+    return None
+  params = dict(first.params)
+  second_params = dict(second.params)
+  action = params.pop('modifyAction', None)
+  second_action = second_params.pop('modifyAction', None)
+  where = params.pop('range', None)
+  second_where = second_params.pop('range', None)
+  if (params != second_params or 'modifyQuery' in params or
+      action is None or second_action is None or
+      (where is None) != (second_where is None)):
+    return None
+  if where is not None and min(where['start'], where['end'],
+                               second_where['start'],
+                               second_where['end']) < 0:
+    # Negative offsets count from the end of the blip, which changes.
+    return None
+
+  how = action['modifyHow']
+  second_how = second_action['modifyHow']
+  merged_action = None
+  merged_where = where
+  if how in ('INSERT', 'INSERT_AFTER') and second_how in ('INSERT',
+                                                          'INSERT_AFTER'):
+    values = action.get('values')
+    second_values = second_action.get('values')
+    if (not values or not second_values or len(values) != 1 or
+        len(second_values) != 1 or
+        action.get('bundledAnnotations') !=
+        second_action.get('bundledAnnotations')):
+      return None
+    if where is None:
+      # Appends to the end of the whole blip.
+      if how != 'INSERT_AFTER' or second_how != 'INSERT_AFTER':
+        return None
+    elif (_insert_point(second_how, second_where) !=
+          _insert_point(how, where) + len(values[0])):
+      return None
+    merged_action = dict(action)
+    merged_action['values'] = [values[0] + second_values[0]]
+  elif how == 'DELETE' and second_how == 'DELETE' and where is not None:
+    length = second_where['end'] - second_where['start']
+    if second_where['end'] == where['start']:
+      merged_where = {'start': second_where['start'], 'end': where['end']}
+    elif second_where['start'] == where['start']:
+      merged_where = {'start': where['start'], 'end': where['end'] + length}
+    else:
+      return None
+    merged_action = action
+  elif how == 'ANNOTATE' and second_how == 'ANNOTATE' and where is not None:
+    if (action.get('annotationKey') != second_action.get('annotationKey') or
+        action.get('values') != second_action.get('values') or
+        len(action.get('values', [])) != 1 or
+        action.get('bundledAnnotations') or
+        second_action.get('bundledAnnotations') or
+        second_where['start'] > where['end'] or
+        second_where['end'] < where['start']):
+      return None
+    merged_where = {'start': min(where['start'], second_where['start']),
+                    'end': max(where['end'], second_where['end'])}
+    merged_action = action
+  else:
+    return None
+
+  params = dict(first.params)
+  params['modifyAction'] = merged_action
+  if merged_where is not None:
+    params['range'] = merged_where
+  return Operation(first.method, first.id, params)
+
+
+def _insert_point(modify_how, where):
+  """Returns where an INSERT or INSERT_AFTER on range where puts text."""
+  if modify_how == 'INSERT':
+    return where['start']
+  return where['end']
+
+
 class OperationQueue(object):
   """Wraps the queuing of operations using easily callable functions.
 
@@ -130,6 +266,10 @@ class OperationQueue(object):
 
   # Some class global counters:
   _next_operation_id = 1
+  _operation_id_lock = threading.Lock()
+  # Private generator for temporary ids, so they can be made reproducible
+  # without disturbing the global random state.
+  _temp_id_random = random.Random()
 
   def __init__(self, proxy_for_id=None):
     self.__pending = []
@@ -139,8 +279,8 @@ class OperationQueue(object):
   def _new_blipdata(self, wave_id, wavelet_id, initial_content='',
                     parent_blip_id=None):
     """Creates JSON of the blip used for this session."""
-    temp_blip_id = 'TBD_%s_%s' % (wavelet_id,
-                                  hex(random.randint(0, sys.maxint)))
+    temp_blip_id = 'TBD_%s_%s' % (
+        wavelet_id, hex(self._temp_id_random.randint(0, sys.maxint)))
     return {'waveId': wave_id,
             'waveletId': wavelet_id,
             'blipId': temp_blip_id,
@@ -156,7 +296,8 @@ class OperationQueue(object):
     Returns:
       Blipdata (for the rootblip), WaveletData.
     """
-    wave_id = domain + '!TBD_%s' % hex(random.randint(0, sys.maxint))
+    wave_id = domain + '!TBD_%s' % hex(
+        self._temp_id_random.randint(0, sys.maxint))
     wavelet_id = domain + '!conv+root'
     root_blip_data = self._new_blipdata(wave_id, wavelet_id)
     participants = set(participants)
@@ -182,21 +323,30 @@ class OperationQueue(object):
     operation list, but has a different proxying_for_id set so the robot using
     this new queue will send out operations with the proxying_for field set.
     """
-    res = OperationQueue()
-    res.__pending = self.__pending
-    res._capability_hash = self._capability_hash
+    res = object.__new__(type(self))
+    res.__dict__.update(self.__dict__)
     res._proxy_for_id = proxy
     return res
 
   def set_capability_hash(self, capability_hash):
     self._capability_hash = capability_hash
 
-  def serialize(self, method_prefix=''):
+  def serialize(self, method_prefix='', coalesce=False):
+    """Serializes the pending operations, led by a robot.notify operation.
+
+    Args:
+      method_prefix: prefixed to each method name, see Operation.serialize.
+      coalesce: if True, operations that can be sent as one are merged
+          first, see coalesce_operations. The queue itself is not changed.
+    """
     first = Operation(ROBOT_NOTIFY,
                       NOTIFY_OP_ID,
                       {'capabilitiesHash': self._capability_hash,
                        'protocolVersion': PROTOCOL_VERSION})
-    operations = [first] + self.__pending
+    pending = self.__pending
+    if coalesce:
+      pending = coalesce_operations(pending)
+    operations = [first] + pending
     return [op.serialize(method_prefix=method_prefix) for op in operations]
     res = util.serialize(operations)
     return res
@@ -204,7 +354,11 @@ class OperationQueue(object):
   def copy_operations(self, other_queue):
     """Copy the pending operations from other_queue into this one."""
     for op in other_queue:
-      self.__pending.append(op)
+      self._append(op)
+
+  def _append(self, operation):
+    """Adds operation to the pending operations."""
+    self.__pending.append(operation)
 
   def new_operation(self, method,
                     wave_id=None,
@@ -221,11 +375,14 @@ class OperationQueue(object):
       props['waveletId'] = wavelet_id
     if self._proxy_for_id:
       props['proxyingFor'] = self._proxy_for_id
-    operation = Operation(method,
-                          'op%s' % OperationQueue._next_operation_id,
-                          props)
-    self.__pending.append(operation)
-    OperationQueue._next_operation_id += 1
+    OperationQueue._operation_id_lock.acquire()
+    try:
+      opid = 'op%s' % OperationQueue._next_operation_id
+      OperationQueue._next_operation_id += 1
+    finally:
+      OperationQueue._operation_id_lock.release()
+    operation = Operation(method, opid, props)
+    self._append(operation)
     return operation
 
   def wavelet_append_blip(self, wave_id, wavelet_id, initial_content=''):
@@ -68,5 +68,60 @@ class TestOperationQueue(unittest.TestCase):
     self.assertEqual(ops.PROTOCOL_VERSION, json[0]['params']['protocolVersion'])
     self.assertEqual('wavelet.modifyTag', json[1]['method'])
 
+  def modify(self, q, blip_id, action, where=None):
+    op = q.document_modify('waveid', 'waveletid', blip_id)
+    op.set_param('modifyAction', action)
+    if where is not None:
+      op.set_param('range', {'start': where[0], 'end': where[1]})
+    return op
+
+  def testCoalesceInserts(self):
+    q = ops.OperationQueue()
+    first = self.modify(q, 'b1', {'modifyHow': 'INSERT_AFTER',
+                                  'values': ['hel']})
+    self.modify(q, 'b1', {'modifyHow': 'INSERT_AFTER', 'values': ['lo']})
+    bang = self.modify(q, 'b2', {'modifyHow': 'INSERT_AFTER',
+                                 'values': ['!']})
+    typed = self.modify(q, 'b2', {'modifyHow': 'INSERT', 'values': ['a']},
+                        (3, 4))
+    self.modify(q, 'b2', {'modifyHow': 'INSERT', 'values': ['b']}, (4, 5))
+    self.modify(q, 'b2', {'modifyHow': 'INSERT_AFTER', 'values': ['c']},
+                (4, 5))
+    json = q.serialize(coalesce=True)[1:]
+    self.assertEqual([first.id, bang.id, typed.id],
+                     [op['id'] for op in json])
+    self.assertEqual([['hello'], ['!'], ['abc']],
+                     [op['params']['modifyAction']['values'] for op in json])
+    self.assertEqual({'start': 3, 'end': 4}, json[2]['params']['range'])
+    # The queue itself is left alone.
+    self.assertEqual(6, len(q))
+    self.assertEqual(['hel'], first.params['modifyAction']['values'])
+
+  def testCoalesceDeletesAndAnnotations(self):
+    q = ops.OperationQueue()
+    self.modify(q, 'b1', {'modifyHow': 'DELETE'}, (5, 6))
+    self.modify(q, 'b1', {'modifyHow': 'DELETE'}, (4, 5))
+    self.modify(q, 'b1', {'modifyHow': 'DELETE'}, (4, 6))
+    self.modify(q, 'b1', {'modifyHow': 'ANNOTATE', 'annotationKey': 'k',
+                          'values': ['v']}, (1, 3))
+    self.modify(q, 'b1', {'modifyHow': 'ANNOTATE', 'annotationKey': 'k',
+                          'values': ['v']}, (2, 6))
+    self.modify(q, 'b1', {'modifyHow': 'ANNOTATE', 'annotationKey': 'k',
+                          'values': ['w']}, (6, 7))
+    json = q.serialize(coalesce=True)[1:]
+    self.assertEqual([{'start': 4, 'end': 8}, {'start': 1, 'end': 6},
+                      {'start': 6, 'end': 7}],
+                     [op['params']['range'] for op in json])
+
+  def testCoalesceDroppedByBlipDelete(self):
+    q = ops.OperationQueue()
+    self.modify(q, 'b1', {'modifyHow': 'INSERT_AFTER', 'values': ['x']})
+    q.document_append_markup('waveid', 'waveletid', 'b1', '<b>x</b>')
+    kept = self.modify(q, 'b2', {'modifyHow': 'DELETE'}, (1, 2))
+    delete = q.blip_delete('waveid', 'waveletid', 'b1')
+    json = q.serialize(coalesce=True)[1:]
+    self.assertEqual([kept.id, delete.id], [op['id'] for op in json])
+    self.assertEqual(5, len(q.serialize()))
+
 if __name__ == '__main__':
   unittest.main()
@@ -20,19 +20,22 @@ This module provides the Robot class and RobotListener interface,
 as well as some helper functions for web requests and responses.
 """
 
+import copy
 import logging
+import re
 import sys
+import threading
 
 try:
   __import__('google3') # setup internal test environment
 except ImportError:
   pass
 
-import simplejson
 import blip
 import errors
+import jsoncodec
 import ops
-import simplejson
+import threadpool
 import wavelet
 import waveservice
 
@@ -48,7 +51,8 @@ class Robot(object):
   dispatches events to the appropriate handlers.
   """
 
-  def __init__(self, name, image_url='', profile_url=DEFAULT_PROFILE_URL):
+  def __init__(self, name, image_url='', profile_url=DEFAULT_PROFILE_URL,
+               handler_threads=0, coalesce_operations=False):
     """Initializes self with robot information.
 
     Args:
@@ -57,12 +61,26 @@ class Robot(object):
           for this robot.
       profile_url: (optional) url of a webpage with more information about
           this robot.
+      handler_threads: (optional) number of threads to run the handlers
+          registered as independent on. By default all handlers run in
+          the thread processing the events.
+      coalesce_operations: (optional) if True, operations that can be sent
+          as one are merged before they are returned to the server or sent
+          through the waveservice, see ops.coalesce_operations.
     """
     self._handlers = {}
+    self._dispatch = {}
+    if handler_threads:
+      self._handler_pool = threadpool.ThreadPool(handler_threads,
+                                                 name='handler')
+    else:
+      self._handler_pool = None
     self._name = name
     self._verification_token = None
     self._st = None
-    self._waveservice = waveservice.WaveService()
+    self._coalesce_operations = coalesce_operations
+    self._waveservice = waveservice.WaveService(
+        coalesce_operations=coalesce_operations)
     self._profile_handler = None
     self._image_url = image_url
     self._profile_url = profile_url
@@ -103,11 +121,15 @@ class Robot(object):
     """Return the capabilities hash as a hex string."""
     return hex(self._capability_hash)
 
-  def register_handler(self, event_class, handler, context=None, filter=None):
+  def register_handler(self, event_class, handler, context=None, filter=None,
+                       independent=False):
     """Registers a handler on a specific event type.
 
     Multiple handlers may be registered on a single event type and are
-    guaranteed to be called in order of registration.
+    guaranteed to be called in order of registration. Independent handlers
+    are the exception when the robot has handler threads: they run
+    concurrently, with each other and with the other handlers. Their
+    operations are still sent in order of registration.
 
     The handler takes two arguments, the event object and the corresponding
     wavelet.
@@ -124,9 +146,20 @@ class Robot(object):
       filter: Depending on the event, a filter can be specified that restricts
           for which values the event handler will be called from the server.
           Valuable to restrict the amount of traffic send to the robot.
+          The server sends an event when the filter of any handler for it
+          matches, so for events with a filter_property the filter, a
+          regular expression, is checked again for each handler.
+
+      independent: Whether the handler can run while other handlers do.
+          Such a handler gets an event and wavelet of its own, built from
+          the same data as those of the others, so it doesn't see what
+          the other handlers change and they don't see its changes.
     """
     payload = (handler, event_class, context, filter)
     self._handlers.setdefault(event_class.type, []).append(payload)
+    self._dispatch.setdefault(event_class.type, []).append(
+        (handler, event_class, self._compile_filter(event_class, filter),
+         independent))
     if isinstance(context, list):
       context = ','.join(context)
     self._capability_hash = (self._capability_hash * 13 +
@@ -135,6 +168,15 @@ class Robot(object):
                              hash(context) +
                              hash(filter)) & 0xfffffff
 
+  def _compile_filter(self, event_class, filter):
+    """Returns the compiled filter of a handler, or None if there is none."""
+    if not filter or not event_class.filter_property:
+      return None
+    try:
+      return re.compile(filter)
+    except re.error:
+      return re.compile(re.escape(filter))
+
   def set_verification_token_info(self, token, st=None):
     """Set the verification token used in the ownership verification.
 
@@ -182,7 +224,8 @@ class Robot(object):
         consumer_key=consumer_key,
         consumer_secret=consumer_secret,
         server_rpc_base=server_rpc_base,
-        http_post=self._http_post)
+        http_post=self._http_post,
+        coalesce_operations=self._coalesce_operations)
 
   def register_profile_handler(self, handler):
     """Sets the profile handler for this robot.
@@ -241,22 +284,48 @@ class Robot(object):
       data = {'name': self.name,
               'imageUrl': self.image_url,
               'profileUrl': self.profile_url}
-    return simplejson.dumps(data)
+    return jsoncodec.dumps(data)
 
   def process_events(self, json):
     """Process an incoming set of events encoded as json."""
-    parsed = simplejson.loads(json)
-    pending_ops = ops.OperationQueue()
+    parsed = jsoncodec.loads(json)
+    pending_ops = _HandlerOperationQueue()
     event_wavelet = self.get_waveservice()._wavelet_from_json(parsed, pending_ops)
 
+    # The operations of each handler call, in the order of the calls.
+    calls = []
+    tasks = []
     for event_data in parsed['events']:
-      for payload in self._handlers.get(event_data['type'], []):
-        handler, event_class, context, filter = payload
-        event = event_class(event_data, event_wavelet)
-        handler(event, event_wavelet)
-
+      # Handlers registered with the same event class share the event.
+      built = {}
+      for handler, event_class, filter, independent in self._dispatch.get(
+          event_data['type'], []):
+        event = built.get(event_class)
+        if event is None:
+          event = built[event_class] = event_class(event_data, event_wavelet)
+        if filter is not None:
+          value = getattr(event, event_class.filter_property, None)
+          if value is None or not filter.match(value):
+            continue
+        operations = []
+        calls.append(operations)
+        if independent and self._handler_pool is not None:
+          own_wavelet = self.get_waveservice()._wavelet_from_json(
+              copy.deepcopy(parsed), pending_ops)
+          own_event = event_class(event_data, own_wavelet)
+          tasks.append(self._handler_pool.submit(
+              pending_ops.collect, operations, handler, own_event,
+              own_wavelet))
+        else:
+          pending_ops.collect(operations, handler, event, event_wavelet)
+
+    for task in tasks:
+      task.wait()
+    for operations in calls:
+      pending_ops.copy_operations(operations)
     pending_ops.set_capability_hash(self.capabilities_hash())
-    return simplejson.dumps(pending_ops.serialize())
+    return jsoncodec.dumps(pending_ops.serialize(
+        coalesce=self._coalesce_operations))
 
   def new_wave(self, domain, participants=None, message='', proxy_for_id=None,
                submit=False):
@@ -338,3 +407,32 @@ class Robot(object):
     or new_wave.
     """
     return self.get_waveservice().submit(wavelet_to_submit)
+
+
+class _HandlerOperationQueue(ops.OperationQueue):
+  """An operation queue that keeps the operations of each handler apart.
+
+  While collect runs a handler, the operations it queues, also through
+  proxy_for views of this queue, go to a list of its own. That way handlers
+  running at the same time don't interleave their operations, and they
+  can be added to the queue in a fixed order afterwards.
+  """
+
+  def __init__(self, proxy_for_id=None):
+    ops.OperationQueue.__init__(self, proxy_for_id)
+    self._local = threading.local()
+
+  def collect(self, operations, handler, *args):
+    """Calls handler(*args), adding the operations it queues to operations."""
+    self._local.operations = operations
+    try:
+      handler(*args)
+    finally:
+      self._local.operations = None
+
+  def _append(self, operation):
+    operations = getattr(self._local, 'operations', None)
+    if operations is None:
+      ops.OperationQueue._append(self, operation)
+    else:
+      operations.append(operation)
@@ -16,6 +16,7 @@
 
 """Unit tests for the robot module."""
 
+import time
 import unittest
 
 import events
@@ -166,6 +167,107 @@ class TestRobot(unittest.TestCase):
     self.assertEquals(ops.WAVELET_APPEND_BLIP, operations[1]['method'])
     self.assertEquals('proxyid', operations[1]['params']['proxyingFor'])
 
+  def testEventIsSharedByHandlers(self):
+    seen = []
+    for i in range(2):
+      self.robot.register_handler(events.WaveletParticipantsChanged,
+                                  lambda event, wavelet: seen.append(event))
+    self.robot.process_events(TEST_JSON)
+    self.assertEquals(2, len(seen))
+    self.assertTrue(seen[0] is seen[1])
+
+  def testFilterIsCheckedForEachHandler(self):
+    called = []
+
+    def handler(name):
+      return lambda event, wavelet: called.append(name)
+
+    self.robot.register_handler(events.AnnotatedTextChanged, handler('link'),
+                                filter='link/')
+    self.robot.register_handler(events.AnnotatedTextChanged,
+                                handler('style'), filter='style/')
+    self.robot.register_handler(events.AnnotatedTextChanged, handler('all'))
+    annotation_events = ('[{"timestamp":1242079611003,'
+                         '"modifiedBy":"someguy@test.com",'
+                         '"properties":{"name":"link/manual",'
+                             '"blipId":"wdykLROk*13"},'
+                         '"type":"ANNOTATED_TEXT_CHANGED"}]')
+    self.robot.process_events(TEST_JSON.replace(EVENTS_JSON,
+                                                annotation_events))
+    self.assertEquals(['link', 'all'], called)
+
+  def testIndependentHandlersKeepOperationOrder(self):
+    threaded_robot = robot.Robot('Testy', handler_threads=4)
+
+    def handler(title, delay):
+      def handle(event, wavelet):
+        time.sleep(delay)
+        wavelet.title = title
+        wavelet.reply('reply to ' + title)
+      return handle
+
+    threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                    handler('first', 0.1), independent=True)
+    threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                    handler('second', 0.0))
+    threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                    handler('third', 0.1), independent=True)
+    start = time.time()
+    operations = simplejson.loads(threaded_robot.process_events(TEST_JSON))
+    self.assertTrue(time.time() - start < 0.19)
+    self.assertEquals(
+        ['first', 'reply to first', 'second', 'reply to second',
+         'third', 'reply to third'],
+        [op['params'].get('waveletTitle') or op['params']['blipData']['content']
+         for op in operations[1:]])
+
+  def testIndependentHandlersEditOwnBlips(self):
+    def handler(text, delay, seen):
+      def handle(event, wavelet):
+        time.sleep(delay)
+        wavelet.root_blip.append(text)
+        seen.append(wavelet.root_blip.text)
+      return handle
+
+    results = []
+    for delays in ((0.05, 0.0), (0.0, 0.05)):
+      threaded_robot = robot.Robot('Testy', handler_threads=2)
+      seen = []
+      threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                      handler(' one', delays[0], seen),
+                                      independent=True)
+      threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                      handler(' two', delays[1], seen),
+                                      independent=True)
+      operations = simplejson.loads(threaded_robot.process_events(TEST_JSON))
+      results.append(([op['method'] for op in operations[1:]],
+                       [op['params'] for op in operations[1:]]))
+      self.assertEquals(['\nContent! one', '\nContent! two'], sorted(seen))
+    self.assertEquals(results[0], results[1])
+    self.assertEquals(2, len(results[0][0]))
+
+  def testCoalesceOperations(self):
+    def handler(event, wavelet):
+      wavelet.root_blip.append('one')
+      wavelet.root_blip.append(' two')
+
+    counts = []
+    for coalesce in (False, True):
+      bot = robot.Robot('Testy', coalesce_operations=coalesce)
+      bot.register_handler(events.WaveletParticipantsChanged, handler)
+      counts.append(len(simplejson.loads(bot.process_events(TEST_JSON))))
+    self.assertEquals([3, 2], counts)
+
+  def testIndependentHandlerErrorIsRaised(self):
+    threaded_robot = robot.Robot('Testy', handler_threads=2)
+
+    def handler(event, wavelet):
+      raise ValueError('broken handler')
+
+    threaded_robot.register_handler(events.WaveletParticipantsChanged,
+                                    handler, independent=True)
+    self.assertRaises(ValueError, threaded_robot.process_events, TEST_JSON)
+
   def testCapabilitiesHashIncludesContextAndFilter(self):
     robot1 = robot.Robot('Robot1')
     robot1.register_handler(events.WaveletSelfAdded, lambda: '')
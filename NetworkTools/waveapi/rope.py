@@ -0,0 +1,250 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A rope used to store the text content of a blip.
+
+The rope is a treap of text pieces keyed implicitly on their offset in
+the document. Inserting, deleting and replacing text costs O(log n) in
+the number of pieces instead of copying the whole document.
+"""
+
+import random
+
+#: Pieces are never grown beyond this size by in place appends, and
+#: initial content is cut into pieces of this size.
+LEAF_SIZE = 1024
+
+# Private generator so priorities don't disturb the global random state.
+_random = random.Random()
+
+
+class _Node(object):
+  """A single piece of text in the rope."""
+
+  __slots__ = ('piece', 'left', 'right', 'priority', 'size')
+
+  def __init__(self, piece):
+    self.piece = piece
+    self.left = None
+    self.right = None
+    self.priority = _random.random()
+    self.size = len(piece)
+
+
+def _size(node):
+  if node is None:
+    return 0
+  return node.size
+
+
+def _update(node):
+  node.size = len(node.piece) + _size(node.left) + _size(node.right)
+
+
+def _merge(left, right):
+  """Concatenates two treaps, all of left preceding all of right."""
+  if left is None:
+    return right
+  if right is None:
+    return left
+  if left.priority > right.priority:
+    left.right = _merge(left.right, right)
+    _update(left)
+    return left
+  right.left = _merge(left, right.left)
+  _update(right)
+  return right
+
+
+def _split(node, index):
+  """Splits a treap into the first index characters and the rest."""
+  if node is None:
+    return None, None
+  left_size = _size(node.left)
+  piece_end = left_size + len(node.piece)
+  if index <= left_size:
+    left, node.left = _split(node.left, index)
+    _update(node)
+    return left, node
+  if index >= piece_end:
+    node.right, right = _split(node.right, index - piece_end)
+    _update(node)
+    return node, right
+  offset = index - left_size
+  tail = _Node(node.piece[offset:])
+  right = _merge(tail, node.right)
+  node.piece = node.piece[:offset]
+  node.right = None
+  _update(node)
+  return node, right
+
+
+def _build(text):
+  """Returns a treap holding text cut into LEAF_SIZE pieces."""
+  root = None
+  for i in xrange(0, len(text), LEAF_SIZE):
+    root = _merge(root, _Node(text[i:i + LEAF_SIZE]))
+  return root
+
+
+def _collect(node, start, end, offset, pieces):
+  """Appends the parts of the pieces under node within [start, end)."""
+  if node is None or start >= offset + node.size or end <= offset:
+    return
+  _collect(node.left, start, end, offset, pieces)
+  piece_start = offset + _size(node.left)
+  piece_end = piece_start + len(node.piece)
+  if piece_start < end and piece_end > start:
+    pieces.append(node.piece[max(start - piece_start, 0):end - piece_start])
+  _collect(node.right, start, end, piece_end, pieces)
+
+
+def _append_in_place(node, text):
+  """Appends text to the last piece of node if that piece has room.
+
+  Returns:
+    Whether the text was appended.
+  """
+  path = []
+  while node is not None:
+    path.append(node)
+    node = node.right
+  if not path or len(path[-1].piece) + len(text) > LEAF_SIZE:
+    return False
+  path[-1].piece += text
+  for node in path:
+    node.size += len(text)
+  return True
+
+
+class Rope(object):
+  """Mutable text supporting O(log n) edits.
+
+  Reading the full text back joins the pieces once and caches the result
+  until the next edit, so code that only reads pays for a single copy.
+  """
+
+  def __init__(self, text=''):
+    self._root = _build(text)
+    # The type of the empty document, so an empty rope reads back as
+    # the same kind of string it was created with.
+    self._empty = text[:0]
+    self._text = text
+
+  def __len__(self):
+    return _size(self._root)
+
+  def __iter__(self):
+    """Iterates over the pieces of the rope in document order."""
+    stack = []
+    node = self._root
+    while stack or node is not None:
+      if node is not None:
+        stack.append(node)
+        node = node.left
+      else:
+        node = stack.pop()
+        yield node.piece
+        node = node.right
+
+  def __getitem__(self, item):
+    if isinstance(item, slice):
+      start, stop, step = item.indices(len(self))
+      if step != 1:
+        return self.text[item]
+      return self.slice(start, stop)
+    return self.text[item]
+
+  @property
+  def text(self):
+    """The full text of the rope."""
+    if self._text is None:
+      self._text = self._empty.join(self)
+    return self._text
+
+  @property
+  def joined_text(self):
+    """The full text if it was joined since the last edit, else None."""
+    return self._text
+
+  def slice(self, start, end):
+    """Returns the text between start and end without joining the rope."""
+    if self._text is not None:
+      return self._text[start:end]
+    pieces = []
+    _collect(self._root, start, end, 0, pieces)
+    return self._empty.join(pieces)
+
+  def find(self, sub, start=0, end=None):
+    """Same as str.find on the text of the rope, without joining it.
+
+    The pieces are searched one at a time, each one preceded by the last
+    len(sub) - 1 characters before it so that matches spanning pieces are
+    found too.
+    """
+    if self._text is not None:
+      if end is None:
+        return self._text.find(sub, start)
+      return self._text.find(sub, start, end)
+    length = len(self)
+    # The same adjustments str.find makes.
+    if end is None or end > length:
+      end = length
+    elif end < 0:
+      end = max(end + length, 0)
+    if start < 0:
+      start = max(start + length, 0)
+    if end - start < len(sub):
+      return -1
+    if not sub:
+      return start
+    pieces = []
+    _collect(self._root, start, end, 0, pieces)
+    overlap = len(sub) - 1
+    carry = self._empty
+    # The position of carry in the text.
+    offset = start
+    for piece in pieces:
+      window = carry + piece
+      index = window.find(sub)
+      if index != -1:
+        return offset + index
+      cut = max(len(window) - overlap, 0)
+      carry = window[cut:]
+      offset += cut
+    return -1
+
+  def insert(self, index, text):
+    """Inserts text before position index."""
+    self.replace(index, index, text)
+
+  def delete(self, start, end):
+    """Deletes the text between start and end."""
+    self.replace(start, end, self._empty)
+
+  def append(self, text):
+    """Appends text to the end of the rope."""
+    self.replace(len(self), len(self), text)
+
+  def replace(self, start, end, text):
+    """Replaces the text between start and end with text."""
+    if start == end and not text:
+      return
+    self._text = None
+    left, rest = _split(self._root, start)
+    middle, right = _split(rest, end - start)
+    if text and not _append_in_place(left, text):
+      for i in xrange(0, len(text), LEAF_SIZE):
+        left = _merge(left, _Node(text[i:i + LEAF_SIZE]))
+    self._root = _merge(left, right)
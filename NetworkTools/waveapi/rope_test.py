@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the rope module."""
+
+
+import random
+import unittest
+
+import rope
+
+
+class TestRope(unittest.TestCase):
+  """Tests the rope against plain string slicing."""
+
+  def testEmpty(self):
+    r = rope.Rope()
+    self.assertEquals(0, len(r))
+    self.assertEquals('', r.text)
+    self.assertEquals(-1, r.find('a'))
+    r = rope.Rope(u'')
+    self.assertTrue(isinstance(r.text, unicode))
+
+  def testEdits(self):
+    r = rope.Rope('\nhello world!')
+    r.replace(7, 12, 'jupiter')
+    self.assertEquals('\nhello jupiter!', r.text)
+    r.delete(2, 5)
+    self.assertEquals('\nho jupiter!', r.text)
+    r.insert(3, 'la')
+    self.assertEquals('\nhola jupiter!', r.text)
+    r.append(u' \u0430')
+    self.assertEquals(u'\nhola jupiter! \u0430', r.text)
+    self.assertEquals(16, len(r))
+    self.assertEquals(6, r.find('jupiter'))
+    self.assertEquals('jupiter', r[6:13])
+    self.assertEquals('h', r[1])
+
+  def testMatchesString(self):
+    rnd = random.Random(42)
+    text = ''.join(rnd.choice('abc\n ') for i in xrange(5000))
+    r = rope.Rope(text)
+    for i in xrange(500):
+      start = rnd.randint(0, len(text))
+      end = rnd.randint(start, min(len(text), start + 50))
+      new = ''.join(rnd.choice('xyz') for j in xrange(rnd.randint(0, 30)))
+      text = text[:start] + new + text[end:]
+      r.replace(start, end, new)
+      self.assertEquals(len(text), len(r))
+      if i % 10 == 0:
+        self.assertEquals(text[start:end + 20], r[start:end + 20])
+    self.assertEquals(text, r.text)
+    self.assertEquals(text.find('xyz'), r.find('xyz'))
+
+  def testFindAcrossPieces(self):
+    rnd = random.Random(7)
+    text = ''.join(rnd.choice('ab') for i in xrange(rope.LEAF_SIZE * 4))
+    r = rope.Rope(text)
+    for i in xrange(40):
+      index = rnd.randint(0, len(text))
+      text = text[:index] + 'xyz' + text[index:]
+      r.insert(index, 'xyz')
+    size = rope.LEAF_SIZE
+    text = text[:size - 1] + 'needle' + text[size + 5:]
+    r.replace(size - 1, size + 5, 'needle')
+    for sub in ('needle', 'xyz', 'abab', 'zx', 'b', '', 'q', 'ab' * 1000):
+      for start, end in ((0, None), (size, None), (-50, None), (3, 2),
+                         (10, size + 2), (0, -size), (len(text), None),
+                         (len(text) + 1, None)):
+        self.assertEquals(text.find(sub, start, end),
+                          r.find(sub, start, end))
+    # Searching doesn't join the rope.
+    self.assertEquals(None, r._text)
+
+  def testLargeAppends(self):
+    r = rope.Rope()
+    chunk = 'x' * (rope.LEAF_SIZE + 7)
+    for i in xrange(5):
+      r.append(chunk)
+      r.append('y')
+    self.assertEquals((chunk + 'y') * 5, r.text)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,349 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Script to run the performance benchmarks in this package.
+
+Each benchmark prints the best of a few timings for the code paths it
+compares. Run it before and after touching one of the hot paths.
+"""
+
+
+import httplib
+import threading
+import time
+
+import blip
+import element
+import events
+import jsoncodec
+import oauth
+import ops
+import robot
+import robot_test
+import simplejson
+import standalone_robot_runner
+import util
+import waveservice
+
+
+def BestTime(func, repeat=3):
+  """Returns the fastest of repeat runs of func, in seconds."""
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+def Report(name, timings):
+  """Prints the (label, seconds) timings of a benchmark."""
+  print name
+  for label, seconds in timings:
+    print '  %-30s %8.2f ms' % (label, seconds * 1000)
+
+
+def BenchmarkReplaceAll():
+  """Replaces every occurrence of a word in a large annotated blip."""
+  content = '\n' + 'lorem ipsum dolor sit amet ' * 4000
+  annotations = [{'range': {'start': i, 'end': i + 5},
+                  'name': 'style/fontWeight', 'value': 'bold'}
+                 for i in xrange(1, len(content) - 5, 60)]
+  elements = dict((str(i), {'type': 'IMAGE', 'properties': {'url': 'x'}})
+                  for i in xrange(3, len(content), 500))
+
+  def Run():
+    b = blip.Blip({'blipId': 'b+1', 'waveId': 'w', 'waveletId': 'wl',
+                   'content': content, 'annotations': annotations,
+                   'elements': elements}, {}, ops.OperationQueue())
+    b.all('ipsum').replace('ip')
+
+  timings = []
+  saved_threshold = blip.BULK_EDIT_THRESHOLD
+  try:
+    for label, threshold in (('one hit at a time', 1000000000),
+                             ('single pass', 1)):
+      blip.BULK_EDIT_THRESHOLD = threshold
+      timings.append((label, BestTime(Run)))
+  finally:
+    blip.BULK_EDIT_THRESHOLD = saved_threshold
+  Report('blip.all(...).replace() with 4000 hits', timings)
+
+
+def BenchmarkFindTerms():
+  """Looks for a few dozen terms in a large blip."""
+  words = ['term%d' % i for i in xrange(40)]
+  filler = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'tempor']
+  content = '\n' + ' '.join(filler[i % 6] + ' ' + words[i % 43 % 40]
+                             for i in xrange(10000))
+  b = blip.Blip({'blipId': 'b+1', 'waveId': 'w', 'waveletId': 'wl',
+                 'content': content}, {}, ops.OperationQueue())
+
+  def OneByOne():
+    for word in words:
+      _FindAll(b.text, word)
+
+  def MultiPattern():
+    # Drop the cached index, so the timing includes the scan.
+    b._search_index = None
+    list(b.all(words)._hits())
+
+  Report('finding 40 terms in %d characters' % len(content),
+         [('one str.find loop per term', BestTime(OneByOne)),
+          ('single multi-pattern search', BestTime(MultiPattern))])
+
+
+def _FindAll(text, word):
+  """The str.find loop blip searches used to run for each term."""
+  res = []
+  idx = text.find(word)
+  while idx != -1:
+    res.append((idx, idx + len(word)))
+    idx = text.find(word, idx + len(word))
+  return res
+
+
+def BenchmarkWaveletFromJson():
+  """Builds a wavelet of 1000 blips and reads its root blip."""
+  service = waveservice.WaveService()
+  blip_ids = ['b+%d' % i for i in xrange(1000)]
+  blips = {}
+  for blip_id in blip_ids:
+    blips[blip_id] = {
+        'blipId': blip_id, 'waveId': 'w', 'waveletId': 'wl',
+        'content': '\n' + 'some text in the blip ' * 20,
+        'annotations': [{'range': {'start': i, 'end': i + 4},
+                         'name': 'style/fontWeight', 'value': 'bold'}
+                        for i in xrange(1, 400, 20)],
+        'elements': {'5': {'type': 'IMAGE', 'properties': {'url': 'x'}}},
+        'threadId': ''}
+  json = {'wavelet': {'waveId': 'w', 'waveletId': 'wl',
+                      'rootBlipId': blip_ids[0],
+                      'rootThread': {'id': '', 'location': -1,
+                                     'blipIds': blip_ids}},
+          'blips': blips}
+
+  def RootOnly():
+    service._wavelet_from_json(json, ops.OperationQueue()).root_blip.text
+
+  def AllBlips():
+    service._wavelet_from_json(json, ops.OperationQueue()).blips.values()
+
+  Report('wavelet of 1000 blips from json',
+         [('reading the root blip', BestTime(RootOnly)),
+          ('building every blip', BestTime(AllBlips))])
+
+
+def BenchmarkJson():
+  """Encodes and decodes a large wavelet and a page of search results."""
+  blips = {}
+  for i in xrange(300):
+    blip_id = 'b+%d' % i
+    blips[blip_id] = {
+        'blipId': blip_id, 'waveId': 'example.com!w+1',
+        'waveletId': 'example.com!conv+root', 'parentBlipId': None,
+        'content': u'\nsome text in the blip, caf\xe9 ' * 20,
+        'contributors': ['a@example.com', 'b@example.com'],
+        'annotations': [{'range': {'start': j, 'end': j + 4},
+                         'name': 'style/fontWeight', 'value': 'bold'}
+                        for j in xrange(1, 400, 20)],
+        'elements': {'5': {'type': 'IMAGE', 'properties': {'url': 'x'}}},
+        'lastModifiedTime': 1270000000000 + i, 'version': i}
+  wavelet_json = simplejson.dumps({'blips': blips, 'wavelet': {
+      'waveId': 'example.com!w+1', 'waveletId': 'example.com!conv+root',
+      'rootBlipId': 'b+0', 'participants': ['a@example.com']}})
+  search_json = simplejson.dumps({'searchResults': {
+      'query': 'in:inbox', 'numResults': 100,
+      'digests': [{'waveId': 'example.com!w+%d' % i, 'title': 'Wave %d' % i,
+                   'snippet': 'a snippet of the wave ' * 5,
+                   'participants': ['a@example.com', 'b@example.com'],
+                   'blipCount': 10, 'unreadCount': 2,
+                   'lastModified': 1270000000000 + i}
+                  for i in xrange(100)]}})
+
+  saved_backend = jsoncodec.backend()
+  try:
+    for payload_name, payload in (('wavelet', wavelet_json),
+                                  ('search', search_json)):
+      data = simplejson.loads(payload)
+      timings = []
+      for name in ('simplejson', 'json'):
+        try:
+          jsoncodec.set_backend(name)
+        except ValueError:
+          continue
+        timings.append(('loads, %s' % name,
+                        BestTime(lambda: jsoncodec.loads(payload))))
+        timings.append(('dumps, %s' % name,
+                        BestTime(lambda: jsoncodec.dumps(data))))
+      Report('%s payload of %d bytes' % (payload_name, len(payload)), timings)
+  finally:
+    jsoncodec.set_backend(saved_backend)
+
+
+def BenchmarkSerialize():
+  """Serializes a wavelet of 300 blips and a queue of element inserts."""
+  service = waveservice.WaveService()
+  blip_ids = ['b+%d' % i for i in xrange(300)]
+  blips = {}
+  for blip_id in blip_ids:
+    blips[blip_id] = {
+        'blipId': blip_id, 'waveId': 'w', 'waveletId': 'wl',
+        'content': '\n' + 'some text in the blip ' * 20,
+        'annotations': [{'range': {'start': i, 'end': i + 4},
+                         'name': 'style/fontWeight', 'value': 'bold'}
+                        for i in xrange(1, 400, 20)],
+        'elements': dict((str(i), {'type': 'IMAGE',
+                                   'properties': {'url': 'x', 'width': 10}})
+                         for i in xrange(5, 400, 50)),
+        'threadId': ''}
+  wavelet = service._wavelet_from_json(
+      {'wavelet': {'waveId': 'w', 'waveletId': 'wl', 'rootBlipId': 'b+0',
+                   'rootThread': {'id': '', 'location': -1,
+                                  'blipIds': blip_ids}},
+       'blips': blips}, ops.OperationQueue())
+  for blip_id in blip_ids[:100]:
+    b = wavelet.blips[blip_id]
+    for i in xrange(5):
+      b.append(element.Image(url='http://example.com/%d.png' % i,
+                             caption='Image %d' % i))
+  queue = wavelet.get_operation_queue()
+
+  def Run():
+    wavelet.serialize()
+    queue.serialize()
+
+  saved_serialize = util.serialize
+  try:
+    util.serialize = _ReflectiveSerialize
+    before = BestTime(Run)
+  finally:
+    util.serialize = saved_serialize
+  Report('serializing 300 blips and %d operations' % len(queue),
+         [('dir() on every object', before),
+          ('cached per class', BestTime(Run))])
+
+
+def _ReflectiveSerialize(obj):
+  """The util.serialize that looked up every attribute on every call."""
+  if util.is_user_defined_new_style_class(obj):
+    if obj and hasattr(obj, util.CUSTOM_SERIALIZE_METHOD_NAME):
+      method = getattr(obj, util.CUSTOM_SERIALIZE_METHOD_NAME)
+      if callable(method):
+        return method()
+    data = {}
+    for attr_name in dir(obj):
+      if attr_name.startswith('_'):
+        continue
+      attr = getattr(obj, attr_name)
+      if attr is None or callable(attr):
+        continue
+      data[_LowerCamelCase(attr_name)] = _ReflectiveSerialize(attr)
+    return data
+  elif util.is_dict(obj):
+    return dict([(_LowerCamelCase(k), _ReflectiveSerialize(v))
+                 for k, v in obj.items()])
+  elif util.is_iterable(obj):
+    return [_ReflectiveSerialize(v) for v in obj]
+  return obj
+
+
+def _LowerCamelCase(s):
+  return reduce(lambda a, b: a + (a and b.capitalize() or b), s.split('_'))
+
+
+def BenchmarkOAuthSigning():
+  """Signs the headers of 2000 rpcs."""
+  consumer = oauth.OAuthConsumer('google.com:robot@appspot.com', 'secret')
+  token = oauth.OAuthToken('access token', 'token secret')
+  url = waveservice.WaveService.RPC_URL
+
+  def SignRequest():
+    for i in xrange(2000):
+      request = oauth.OAuthRequest.from_consumer_and_token(
+          consumer, token=token, http_method='POST', http_url=url)
+      request.sign_request(waveservice.WaveService.SIGNATURE_METHOD,
+                           consumer, token)
+      request.to_header()
+
+  def Signer():
+    signer = oauth.OAuthRequestSigner(consumer, token, 'POST', url)
+    for i in xrange(2000):
+      signer.to_header()
+
+  Report('2000 signed rpc headers',
+         [('OAuthRequest.sign_request', BestTime(SignRequest)),
+          ('OAuthRequestSigner', BestTime(Signer))])
+
+
+def BenchmarkRobotServer():
+  """Posts 400 bundles of events to a local standalone robot server."""
+  test_robot = robot.Robot('Benchy')
+  test_robot.register_handler(events.WaveletParticipantsChanged,
+                              lambda event, wavelet: wavelet.reply('Hi'))
+  server = standalone_robot_runner.create_server(test_robot, '127.0.0.1', 0,
+                                                 threads=8)
+  thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+  thread.setDaemon(True)
+  thread.start()
+
+  def Post(requests, keep_alive):
+    connection = httplib.HTTPConnection('127.0.0.1', server.server_port)
+    for i in xrange(requests):
+      connection.request('POST', '/_wave/robot/jsonrpc', robot_test.TEST_JSON)
+      connection.getresponse().read()
+      if not keep_alive:
+        connection.close()
+    connection.close()
+
+  def Load(clients, keep_alive):
+    def Run():
+      threads = [threading.Thread(target=Post,
+                                  args=(400 // clients, keep_alive))
+                 for i in xrange(clients)]
+      for client in threads:
+        client.start()
+      for client in threads:
+        client.join()
+    return Run
+
+  try:
+    Report('400 jsonrpc requests to the standalone server',
+           [('1 client, new connections', BestTime(Load(1, False))),
+            ('1 client, kept alive', BestTime(Load(1, True))),
+            ('8 clients, kept alive', BestTime(Load(8, True)))])
+  finally:
+    server.shutdown()
+    server.server_close()
+
+
+def RunBenchmarks():
+  """Runs all registered benchmarks."""
+  benchmarks = [
+      BenchmarkReplaceAll,
+      BenchmarkFindTerms,
+      BenchmarkWaveletFromJson,
+      BenchmarkJson,
+      BenchmarkSerialize,
+      BenchmarkOAuthSigning,
+      BenchmarkRobotServer,
+  ]
+  for benchmark in benchmarks:
+    benchmark()
+
+
+if __name__ == "__main__":
+  RunBenchmarks()
@@ -18,13 +18,23 @@
 
 
 import blip_test
+import commandline_robot_runner_test
 import element_test
+import httppool_test
+import intervals_test
+import jsoncodec_test
+import jsonstream_test
 import module_test_runner
 import ops_test
 import robot_test
+import rope_test
 import util_test
 import wavelet_test
+import waveservice_test
 import search_test
+import standalone_robot_runner_test
+import textindex_test
+import threadpool_test
 
 
 def RunUnitTests():
@@ -32,12 +42,22 @@ def RunUnitTests():
   test_runner = module_test_runner.ModuleTestRunner()
   test_runner.modules = [
       blip_test,
+      commandline_robot_runner_test,
       element_test,
+      httppool_test,
+      intervals_test,
+      jsoncodec_test,
+      jsonstream_test,
       ops_test,
       robot_test,
+      rope_test,
       util_test,
       wavelet_test,
+      waveservice_test,
       search_test,
+      standalone_robot_runner_test,
+      textindex_test,
+      threadpool_test,
   ]
   test_runner.RunAllTests()
 
@@ -0,0 +1,547 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A module to run wave robots in a standalone http server.
+
+Unlike appengine_robot_runner, this needs nothing but the standard library.
+RobotApplication is a plain WSGI application serving the endpoints of one
+or more robots, so it can be mounted in any WSGI container. RobotServer
+runs it itself: requests are answered by a fixed pool of threads, over
+HTTP/1.1 connections that are kept alive between requests. Idle
+connections wait for their next request without holding a thread.
+
+Responses are returned to the server rather than written to sys.stdout,
+so stray print statements in robot code can't corrupt them.
+"""
+
+
+import BaseHTTPServer
+import errno
+import logging
+import os
+import select
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import events
+import threadpool
+
+
+DEFAULT_MAX_BODY_SIZE = 4 * 1024 * 1024
+DEFAULT_THREADS = 16
+DEFAULT_KEEP_ALIVE_TIMEOUT = 15
+
+_WAVE_PATH = '/_wave/'
+
+# Endpoint below _WAVE_PATH -> (name of the RobotApplication method,
+# allowed http methods).
+_ENDPOINTS = {
+    'capabilities.xml': ('_capabilities', ('GET', 'HEAD')),
+    'robot/profile': ('_profile', ('GET', 'HEAD')),
+    'robot/jsonrpc': ('_jsonrpc', ('GET', 'POST')),
+    'verify_token': ('_verify_token', ('GET', 'HEAD')),
+}
+
+_STATUS = BaseHTTPServer.BaseHTTPRequestHandler.responses
+
+
+class _HttpError(Exception):
+  """Raised by the endpoints to answer with an http error."""
+
+  def __init__(self, code, message, headers=None):
+    Exception.__init__(self, message)
+    self.code = code
+    self.headers = headers or []
+
+
+class RobotApplication(object):
+  """A WSGI application serving the endpoints of one or more robots.
+
+  A robot mounted at the prefix '/bot' answers /bot/_wave/capabilities.xml,
+  /bot/_wave/robot/profile, /bot/_wave/robot/jsonrpc and
+  /bot/_wave/verify_token.
+  """
+
+  def __init__(self, robots, max_body_size=DEFAULT_MAX_BODY_SIZE):
+    """Initializes the application.
+
+    Args:
+      robots: the robot to serve under any path, or a dictionary from path
+          prefix, like '' or '/bot', to robot.
+      max_body_size: requests with a larger body are refused.
+    """
+    if isinstance(robots, dict):
+      self._robots = dict((prefix.rstrip('/'), robot)
+                          for prefix, robot in robots.items())
+      self._default = None
+    else:
+      self._robots = {}
+      self._default = robots
+    self.max_body_size = max_body_size
+
+  def __call__(self, environ, start_response):
+    """Answers a request, as a WSGI application."""
+    headers = []
+    try:
+      robot, method = self._route(environ)
+      content_type, body = method(robot, environ)
+      status = '200 OK'
+      headers.append(('Content-Type', content_type))
+    except _HttpError, e:
+      status = '%d %s' % (e.code, _STATUS[e.code][0])
+      headers.append(('Content-Type', 'text/plain'))
+      headers.extend(e.headers)
+      body = str(e)
+    except Exception:
+      logging.exception('Error handling %s %s', environ['REQUEST_METHOD'],
+                        environ.get('PATH_INFO'))
+      status = '500 Internal Server Error'
+      headers.append(('Content-Type', 'text/plain'))
+      body = 'Internal error'
+    headers.append(('Content-Length', str(len(body))))
+    start_response(status, headers)
+    return [body]
+
+  def _route(self, environ):
+    """Returns the robot and endpoint method a request is for."""
+    path = environ.get('PATH_INFO', '')
+    pos = path.find(_WAVE_PATH)
+    if pos == -1 or path[pos + len(_WAVE_PATH):] not in _ENDPOINTS:
+      raise _HttpError(404, 'Not found')
+    robot = self._robots.get(path[:pos].rstrip('/'), self._default)
+    if robot is None:
+      raise _HttpError(404, 'No robot at %s' % path[:pos])
+    name, allowed = _ENDPOINTS[path[pos + len(_WAVE_PATH):]]
+    if environ['REQUEST_METHOD'] not in allowed:
+      raise _HttpError(405, 'Method not allowed',
+                       [('Allow', ', '.join(allowed))])
+    return robot, getattr(self, name)
+
+  def _capabilities(self, robot, environ):
+    return 'application/xml', robot.capabilities_xml()
+
+  def _profile(self, robot, environ):
+    # Responds with a proxied profile if a name is specified.
+    name = _query_param(environ, 'name')
+    if name:
+      return 'application/json', robot.profile_json(name)
+    return 'application/json', robot.profile_json()
+
+  def _jsonrpc(self, robot, environ):
+    if environ['REQUEST_METHOD'] == 'GET':
+      # Useful for debugging, but bundles of events are often too big.
+      json_body = _query_param(environ, 'events')
+    else:
+      json_body = self._read_body(environ)
+    if not json_body:
+      raise _HttpError(400, 'No events')
+    json_body = unicode(json_body, 'utf8')
+    logging.debug('Incoming: %s', json_body)
+    json_response = robot.process_events(json_body)
+    logging.debug('Outgoing: %s', json_response)
+    return 'application/json; charset=utf-8', json_response.encode('utf-8')
+
+  def _verify_token(self, robot, environ):
+    token, st = robot.get_verification_token_info()
+    if token is None:
+      raise _HttpError(404, 'No token set')
+    if st is not None and _query_param(environ, 'st') != st:
+      return 'text/plain', 'Invalid st value passed'
+    return 'text/plain', token
+
+  def _read_body(self, environ):
+    """Returns the body of a request, if it isn't too large."""
+    try:
+      length = int(environ.get('CONTENT_LENGTH') or -1)
+    except ValueError:
+      raise _HttpError(400, 'Invalid Content-Length')
+    if length < 0:
+      raise _HttpError(411, 'Content-Length required')
+    if length > self.max_body_size:
+      raise _HttpError(413, 'Request body larger than %d bytes' %
+                       self.max_body_size)
+    return environ['wsgi.input'].read(length)
+
+
+def _query_param(environ, name):
+  """Returns the first value of a query parameter, or None."""
+  values = urlparse.parse_qs(environ.get('QUERY_STRING', '')).get(name)
+  if values:
+    return values[0]
+  return None
+
+
+class _RequestBody(object):
+  """The body of a request, as far as its Content-Length goes."""
+
+  def __init__(self, rfile, length):
+    self._rfile = rfile
+    self.remaining = length
+
+  def read(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self._rfile.read(size)
+    self.remaining -= len(data)
+    return data
+
+
+class RobotRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Passes requests to the WSGI application of a RobotServer.
+
+  A handler lasts as long as its connection. Unlike other request
+  handlers, it doesn't serve the connection when created; the server calls
+  handle once for every request that arrives on it.
+  """
+
+  protocol_version = 'HTTP/1.1'
+  server_version = 'WaveRobotServer/1.0'
+  # Sends each response in one piece rather than a header at a time, which
+  # on a kept alive connection would wait for delayed acks.
+  wbufsize = -1
+
+  def __init__(self, request, client_address, server):
+    self.request = request
+    self.client_address = client_address
+    self.server = server
+    self.setup()
+
+  def setup(self):
+    # Clients that stall in the middle of a request time out as well.
+    self.timeout = self.server.keep_alive_timeout
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+  def handle(self):
+    """Answers the next request on the connection."""
+    self.close_connection = 1
+    self.handle_one_request()
+
+  def read_ahead(self):
+    """Returns whether data of the next request has been read already.
+
+    That data isn't left on the socket, so the socket won't turn readable
+    for it.
+    """
+    # socket._fileobject keeps what it read ahead in _rbuf.
+    buffered = getattr(self.rfile, '_rbuf', None)
+    return buffered is not None and len(buffered.getvalue()) > 0
+
+  def do_GET(self):
+    self._run_application()
+
+  do_HEAD = do_GET
+  do_POST = do_GET
+
+  def _run_application(self):
+    """Answers the current request with the server's application."""
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+    except ValueError:
+      length = 0
+    body = _RequestBody(self.rfile, max(length, 0))
+    environ = self._environ(body)
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+      response[:] = [status, headers]
+      return chunks.append
+
+    result = self.server.application(environ, start_response)
+    try:
+      for chunk in result:
+        chunks.append(chunk)
+    finally:
+      if hasattr(result, 'close'):
+        result.close()
+    content = ''.join(chunks)
+
+    status, headers = response
+    code, reason = status.split(' ', 1)
+    self.send_response(int(code), reason)
+    for name, value in headers:
+      if name.lower() not in ('content-length', 'connection'):
+        self.send_header(name, value)
+    self.send_header('Content-Length', str(len(content)))
+    # An unread body would be taken for the next request.
+    if body.remaining or self.headers.get('Transfer-Encoding'):
+      self.close_connection = 1
+    if self.close_connection:
+      self.send_header('Connection', 'close')
+    self.end_headers()
+    if self.command != 'HEAD':
+      self.wfile.write(content)
+    self.wfile.flush()
+
+  def _environ(self, body):
+    """Returns the WSGI environment of the current request."""
+    path, query = (self.path.split('?', 1) + [''])[:2]
+    environ = {
+        'REQUEST_METHOD': self.command,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': urllib.unquote(path),
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': self.headers.get('Content-Length', ''),
+        'SERVER_NAME': self.server.server_name,
+        'SERVER_PORT': str(self.server.server_port),
+        'SERVER_PROTOCOL': self.request_version,
+        'REMOTE_ADDR': self.client_address[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in self.headers.items():
+      key = 'HTTP_' + name.upper().replace('-', '_')
+      if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+        environ[key] = value
+    return environ
+
+  def log_message(self, format, *args):
+    logging.debug('%s %s', self.client_address[0], format % args)
+
+
+class _KeepAlivePoller(object):
+  """Waits for the next request on idle keep-alive connections.
+
+  The connections are watched by a single thread. A connection is passed
+  to serve once its next request starts to arrive, and to close once it
+  has been idle for timeout seconds.
+  """
+
+  def __init__(self, timeout, serve, close):
+    self._timeout = timeout
+    self._serve = serve
+    self._close = close
+    self._added = []
+    self._closed = False
+    self._lock = threading.Lock()
+    # Writing to the pipe wakes the thread up to watch added connections.
+    self._wake_read, self._wake_write = os.pipe()
+    self._thread = threading.Thread(target=self._run,
+                                    name='robot-server-keep-alive')
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+  def add(self, handler):
+    """Watches the connection of handler until its next request."""
+    self._lock.acquire()
+    try:
+      closed = self._closed
+      if not closed:
+        self._added.append((handler, time.time() + self._timeout))
+    finally:
+      self._lock.release()
+    if closed:
+      self._close(handler)
+    else:
+      os.write(self._wake_write, 'x')
+
+  def close(self):
+    """Closes the idle connections and stops the thread."""
+    self._lock.acquire()
+    try:
+      self._closed = True
+    finally:
+      self._lock.release()
+    os.write(self._wake_write, 'x')
+    self._thread.join()
+    os.close(self._wake_read)
+    os.close(self._wake_write)
+
+  def _run(self):
+    # The socket of each idle connection -> (handler, deadline).
+    idle = {}
+    while True:
+      self._lock.acquire()
+      try:
+        added = self._added
+        self._added = []
+        closed = self._closed
+      finally:
+        self._lock.release()
+      for handler, deadline in added:
+        idle[handler.connection] = (handler, deadline)
+      if closed:
+        break
+      now = time.time()
+      timeout = None
+      for sock, (handler, deadline) in idle.items():
+        if deadline <= now:
+          del idle[sock]
+          self._close(handler)
+        elif timeout is None or deadline - now < timeout:
+          timeout = deadline - now
+      try:
+        readable = select.select([self._wake_read] + idle.keys(), [], [],
+                                 timeout)[0]
+      except select.error, e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      for sock in readable:
+        if sock == self._wake_read:
+          os.read(self._wake_read, 4096)
+        else:
+          # Also when the client closed the connection, which the handler
+          # notices.
+          self._serve(idle.pop(sock)[0])
+    for handler, deadline in idle.values():
+      self._close(handler)
+
+
+class RobotServer(BaseHTTPServer.HTTPServer):
+  """An http server answering requests on a pool of threads.
+
+  A connection only takes up a thread while a request on it is answered.
+  In between requests, connections that are kept alive wait in a poller,
+  which hands them back to the pool once their next request arrives.
+  """
+
+  allow_reuse_address = True
+
+  def __init__(self, address, application, threads=DEFAULT_THREADS,
+               keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT):
+    """Initializes the server and binds it to address.
+
+    Args:
+      address: the (host, port) to listen on.
+      application: the WSGI application answering requests, usually a
+          RobotApplication.
+      threads: the number of requests answered at the same time.
+      keep_alive_timeout: seconds after which an idle connection is closed.
+    """
+    BaseHTTPServer.HTTPServer.__init__(self, address, RobotRequestHandler)
+    self.application = application
+    self.keep_alive_timeout = keep_alive_timeout
+    self._pool = threadpool.ThreadPool(threads, name='robot-server')
+    self._keep_alive = _KeepAlivePoller(keep_alive_timeout,
+                                        self._submit_request,
+                                        self._close_connection)
+
+  def process_request(self, request, client_address):
+    try:
+      handler = self.RequestHandlerClass(request, client_address, self)
+    except Exception:
+      self.handle_error(request, client_address)
+      self.close_request(request)
+      return
+    self._submit_request(handler)
+
+  def _submit_request(self, handler):
+    self._pool.submit(self._serve_requests, handler)
+
+  def _serve_requests(self, handler):
+    """Answers the requests that have arrived on the connection of handler.
+
+    The connection is then closed, or left to the poller to wait for its
+    next request.
+    """
+    while True:
+      try:
+        handler.handle()
+      except Exception:
+        self.handle_error(handler.request, handler.client_address)
+        handler.close_connection = 1
+      if handler.close_connection:
+        self._close_connection(handler)
+        return
+      if not handler.read_ahead():
+        self._keep_alive.add(handler)
+        return
+
+  def _close_connection(self, handler):
+    try:
+      try:
+        handler.finish()
+      except socket.error:
+        pass
+    finally:
+      self.close_request(handler.request)
+
+  def server_close(self):
+    """Stops listening, and waits for the open connections to finish."""
+    BaseHTTPServer.HTTPServer.server_close(self)
+    self._keep_alive.close()
+    self._pool.close()
+
+
+def operation_error_handler(event, wavelet):
+  """Default operation error handler, logging what went wrong."""
+  if isinstance(event, events.OperationError):
+    logging.error('Previously operation failed: id=%s, message: %s',
+                  event.operation_id, event.error_message)
+
+
+def create_server(robots, host='', port=8080, threads=DEFAULT_THREADS,
+                  max_body_size=DEFAULT_MAX_BODY_SIZE,
+                  keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT):
+  """Returns a RobotServer for robots, bound but not serving yet.
+
+  The arguments are those of run.
+  """
+  return RobotServer((host, port),
+                     RobotApplication(robots, max_body_size=max_body_size),
+                     threads=threads, keep_alive_timeout=keep_alive_timeout)
+
+
+def run(robots, host='', port=8080, threads=DEFAULT_THREADS, log_errors=True,
+        max_body_size=DEFAULT_MAX_BODY_SIZE,
+        keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT):
+  """Serves robots over http until interrupted.
+
+    For example:
+      robot = Robot('Terminator',
+                    image_url='http://www.sky.net/models/t800.png',
+                    profile_url='http://www.sky.net/models/t800.html')
+      robot.register_handler(WAVELET_PARTICIPANTS_CHANGED, KillParticipant)
+      run(robot, port=8080)
+
+    Args:
+      robots: the robot to serve, or a dictionary from path prefix to robot
+          to serve several robots, like {'/t800': robot, '/t1000': other}.
+      host: the interface to listen on, all of them by default.
+      port: the port to listen on.
+      threads: the number of requests answered at the same time.
+      log_errors: Optional flag that defaults to True and determines whether
+          a default handler to log operation errors should be set up.
+      max_body_size: requests with a larger body are refused.
+      keep_alive_timeout: seconds after which an idle connection is closed.
+  """
+  if log_errors:
+    if isinstance(robots, dict):
+      all_robots = robots.values()
+    else:
+      all_robots = [robots]
+    for robot in all_robots:
+      robot.register_handler(events.OperationError, operation_error_handler)
+  server = create_server(robots, host, port, threads=threads,
+                         max_body_size=max_body_size,
+                         keep_alive_timeout=keep_alive_timeout)
+  logging.info('Serving robots on port %d', server.server_port)
+  try:
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+  finally:
+    server.server_close()
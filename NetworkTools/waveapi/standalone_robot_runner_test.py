@@ -0,0 +1,237 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the standalone_robot_runner module."""
+
+
+import httplib
+import logging
+import StringIO
+import threading
+import time
+import unittest
+
+import events
+import robot
+import robot_test
+import simplejson
+import standalone_robot_runner
+
+
+def MakeRobot(name):
+  """Returns a robot that sets the title of wavelets it is added to."""
+  test_robot = robot.Robot(name, image_url='http://example.com/%s.png' % name)
+
+  def OnParticipantsChanged(event, wavelet):
+    wavelet.title = 'Seen by ' + name
+
+  test_robot.register_handler(events.WaveletParticipantsChanged,
+                              OnParticipantsChanged)
+  return test_robot
+
+
+class TestRobotApplication(unittest.TestCase):
+  """Tests the WSGI application by calling it directly."""
+
+  def setUp(self):
+    self.robot = MakeRobot('Testy')
+    self.app = standalone_robot_runner.RobotApplication(self.robot,
+                                                        max_body_size=10000)
+
+  def Call(self, method, path, body='', query='', app=None):
+    environ = {'REQUEST_METHOD': method,
+               'PATH_INFO': path,
+               'QUERY_STRING': query,
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': StringIO.StringIO(body)}
+    response = []
+
+    def StartResponse(status, headers):
+      response[:] = [status, dict(headers)]
+
+    content = ''.join((app or self.app)(environ, StartResponse))
+    status, headers = response
+    self.assertEquals(str(len(content)), headers['Content-Length'])
+    return int(status.split()[0]), headers, content
+
+  def testCapabilities(self):
+    status, headers, content = self.Call('GET', '/_wave/capabilities.xml')
+    self.assertEquals(200, status)
+    self.assertEquals('application/xml', headers['Content-Type'])
+    self.assertEquals(self.robot.capabilities_xml(), content)
+
+  def testProfile(self):
+    status, headers, content = self.Call('GET', '/_wave/robot/profile')
+    self.assertEquals('Testy', simplejson.loads(content)['name'])
+    status, headers, content = self.Call('GET', '/_wave/robot/profile',
+                                         query='name=other')
+    self.assertEquals(self.robot.profile_json('other'), content)
+
+  def testJsonRpc(self):
+    status, headers, content = self.Call('POST', '/_wave/robot/jsonrpc',
+                                         robot_test.TEST_JSON)
+    self.assertEquals(200, status)
+    operations = simplejson.loads(content)
+    self.assertEquals('Seen by Testy',
+                      operations[1]['params']['waveletTitle'])
+
+  def testJsonRpcErrors(self):
+    self.assertEquals(400, self.Call('POST', '/_wave/robot/jsonrpc')[0])
+    self.assertEquals(413, self.Call('POST', '/_wave/robot/jsonrpc',
+                                     'x' * 10001)[0])
+    # The failure is logged with its traceback.
+    logging.disable(logging.ERROR)
+    try:
+      self.assertEquals(500, self.Call('POST', '/_wave/robot/jsonrpc',
+                                       '{not json')[0])
+    finally:
+      logging.disable(logging.NOTSET)
+
+  def testVerifyToken(self):
+    self.assertEquals(404, self.Call('GET', '/_wave/verify_token')[0])
+    self.robot.set_verification_token_info('token', st='secret')
+    self.assertEquals('Invalid st value passed',
+                      self.Call('GET', '/_wave/verify_token')[2])
+    self.assertEquals('token', self.Call('GET', '/_wave/verify_token',
+                                         query='st=secret')[2])
+
+  def testUnknownPathAndMethod(self):
+    self.assertEquals(404, self.Call('GET', '/_wave/unknown')[0])
+    self.assertEquals(404, self.Call('GET', '/index.html')[0])
+    status, headers, content = self.Call('POST', '/_wave/capabilities.xml')
+    self.assertEquals(405, status)
+    self.assertEquals('GET, HEAD', headers['Allow'])
+
+  def testSeveralRobots(self):
+    other = MakeRobot('Other')
+    app = standalone_robot_runner.RobotApplication({'/': self.robot,
+                                                    '/other/': other})
+    content = self.Call('GET', '/_wave/robot/profile', app=app)[2]
+    self.assertEquals('Testy', simplejson.loads(content)['name'])
+    content = self.Call('GET', '/other/_wave/robot/profile', app=app)[2]
+    self.assertEquals('Other', simplejson.loads(content)['name'])
+    self.assertEquals(404, self.Call('GET', '/none/_wave/robot/profile',
+                                     app=app)[0])
+
+
+class TestRobotServer(unittest.TestCase):
+  """Tests the server over local connections."""
+
+  def setUp(self):
+    self.robot = MakeRobot('Testy')
+    self.connections = []
+    self.server = None
+    self.Serve(threads=2, keep_alive_timeout=1)
+
+  def tearDown(self):
+    for connection in self.connections:
+      connection.close()
+    self.StopServing()
+
+  def Serve(self, threads, keep_alive_timeout):
+    self.StopServing()
+    self.server = standalone_robot_runner.create_server(
+        self.robot, host='127.0.0.1', port=0, threads=threads,
+        max_body_size=10000, keep_alive_timeout=keep_alive_timeout)
+    thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+    thread.setDaemon(True)
+    thread.start()
+
+  def StopServing(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+
+  def Connect(self):
+    connection = httplib.HTTPConnection('127.0.0.1', self.server.server_port,
+                                        timeout=5)
+    self.connections.append(connection)
+    return connection
+
+  def Request(self, connection, method, path, body=None):
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    return response, response.read()
+
+  def testKeepAlive(self):
+    connection = self.Connect()
+    response, content = self.Request(connection, 'POST',
+                                     '/_wave/robot/jsonrpc',
+                                     robot_test.TEST_JSON)
+    self.assertEquals(200, response.status)
+    self.assertFalse(response.will_close)
+    socket = connection.sock
+    response, content = self.Request(connection, 'GET',
+                                     '/_wave/capabilities.xml')
+    self.assertEquals(self.robot.capabilities_xml(), content)
+    self.assertTrue(socket is connection.sock)
+
+  def testHead(self):
+    response, content = self.Request(self.Connect(), 'HEAD',
+                                     '/_wave/capabilities.xml')
+    self.assertEquals(200, response.status)
+    self.assertEquals('', content)
+
+  def testTooLargeBodyClosesConnection(self):
+    response, content = self.Request(self.Connect(), 'POST',
+                                     '/_wave/robot/jsonrpc', 'x' * 20000)
+    self.assertEquals(413, response.status)
+    self.assertTrue(response.will_close)
+
+  def testIdleConnectionDoesNotHoldThread(self):
+    self.Serve(threads=1, keep_alive_timeout=10)
+    idle = self.Connect()
+    self.assertEquals(200, self.Request(idle, 'GET',
+                                        '/_wave/capabilities.xml')[0].status)
+    start = time.time()
+    response, content = self.Request(self.Connect(), 'POST',
+                                     '/_wave/robot/jsonrpc',
+                                     robot_test.TEST_JSON)
+    self.assertEquals(200, response.status)
+    self.assertTrue(time.time() - start < 1)
+    # The idle connection is still served as well.
+    response, content = self.Request(idle, 'GET', '/_wave/capabilities.xml')
+    self.assertEquals(self.robot.capabilities_xml(), content)
+
+  def testIdleConnectionTimesOut(self):
+    self.Serve(threads=1, keep_alive_timeout=0.1)
+    connection = self.Connect()
+    self.Request(connection, 'GET', '/_wave/capabilities.xml')
+    time.sleep(0.3)
+    self.assertEquals('', connection.sock.recv(1))
+
+  def testConcurrentConnections(self):
+    results = []
+
+    def Post():
+      connection = self.Connect()
+      for i in range(5):
+        response, content = self.Request(connection, 'POST',
+                                         '/_wave/robot/jsonrpc',
+                                         robot_test.TEST_JSON)
+        results.append(response.status)
+      connection.close()
+
+    # More connections than threads; waiting ones are served once the
+    # connections ahead of them are closed.
+    clients = [threading.Thread(target=Post) for i in range(4)]
+    for client in clients:
+      client.start()
+    for client in clients:
+      client.join()
+    self.assertEquals([200] * 20, results)
+
+
+if __name__ == '__main__':
+  unittest.main()
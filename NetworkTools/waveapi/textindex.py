@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cached text searches over a fixed piece of text.
+
+A blip keeps a TextIndex for its current content and drops it when the
+content changes, so repeated searches between edits are answered from
+the cache. Several patterns are searched for in a single scan by
+combining all plain strings into one regular expression.
+"""
+
+import heapq
+import itertools
+import re
+
+
+def is_pattern(what):
+  """Returns whether what is a compiled regular expression."""
+  return hasattr(what, 'finditer')
+
+
+def _trie_pattern(strings):
+  """Returns a regular expression matching the longest of strings.
+
+  The strings are merged into a trie first, so strings sharing a prefix
+  don't make the regular expression engine try each of them in turn.
+  """
+  trie = {}
+  for s in strings:
+    node = trie
+    for char in s:
+      node = node.setdefault(char, {})
+    # The empty key marks the end of a string.
+    node[''] = None
+  return _node_pattern(trie)
+
+
+def _node_pattern(node):
+  alternatives = [re.escape(char) + _node_pattern(child)
+                  for char, child in sorted(node.items()) if char]
+  if not alternatives:
+    return ''
+  if len(alternatives) == 1 and '' not in node:
+    return alternatives[0]
+  pattern = '(?:%s)' % '|'.join(alternatives)
+  if '' in node:
+    # Optional and greedy, so longer strings win over their prefixes.
+    pattern += '?'
+  return pattern
+
+
+class TextIndex(object):
+  """Answers searches for strings and regular expressions in a text.
+
+  Matches are non-overlapping and found left to right. When several
+  patterns match at the same position the longest match wins. Empty
+  regular expression matches are skipped.
+  """
+
+  def __init__(self, text):
+    self.text = text
+    self._hits = {}
+
+  def find(self, patterns, maxres=-1):
+    """Returns the (start, end) ranges where any of patterns occurs.
+
+    Only searches for all hits are cached; a search for the first few
+    hits stops scanning once it has them, unless all hits are known.
+
+    Args:
+      patterns: a list of strings and compiled regular expressions.
+      maxres: number of results to return at most, or <= 0 for all.
+    """
+    key = tuple(patterns)
+    hits = self._hits.get(key)
+    if hits is None:
+      if maxres > 0:
+        return list(itertools.islice(self._search(patterns), maxres))
+      hits = self._hits[key] = list(self._search(patterns))
+    if maxres > 0:
+      return hits[:maxres]
+    return hits
+
+  def _search(self, patterns):
+    """Iterates the hits of patterns from left to right."""
+    strings = [p for p in patterns if not is_pattern(p) and p]
+    regexes = [p for p in patterns if is_pattern(p)]
+    if len(strings) == 1 and not regexes:
+      return self._find_string(strings[0])
+    if strings:
+      regexes.append(re.compile(_trie_pattern(strings)))
+    if len(regexes) == 1:
+      return self._find_regex(regexes[0])
+    return self._merge(regexes)
+
+  def _find_regex(self, regex):
+    for m in regex.finditer(self.text):
+      if m.end() > m.start():
+        yield m.span()
+
+  def _merge(self, regexes):
+    # Sorted by start with longer hits first, so the longest of the hits
+    # starting at the same position is kept.
+    streams = [((start, -end) for start, end in self._find_regex(regex))
+               for regex in regexes]
+    last_end = 0
+    for start, neg_end in heapq.merge(*streams):
+      if start >= last_end:
+        last_end = -neg_end
+        yield start, last_end
+
+  def _find_string(self, what):
+    idx = self.text.find(what)
+    while idx != -1:
+      yield idx, idx + len(what)
+      idx = self.text.find(what, idx + len(what))
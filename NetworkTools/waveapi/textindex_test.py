@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the textindex module."""
+
+
+import re
+import unittest
+
+import textindex
+
+
+class TestTextIndex(unittest.TestCase):
+  """Tests searching through a TextIndex."""
+
+  def testFindString(self):
+    index = textindex.TextIndex('aaa ab aaa')
+    self.assertEquals([(0, 2), (7, 9)], index.find(['aa']))
+    self.assertEquals([(0, 2)], index.find(['aa'], 1))
+    self.assertEquals([], index.find(['x']))
+    self.assertEquals([], index.find(['']))
+
+  def testFindSeveralStrings(self):
+    index = textindex.TextIndex('the cat catches the cattle')
+    self.assertEquals([(4, 7), (8, 15), (20, 26)],
+                      index.find(['cat', 'catches', 'cattle']))
+    self.assertEquals([(0, 3), (4, 7)], index.find(['the', 'cat'], 2))
+
+  def testFindRegex(self):
+    index = textindex.TextIndex(u'call 555-1234 or 555-9876 now')
+    phone = re.compile(r'\d{3}-\d{4}')
+    self.assertEquals([(5, 13), (17, 25)], index.find([phone]))
+    self.assertEquals([(0, 4), (5, 13), (17, 25)],
+                      index.find([phone, 'call', '555']))
+    self.assertEquals([], index.find([re.compile('x*')]))
+
+  def testResultsAreCached(self):
+    index = textindex.TextIndex('abc abc')
+    self.assertTrue(index.find(['abc']) is index.find(['abc']))
+
+  def testFirstHitsAreNotCached(self):
+    index = textindex.TextIndex('abc abc abc')
+    self.assertEquals([(0, 3)], index.find(['abc'], 1))
+    self.assertEquals([(0, 1), (4, 5)],
+                      index.find([re.compile('a'), 'zz'], 2))
+    self.assertEquals({}, index._hits)
+    hits = index.find(['abc'])
+    self.assertEquals([(0, 3), (4, 7)], index.find(['abc'], 2))
+    self.assertTrue(hits is index.find(['abc']))
+
+  def testIsPattern(self):
+    self.assertTrue(textindex.is_pattern(re.compile('a')))
+    self.assertFalse(textindex.is_pattern('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A fixed size pool of worker threads.
+
+Robots use it to run event handlers concurrently and the robot server to
+answer requests. The threads are started on first use and are daemons,
+so an idle pool doesn't keep the process alive.
+"""
+
+import Queue
+import sys
+import threading
+
+
+class Task(object):
+  """A call submitted to a ThreadPool, and its outcome once done."""
+
+  def __init__(self, func, args, kwargs):
+    self._func = func
+    self._args = args
+    self._kwargs = kwargs
+    self._done = threading.Event()
+    self._result = None
+    self._exc_info = None
+
+  def run(self):
+    """Runs the call in the current thread and records its outcome."""
+    try:
+      try:
+        self._result = self._func(*self._args, **self._kwargs)
+      except:
+        self._exc_info = sys.exc_info()
+    finally:
+      self._done.set()
+
+  def done(self):
+    """Returns whether the call has finished."""
+    return self._done.isSet()
+
+  def wait(self):
+    """Waits for the call to finish and returns its result.
+
+    Raises:
+      Whatever the call raised.
+    """
+    self._done.wait()
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+class ThreadPool(object):
+  """Runs submitted calls on at most size threads."""
+
+  def __init__(self, size, name='worker'):
+    """Initializes a pool that has no threads yet.
+
+    Args:
+      size: the number of threads.
+      name: prefix of the names of the threads.
+    """
+    if size < 1:
+      raise ValueError('A thread pool needs at least one thread.')
+    self.size = size
+    self._name = name
+    self._tasks = Queue.Queue()
+    self._threads = []
+    self._lock = threading.Lock()
+
+  def submit(self, func, *args, **kwargs):
+    """Queues func(*args, **kwargs) to run on one of the threads.
+
+    Returns:
+      The Task to wait on for the result.
+    """
+    task = Task(func, args, kwargs)
+    self._start_threads()
+    self._tasks.put(task)
+    return task
+
+  def map(self, func, items):
+    """Returns [func(item) for item in items], computed on the threads.
+
+    Raises:
+      The exception of the first item whose call failed, once all calls
+      have finished.
+    """
+    tasks = [self.submit(func, item) for item in items]
+    for task in tasks:
+      task._done.wait()
+    return [task.wait() for task in tasks]
+
+  def pending(self):
+    """Returns roughly how many submitted calls haven't started yet."""
+    return self._tasks.qsize()
+
+  def close(self):
+    """Stops the threads once the calls submitted so far have run."""
+    self._lock.acquire()
+    try:
+      threads = self._threads
+      self._threads = []
+    finally:
+      self._lock.release()
+    for thread in threads:
+      self._tasks.put(None)
+    for thread in threads:
+      thread.join()
+
+  def _start_threads(self):
+    if len(self._threads) == self.size:
+      return
+    self._lock.acquire()
+    try:
+      while len(self._threads) < self.size:
+        thread = threading.Thread(
+            target=self._work,
+            name='%s-%d' % (self._name, len(self._threads)))
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+    finally:
+      self._lock.release()
+
+  def _work(self):
+    while True:
+      task = self._tasks.get()
+      if task is None:
+        return
+      task.run()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the threadpool module."""
+
+
+import threading
+import time
+import unittest
+
+import threadpool
+
+
+class TestThreadPool(unittest.TestCase):
+  """Tests running calls on a ThreadPool."""
+
+  def setUp(self):
+    self.pool = threadpool.ThreadPool(3)
+
+  def tearDown(self):
+    self.pool.close()
+
+  def testSubmit(self):
+    task = self.pool.submit(lambda a, b=0: a + b, 1, b=2)
+    self.assertEquals(3, task.wait())
+    self.assertTrue(task.done())
+
+  def testSubmitRunsOnWorkerThread(self):
+    task = self.pool.submit(lambda: threading.currentThread().getName())
+    self.assertTrue(task.wait().startswith('worker-'))
+
+  def testWaitReraises(self):
+    def fail():
+      raise KeyError('missing')
+    task = self.pool.submit(fail)
+    self.assertRaises(KeyError, task.wait)
+
+  def testMap(self):
+    self.assertEquals([0, 1, 4, 9], self.pool.map(lambda x: x * x, range(4)))
+
+  def testMapRunsConcurrently(self):
+    start = time.time()
+    self.pool.map(time.sleep, [0.1] * 3)
+    self.assertTrue(time.time() - start < 0.25)
+
+  def testCloseRunsQueuedCalls(self):
+    done = []
+    for i in range(5):
+      self.pool.submit(done.append, i)
+    self.pool.close()
+    self.assertEquals(range(5), sorted(done))
+
+  def testNeedsAThread(self):
+    self.assertRaises(ValueError, threadpool.ThreadPool, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
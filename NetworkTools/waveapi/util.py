@@ -17,6 +17,7 @@
 """Utility library containing various helpers used by the API."""
 
 import re
+import types
 
 CUSTOM_SERIALIZE_METHOD_NAME = 'serialize'
 
@@ -75,13 +76,81 @@ def lower_camel_case(s):
   Returns:
     The lower camel cased string.
   """
-  return reduce(lambda a, b: a + (a and b.capitalize() or b), s.split('_'))
+  if '_' not in s:
+    return s
+  res = _lower_camel_case_cache.get(s)
+  if res is None:
+    if len(_lower_camel_case_cache) >= _MAX_CACHED_NAMES:
+      _lower_camel_case_cache.clear()
+    res = reduce(lambda a, b: a + (a and b.capitalize() or b), s.split('_'))
+    _lower_camel_case_cache[s] = res
+  return res
+
+# Keys are mostly attribute and parameter names, but dicts passed in by
+# callers can bring any number of others, so the cache is bounded.
+_MAX_CACHED_NAMES = 4096
+_lower_camel_case_cache = {}
 
 def non_none_dict(d):
   """return a copy of the dictionary without none values."""
   return dict([a for a in d.items() if a[1] is not None])
 
-def _serialize_attributes(obj):
+# How the instances of a class are serialized.
+_AS_IS, _CUSTOM, _ATTRIBUTES, _DICT, _ITERABLE, _OLD_STYLE = range(6)
+
+
+class _SerializationPlan(object):
+  """How to serialize the instances of a class.
+
+  Records which of the cases of serialize applies to the class. For
+  user-defined classes without a custom serialize method it also holds
+  the public attributes defined on the class, along with their lower
+  camel cased names. Methods are left out up front, so only the
+  remaining attributes are looked up on each instance.
+  """
+
+  def __init__(self, cls):
+    self.attributes = []
+    self.names = frozenset()
+    if cls is types.InstanceType:
+      # Instances of old-style classes all share this type.
+      self.kind = _OLD_STYLE
+    elif cls.__module__ != '__builtin__':
+      method = getattr(cls, CUSTOM_SERIALIZE_METHOD_NAME, None)
+      if method is not None and callable(method):
+        self.kind = _CUSTOM
+      else:
+        self.kind = _ATTRIBUTES
+      for attr_name in dir(cls):
+        if attr_name.startswith('_'):
+          continue
+        attr = getattr(cls, attr_name, None)
+        if isinstance(attr, (types.MethodType, types.FunctionType,
+                             types.BuiltinMethodType, staticmethod,
+                             classmethod, type)):
+          continue
+        self.attributes.append((attr_name, lower_camel_case(attr_name)))
+      self.names = frozenset([name for name, key in self.attributes])
+    elif hasattr(cls, 'iteritems'):
+      self.kind = _DICT
+    elif hasattr(cls, '__iter__'):
+      self.kind = _ITERABLE
+    else:
+      self.kind = _AS_IS
+
+
+_serialization_plans = {}
+
+
+def _serialization_plan(cls):
+  """Returns the _SerializationPlan for cls, making it on first use."""
+  plan = _serialization_plans.get(cls)
+  if plan is None:
+    plan = _serialization_plans[cls] = _SerializationPlan(cls)
+  return plan
+
+
+def _serialize_attributes(obj, plan=None):
   """Serializes attributes of an instance.
 
   Iterates all attributes of an object and invokes serialize if they are
@@ -89,19 +158,27 @@ def _serialize_attributes(obj):
 
   Args:
     obj: The instance to serialize.
+    plan: The _SerializationPlan of the class of obj, if already known.
 
   Returns:
     The serialized object.
   """
+  if plan is None:
+    plan = _serialization_plan(type(obj))
   data = {}
-  for attr_name in dir(obj):
-    if attr_name.startswith('_'):
-      continue
-    attr = getattr(obj, attr_name)
+  for attr_name, key in plan.attributes:
+    attr = getattr(obj, attr_name, None)
     if attr is None or callable(attr):
       continue
     # Looks okay, serialize it.
-    data[lower_camel_case(attr_name)] = serialize(attr)
+    data[key] = serialize(attr)
+  instance_dict = getattr(obj, '__dict__', None)
+  if instance_dict:
+    for attr_name, attr in instance_dict.items():
+      if (attr_name.startswith('_') or attr_name in plan.names or
+          attr is None or callable(attr)):
+        continue
+      data[lower_camel_case(attr_name)] = serialize(attr)
   return data
 
 
@@ -134,17 +211,25 @@ def serialize(obj):
   Returns:
     The serialized object.
   """
-  if is_user_defined_new_style_class(obj):
-    if obj and hasattr(obj, CUSTOM_SERIALIZE_METHOD_NAME):
-      method = getattr(obj, CUSTOM_SERIALIZE_METHOD_NAME)
-      if callable(method):
-        return method()
-    return _serialize_attributes(obj)
-  elif is_dict(obj):
+  plan = _serialization_plans.get(type(obj))
+  if plan is None:
+    plan = _serialization_plan(type(obj))
+  kind = plan.kind
+  if kind == _AS_IS:
+    return obj
+  elif kind == _DICT:
     return _serialize_dict(obj)
-  elif is_iterable(obj):
+  elif kind == _ITERABLE:
     return [serialize(v) for v in obj]
-  return obj
+  elif kind == _CUSTOM and obj:
+    return getattr(obj, CUSTOM_SERIALIZE_METHOD_NAME)()
+  elif kind == _OLD_STYLE:
+    if is_dict(obj):
+      return _serialize_dict(obj)
+    elif is_iterable(obj):
+      return [serialize(v) for v in obj]
+    return obj
+  return _serialize_attributes(obj, plan)
 
 def is_valid_proxy_for_id(s):
   """ Checks if the given string is a valid proxy id.
@@ -134,6 +134,49 @@ class TestUtils(unittest.TestCase):
     self.assertEquals(1, len(output.keys()))
     self.assertEquals(data.public, output['public'])
 
+  def testSerializeClassAndInstanceAttributes(self):
+
+    class Base(object):
+      shared = 'class'
+      nothing = None
+      Nested = dict
+
+      def __init__(self):
+        self.own_value = 2
+        self.shared = 'instance'
+        self.callback = lambda: None
+
+      @property
+      def computed_value(self):
+        return [self.own_value]
+
+    class Derived(Base):
+      __slots__ = ('slot_value',)
+
+      def __init__(self):
+        Base.__init__(self)
+        self.slot_value = 3
+
+    for i in range(2):
+      output = util.serialize(Derived())
+      self.assertEquals({'shared': 'instance', 'ownValue': 2,
+                         'computedValue': [2], 'slotValue': 3}, output)
+
+  def testSerializeCustomMethod(self):
+
+    class Custom(object):
+      def __init__(self, size):
+        self.size = size
+
+      def __len__(self):
+        return self.size
+
+      def serialize(self):
+        return 'custom'
+
+    self.assertEquals(['custom', {'size': 0}],
+                      util.serialize([Custom(1), Custom(0)]))
+
   def testStringEnum(self):
     util.StringEnum()
     single = util.StringEnum('foo')
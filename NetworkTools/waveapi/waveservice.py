@@ -16,23 +16,54 @@
 
 """Base class to use OAuth to talk to the wave service."""
 
-import httplib
 import logging
+import threading
 import urllib
 import urlparse
 
 import oauth
-import simplejson
 
 import ops
 import blip
 import errors
 import events
+import httppool
+import jsoncodec
+import jsonstream
 import search
 import util
 import wavelet
 
 
+# Methods that don't operate on a wavelet or change anything, so they
+# can be sent at the same time as anything else.
+_READ_ONLY_METHODS = (ops.ROBOT_SEARCH, ops.ROBOT_FETCH_MY_PROFILE,
+                      ops.ROBOT_FETCH_PROFILES)
+
+
+def _is_read_only(method):
+  """Returns whether a serialized method, maybe prefixed, is read only."""
+  for read_only in _READ_ONLY_METHODS:
+    if method == read_only or method.endswith('.' + read_only):
+      return True
+  return False
+
+
+def _temp_ids(params):
+  """Returns the temporary wave and blip ids in serialized params."""
+  found = set()
+  for key, value in params.items():
+    if isinstance(value, dict):
+      found.update(_temp_ids(value))
+    elif key.endswith('Ids') and isinstance(value, list):
+      found.update([item for item in value
+                    if isinstance(item, basestring) and 'TBD_' in item])
+    elif (key.endswith('Id') and isinstance(value, basestring) and
+          'TBD_' in value):
+      found.add(value)
+  return found
+
+
 class WaveService(object):
   # Google OAuth URLs
   REQUEST_TOKEN_URL = 'https://www.google.com/accounts/OAuthGetRequestToken'
@@ -48,9 +79,19 @@ class WaveService(object):
   SANDBOX_RPC_URL = (
       'https://www-opensocial-sandbox.googleusercontent.com/api/rpc')
 
+  # Limits for splitting up the operations of a single make_rpc call.
+  #: Most operations sent in one request.
+  MAX_BATCH_OPERATIONS = 100
+  #: Most bytes of JSON sent in one request, unless a single operation
+  #: is larger by itself.
+  MAX_BATCH_BYTES = 512 * 1024
+  #: Most requests in flight at the same time.
+  MAX_CONCURRENT_BATCHES = 4
+
   def __init__(self, use_sandbox=False, server_rpc_base=None,
                consumer_key='anonymous', consumer_secret='anonymous',
-               http_post=None):
+               http_post=None, connection_pool=None,
+               coalesce_operations=False):
     """Initializes a service that can perform the various OAuth steps.
 
     Args:
@@ -60,8 +101,13 @@ class WaveService(object):
       consumer_key: A string for the consumer key, defaults to 'anonymous'
       consumer_secret: A string for the consumer secret, defaults to 'anonymous'
       http_post: handler to call to execute a http post.
+      connection_pool: optional httppool.ConnectionPool to send requests
+          through. By default the service uses a pool of its own.
+      coalesce_operations: if True, operations that can be sent as one are
+          merged before each rpc, see ops.coalesce_operations.
     """
     self._consumer = oauth.OAuthConsumer(consumer_key, consumer_secret)
+    self._coalesce_operations = coalesce_operations
     logging.info('server_rpc_base: %s', server_rpc_base)
     if server_rpc_base:
       self._server_rpc_base = server_rpc_base
@@ -71,9 +117,11 @@ class WaveService(object):
       self._server_rpc_base = WaveService.RPC_URL
     logging.info('server:' + self._server_rpc_base)
 
-    self._http_post = self.http_post
-    self._connection = httplib.HTTPSConnection('www.google.com')
+    self._http_post = http_post or self.http_post
+    self._pool = connection_pool or httppool.ConnectionPool()
     self._access_token = None
+    # The (consumer, token, url) the rpc signer was made for, and the signer.
+    self._signer = None
 
   def _make_token(self, token):
     """If passed an oauth token, return that. If passed a string, convert."""
@@ -95,10 +143,10 @@ class WaveService(object):
       An OAuthToken object
     """
     # Send request to the request token URL
-    self._connection.request(oauth_request.http_method, oauth_request.to_url())
+    status, headers, response = self._pool.request(oauth_request.http_method,
+                                                   oauth_request.to_url())
 
     # Extract token from response
-    response = self._connection.getresponse().read()
     self._request_token = oauth.OAuthToken.from_string(response)
     return self._request_token
 
@@ -136,11 +184,11 @@ class WaveService(object):
         token=request_token, http_url=WaveService.AUTHORIZATION_URL)
 
     # Send request
-    self._connection.request(oauth_request.http_method, oauth_request.to_url())
+    status, headers, response = self._pool.request(oauth_request.http_method,
+                                                   oauth_request.to_url())
 
     # Extract location from the response
-    response = self._connection.getresponse()
-    return response.getheader('location')
+    return headers.get('location')
 
   def upgrade_to_access_token(self, request_token, verifier=None):
     """Upgrades the request_token to an access token (Step 3).
@@ -174,6 +222,9 @@ class WaveService(object):
     is mostly useful when running on app engine and you want to set
     the time out to something different than the default 5 seconds.
 
+    The default posts through a pool of keep-alive connections, so
+    consecutive rpcs don't pay for a new connection and TLS handshake.
+
     Args:
         url: to post to
         body: post body
@@ -181,21 +232,38 @@ class WaveService(object):
     Returns:
         response_code, returned_page
     """
-    import urllib2
-    req = urllib2.Request(url,
-                          data=data,
-                          headers=headers)
-    try:
-      f = urllib2.urlopen(req)
-      return f.code, f.read()
-    except urllib2.HTTPError, e:
-      return e.code, e.read()
+    status, response_headers, content = self._pool.request(
+        'POST', url, body=data, headers=headers)
+    return status, content
+
+  def make_rpc(self, operations, max_batch_operations=None):
+    """Make an rpc call, submitting the specified operations.
+
+    Queues that are too large for a single request are split into batches
+    of at most max_batch_operations operations, MAX_BATCH_OPERATIONS by
+    default, and MAX_BATCH_BYTES bytes.
+    Batches that don't touch a wavelet in common are sent concurrently,
+    at most MAX_CONCURRENT_BATCHES at a time; the others are sent in order.
+    Operations that aren't on a wavelet, other than searches and profile
+    fetches, are sent after everything queued before them, and operations using a temporary id are sent together
+    with the one that made it up.
 
-  def make_rpc(self, operations):
-    """Make an rpc call, submitting the specified operations."""
-
-    rpc_host = urlparse.urlparse(self._server_rpc_base).netloc
+    Returns:
+      The results of all operations as one list, the result of the notify
+      operation followed by the other results in the order the operations
+      were queued.
+    Raises:
+      errors.RpcError: if the request failed.
+      errors.BatchRpcError: if some batches of a split request failed. The
+          results of the other batches are passed along with it.
+    """
+    batches = self._rpc_batches(operations, max_batch_operations)
+    if len(batches) == 1:
+      return self._post_rpc(batches[0][0])
+    return self._run_batches(batches)
 
+  def _rpc_batches(self, operations, max_batch_operations):
+    """Serializes operations for make_rpc and splits them into batches."""
     # We either expect an operationqueue, a single op or a list
     # of ops:
     if (not isinstance(operations, ops.OperationQueue)):
@@ -206,27 +274,235 @@ class WaveService(object):
     else:
       queue = operations
 
+    serialized = queue.serialize(method_prefix='wave',
+                                 coalesce=self._coalesce_operations)
+    return self._split_batches(serialized[0], serialized[1:],
+                               max_batch_operations)
 
-    data = simplejson.dumps(queue.serialize(method_prefix='wave'))
-    print data
-    oauth_request = oauth.OAuthRequest.from_consumer_and_token(self._consumer,
-         token=self._access_token, http_method='POST',
-         http_url=self._server_rpc_base)
-    oauth_request.sign_request(WaveService.SIGNATURE_METHOD,
-         self._consumer, self._access_token)
+  def _split_batches(self, notify, operations, max_operations=None):
+    """Splits serialized operations into batches to send.
+
+    Operations referring to a temporary wave or blip id, made up by an
+    earlier operation in the queue, are kept in one batch with it so the
+    server can resolve the id. Such a batch can exceed the limits.
+
+    Args:
+      notify: the serialized notify operation, sent with every batch.
+      operations: the other serialized operations.
+      max_operations: most operations per batch, if not
+          MAX_BATCH_OPERATIONS.
+    Returns:
+      A list of (body, operation ids, wavelets) tuples. wavelets holds
+      the (wave id, wavelet id) pairs the batch operates on, and None if
+      it has an operation without a wave id that may change something.
+    """
+    if not max_operations:
+      max_operations = self.MAX_BATCH_OPERATIONS
+    temp_ids = [_temp_ids(op['params']) for op in operations]
+    last_use = {}
+    for i, ids in enumerate(temp_ids):
+      for temp_id in ids:
+        last_use[temp_id] = i
+    notify_data = jsoncodec.dumps(notify)
+    batches = []
+    current = []
+    size = len(notify_data) + 2
+    # The last operation that has to go in the current batch.
+    reach = -1
+    for i, op in enumerate(operations):
+      data = jsoncodec.dumps(op)
+      if current and reach < i and (
+          len(current) >= max_operations or
+          size + len(data) + 1 > self.MAX_BATCH_BYTES):
+        batches.append(current)
+        current = []
+        size = len(notify_data) + 2
+      current.append((op, data))
+      size += len(data) + 1
+      for temp_id in temp_ids[i]:
+        reach = max(reach, last_use[temp_id])
+    batches.append(current)
+
+    res = []
+    for batch in batches:
+      body = '[%s]' % ','.join([notify_data] + [data for op, data in batch])
+      wavelets = set()
+      for op, data in batch:
+        params = op['params']
+        if params.get('waveId') is not None:
+          wavelets.add((params.get('waveId'), params.get('waveletId')))
+        elif not _is_read_only(op['method']):
+          wavelets.add(None)
+      res.append((body, [op['id'] for op, data in batch], wavelets))
+    return res
+
+  def _run_batches(self, batches):
+    """Posts batches from _split_batches and merges their results."""
+    # A batch has to wait for the last earlier batch touching each of
+    # its wavelets, so operations on one wavelet are applied in order.
+    # A batch with operations that aren't on a wavelet waits for all
+    # earlier batches, and all later batches wait for it.
+    depends_on = []
+    last_batch = {}
+    last_barrier = None
+    for i, (body, op_ids, wavelets) in enumerate(batches):
+      if None in wavelets:
+        dependencies = set(range(i))
+        last_barrier = i
+      else:
+        dependencies = set([last_batch[w] for w in wavelets
+                            if w in last_batch])
+        if last_barrier is not None:
+          dependencies.add(last_barrier)
+      depends_on.append(dependencies)
+      for w in wavelets:
+        last_batch[w] = i
+
+    results = [None] * len(batches)
+    failures = [None] * len(batches)
+    done = [threading.Event() for batch in batches]
+    next_batch = [0]
+    lock = threading.Lock()
+
+    def worker():
+      # Batches are taken in order, so the earliest one that isn't done
+      # never waits and the workers can't deadlock.
+      while True:
+        lock.acquire()
+        try:
+          i = next_batch[0]
+          next_batch[0] += 1
+        finally:
+          lock.release()
+        if i >= len(batches):
+          return
+        try:
+          for dependency in depends_on[i]:
+            done[dependency].wait()
+          if [d for d in depends_on[i] if failures[d] is not None]:
+            failures[i] = errors.RpcError(
+                'Not sent, an earlier batch it waits for failed.')
+          else:
+            try:
+              results[i] = self._post_rpc(batches[i][0])
+            except Exception, e:
+              failures[i] = e
+        finally:
+          done[i].set()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(self.MAX_CONCURRENT_BATCHES, len(batches)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    merged = self._merge_results(
+        [op_ids for body, op_ids, wavelets in batches],
+        [result for result in results if result is not None])
+    failed = [i for i in range(len(batches)) if failures[i] is not None]
+    if failed:
+      failed_ids = []
+      for i in failed:
+        failed_ids.extend(batches[i][1])
+      raise errors.BatchRpcError(
+          '%d of %d batches failed, first error: %s' % (
+              len(failed), len(batches), failures[failed[0]]),
+          merged, failed_ids)
+    return merged
+
+  def _merge_results(self, op_ids, results):
+    """Merges the results of several batches into one list.
 
-    logging.info('Active URL: %s'  % self._server_rpc_base)
-    logging.info('Active Outgoing: %s' % data)
+    Args:
+      op_ids: lists of the ids of the operations sent in each batch.
+      results: the result lists returned for the batches.
+    """
+    notify = []
+    by_id = {}
+    unknown = []
+    for result in results:
+      for record in result:
+        op_id = record.get('id')
+        if op_id == ops.NOTIFY_OP_ID:
+          if not notify:
+            notify.append(record)
+        elif op_id in by_id or op_id is None:
+          unknown.append(record)
+        else:
+          by_id[op_id] = record
+    merged = notify
+    for batch_ids in op_ids:
+      for op_id in batch_ids:
+        if op_id in by_id:
+          merged.append(by_id.pop(op_id))
+    # Results for ids we didn't send, kept so nothing is lost.
+    return merged + by_id.values() + unknown
+
+  def stream_rpc(self, operations):
+    """Like make_rpc, but yields the result records as they arrive.
+
+    The response is decoded while it is being read, so the first records
+    are available before all of it has been downloaded, and a large
+    response isn't held in memory both as text and decoded. Read all the
+    records, or the connection can't be used again.
+
+    Only requests sent with the default http_post and in a single batch
+    are streamed; others are yielded once they have been read completely.
+    """
+    batches = self._rpc_batches(operations, None)
+    if len(batches) > 1:
+      for record in self._run_batches(batches):
+        yield record
+      return
+    data = batches[0][0]
+    if self._http_post != self.http_post:
+      for record in self._post_rpc(data):
+        yield record
+      return
+
+    status, response_headers, response = self._pool.open(
+        'POST', self._server_rpc_base, body=data,
+        headers=self._rpc_headers(data))
+    try:
+      if status != 200:
+        raise errors.RpcError('code: %s\n%s' % (status, response.read()))
+      for record in jsonstream.iter_array(response):
+        yield record
+    except:
+      response.close()
+      raise
+    response.close()
+
+  def _rpc_headers(self, data):
+    """Returns the signed headers to post a JSON-RPC request body with."""
+    logging.info('Active URL: %s', self._server_rpc_base)
+    logging.info('Active Outgoing: %s', data)
     headers = {'Content-Type': 'application/json'}
-    headers.update(oauth_request.to_header());
+    headers.update(self._rpc_signer().to_header())
+    return headers
+
+  def _rpc_signer(self):
+    """Returns the signer for rpcs with the current consumer and token."""
+    key = (self._consumer, self._access_token, self._server_rpc_base)
+    signer = self._signer
+    if signer is None or signer[0] != key:
+      signer = (key, oauth.OAuthRequestSigner(
+          self._consumer, self._access_token, http_method='POST',
+          http_url=self._server_rpc_base))
+      self._signer = signer
+    return signer[1]
+
+  def _post_rpc(self, data):
+    """Signs and posts a JSON-RPC request body and returns the results."""
     status, content = self._http_post(
          url=self._server_rpc_base,
          data=data,
-         headers=headers)
+         headers=self._rpc_headers(data))
 
     if status != 200:
       raise errors.RpcError('code: %s\n%s' % (status, content))
-    return simplejson.loads(content)
+    return jsoncodec.loads(content)
 
   def _first_rpc_result(self, result):
     """result is returned from make_rpc. Get the first data record
@@ -235,12 +511,15 @@ class WaveService(object):
     result = [record for record in result if record['id'] != ops.NOTIFY_OP_ID]
     if not result:
       raise errors.RpcError('No results found.')
-    result = result[0]
-    error = result.get('error')
+    return self._rpc_record_data(result[0])
+
+  def _rpc_record_data(self, record):
+    """Returns the data of a single rpc result record or raises its error."""
+    error = record.get('error')
     if error:
       raise errors.RpcError(str(error['code'])
           + ': ' + error['message'])
-    data = result.get('data')
+    data = record.get('data')
     if data is not None:
       return data
     raise errors.Error('RPC Error: No data record.')
@@ -257,10 +536,11 @@ class WaveService(object):
     be contaned in the wavelet record.
     """
     if isinstance(json, basestring):
-      json = simplejson.loads(json)
+      json = jsoncodec.loads(json)
 
-    # Create blips dict so we can pass into BlipThread objects
-    blips = {}
+    # Create blips dict so we can pass into BlipThread objects. The
+    # blips themselves are only built once they are accessed.
+    blips = blip.Blips({})
 
     # Setup threads first, as the Blips and Wavelet need to know about them
     threads = {}
@@ -292,8 +572,8 @@ class WaveService(object):
       reply_threads = [threads[id] for id in raw_blip_data.get('replyThreadIds',
                                                                [])]
       thread = threads.get(raw_blip_data.get('threadId'))
-      blips[blip_id] = blip.Blip(raw_blip_data, blips, pending_ops,
-                                 thread=thread, reply_threads=reply_threads)
+      blips._add_json(blip_id, raw_blip_data, pending_ops, thread=thread,
+                      reply_threads=reply_threads)
 
     result = wavelet.Wavelet(raw_wavelet_data, blips, root_thread, pending_ops)
 
@@ -316,6 +596,33 @@ class WaveService(object):
     result = self._first_rpc_result(self.make_rpc(operation_queue))
     return search.Results(result)
 
+  def search_pages(self, query, index=0, num_results=20, num_pages=1):
+    """Executes the searches for several consecutive pages at once.
+
+    Each page is requested separately, so the server can work on all of
+    them at the same time; see make_rpc for how many are sent at once.
+
+    Args:
+      query: what to search for, for example [in:inbox]
+      index: index of the first result of the first page
+      num_results: how many results make up a page
+      num_pages: how many pages to return
+    Returns:
+      A list of num_pages search.Results, in page order.
+    """
+    operation_queue = ops.OperationQueue()
+    op_ids = [operation_queue.robot_search(query, index + i * num_results,
+                                           num_results).id
+              for i in range(num_pages)]
+    records = dict([(record.get('id'), record) for record in
+                    self.make_rpc(operation_queue, max_batch_operations=1)])
+    res = []
+    for op_id in op_ids:
+      if op_id not in records:
+        raise errors.RpcError('No result for operation %s.' % op_id)
+      res.append(search.Results(self._rpc_record_data(records[op_id])))
+    return res
+
   def new_wave(self, domain, participants=None, message='', proxy_for_id=None,
                submit=False):
     """Create a new wave with the initial participants on it.
@@ -347,7 +654,7 @@ class WaveService(object):
     util.check_is_valid_proxy_for_id(proxy_for_id)
     operation_queue = ops.OperationQueue(proxy_for_id)
     if not isinstance(message, basestring):
-      message = simplejson.dumps(message)
+      message = jsoncodec.dumps(message)
 
     # Create temporary wavelet data
     blip_data, wavelet_data = operation_queue.robot_create_wavelet(
@@ -419,14 +726,65 @@ class WaveService(object):
     """
     util.check_is_valid_proxy_for_id(proxy_for_id)
     if not wavelet_id:
-      domain, id = wave_id.split('!', 1)
-      wavelet_id = domain + '!conv+root'
+      wavelet_id = self._root_wavelet_id(wave_id)
     operation_queue = ops.OperationQueue(proxy_for_id)
     operation_queue.robot_fetch_wave(wave_id, wavelet_id,
         raw_deltas_from_version, return_raw_snapshot)
-    result = self._first_rpc_result(self.make_rpc(operation_queue))
+    result = self._first_rpc_result(self.stream_rpc(operation_queue))
     return self._wavelet_from_json(result, ops.OperationQueue(proxy_for_id))
 
+  def fetch_wavelets(self, wavelet_ids, proxy_for_id=None):
+    """Fetches several wavelets in a single rpc.
+
+    Like fetch_wavelet, each returned wavelet has its own operation queue
+    that the caller is responsible for submitting.
+
+    Args:
+      wavelet_ids: a list of (wave_id, wavelet_id) tuples. A wavelet_id of
+          None stands for the root wavelet of the wave.
+      proxy_for_id: on whose behalf to execute the operations.
+    Returns:
+      A list with, in the order of wavelet_ids, either the fetched wavelet
+      or the errors.Error that prevented fetching it.
+    """
+    util.check_is_valid_proxy_for_id(proxy_for_id)
+    operation_queue = ops.OperationQueue(proxy_for_id)
+    op_ids = []
+    for wave_id, wavelet_id in wavelet_ids:
+      if not wavelet_id:
+        wavelet_id = self._root_wavelet_id(wave_id)
+      op_ids.append(operation_queue.robot_fetch_wave(wave_id, wavelet_id).id)
+
+    failed_ids = set()
+    try:
+      results = self.make_rpc(operation_queue)
+    except errors.BatchRpcError, e:
+      # Return what the batches that did go through fetched.
+      results = e.results
+      failed_ids = set(e.failed_operation_ids)
+      batch_error = e
+    records = dict([(record.get('id'), record) for record in results])
+
+    res = []
+    for op_id in op_ids:
+      if op_id in failed_ids:
+        res.append(batch_error)
+      elif op_id not in records:
+        res.append(errors.RpcError('No result for operation %s.' % op_id))
+      else:
+        try:
+          data = self._rpc_record_data(records[op_id])
+          res.append(self._wavelet_from_json(
+              data, ops.OperationQueue(proxy_for_id)))
+        except errors.Error, e:
+          res.append(e)
+    return res
+
+  def _root_wavelet_id(self, wave_id):
+    """Returns the id of the root conversation wavelet of a wave."""
+    domain, id = wave_id.split('!', 1)
+    return domain + '!conv+root'
+
   def blind_wavelet(self, json, proxy_for_id=None):
     """Construct a blind wave from a json string.
 
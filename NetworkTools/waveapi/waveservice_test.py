@@ -17,10 +17,14 @@
 """Unit tests for the wavelet module."""
 
 
+import threading
+import time
 import unittest
 
 import blip
 import element
+import errors
+import oauth
 import ops
 import wavelet
 import waveservice
@@ -63,6 +67,312 @@ class TestWavelet(unittest.TestCase):
     self.assertEquals(8, len(w.blips))
     self.assertEquals(4, len(w.root_thread.blips))
 
+  def testBlipsAreBuiltOnAccess(self):
+    TEST_DATA = simplejson.loads(testdata.json_string)
+    w = self.waveservice._wavelet_from_json(TEST_DATA, ops.OperationQueue())
+    unbuilt = [blip_id for blip_id in w.blips
+               if isinstance(w.blips._blips[blip_id], blip._UnbuiltBlip)]
+    self.assertEquals(len(TEST_DATA['blips']) - 1, len(unbuilt))
+    self.assertFalse(w.root_blip.blip_id in unbuilt)
+    child = w.blips[unbuilt[0]]
+    self.assertTrue(child is w.blips.get(unbuilt[0]))
+    self.assertEquals(unbuilt[0], child.blip_id)
+    self.assertTrue(child.parent_blip is None or
+                    child.parent_blip.blip_id in w.blips)
+
+    eager = self.waveservice._wavelet_from_json(TEST_DATA,
+                                                ops.OperationQueue())
+    eager.blips.values()
+    self.assertEquals(eager.serialize(),
+                      self.waveservice._wavelet_from_json(
+                          TEST_DATA, ops.OperationQueue()).serialize())
+
+  def testBlipsAreBuiltOnce(self):
+    TEST_DATA = simplejson.loads(testdata.json_string)
+    w = self.waveservice._wavelet_from_json(TEST_DATA, ops.OperationQueue())
+    blip_id = [blip_id for blip_id in w.blips
+               if isinstance(w.blips._blips[blip_id], blip._UnbuiltBlip)][0]
+    original = blip.Blip
+    class SlowBlip(original):
+      def __init__(self, *args, **kwargs):
+        time.sleep(0.02)
+        original.__init__(self, *args, **kwargs)
+    built = []
+    def build():
+      built.append(w.blips[blip_id])
+    blip.Blip = SlowBlip
+    try:
+      threads = [threading.Thread(target=build) for i in range(4)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    finally:
+      blip.Blip = original
+    self.assertEquals(4, len(built))
+    for other in built:
+      self.assertTrue(other is built[0])
+
+
+class FakeRpcServer(object):
+  """Stands in for http_post, answering every operation with its id."""
+
+  def __init__(self, fail_ids=(), delays=None):
+    self.requests = []
+    self.fail_ids = fail_ids
+    self.delays = delays or {}
+    self._lock = threading.Lock()
+
+  def __call__(self, url, data, headers):
+    request = simplejson.loads(data)
+    ids = [op['id'] for op in request]
+    time.sleep(self.delays.get(ids[-1], 0))
+    self._lock.acquire()
+    try:
+      self.requests.append(ids)
+    finally:
+      self._lock.release()
+    if [op_id for op_id in ids if op_id in self.fail_ids]:
+      return 500, 'failed'
+    return 200, simplejson.dumps([{'id': op_id, 'data': {}}
+                                  for op_id in ids])
+
+
+class TestMakeRpc(unittest.TestCase):
+  """Tests splitting up rpcs into batches."""
+
+  def setUp(self):
+    self.waveservice = waveservice.WaveService()
+    self.waveservice.MAX_BATCH_OPERATIONS = 2
+
+  def queue_tags(self, queue, wavelet_ids):
+    return [queue.wavelet_modify_tag('w', wavelet_id, 'tag').id
+            for wavelet_id in wavelet_ids]
+
+  def testSingleBatch(self):
+    server = FakeRpcServer()
+    self.waveservice.set_http_post(server)
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'b'])
+    result = self.waveservice.make_rpc(queue)
+    self.assertEquals([['0'] + ids], server.requests)
+    self.assertEquals(['0'] + ids, [record['id'] for record in result])
+
+  def testBatchesAreMergedInOrder(self):
+    server = FakeRpcServer()
+    self.waveservice.set_http_post(server)
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'b', 'c', 'd', 'e'])
+    result = self.waveservice.make_rpc(queue)
+    self.assertEquals(3, len(server.requests))
+    self.assertEquals(['0'] + ids, [record['id'] for record in result])
+
+  def testBatchesSizeLimit(self):
+    server = FakeRpcServer()
+    self.waveservice.set_http_post(server)
+    self.waveservice.MAX_BATCH_BYTES = 10
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'b', 'c'])
+    self.waveservice.make_rpc(queue)
+    self.assertEquals(sorted([['0', op_id] for op_id in ids]),
+                      sorted(server.requests))
+
+  def testBatchesOnOneWaveletStayInOrder(self):
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'a', 'a', 'a', 'a'])
+    # Without ordering the slow first batch would arrive last.
+    server = FakeRpcServer(delays={ids[1]: 0.05})
+    self.waveservice.set_http_post(server)
+    self.waveservice.make_rpc(queue)
+    self.assertEquals([['0'] + ids[:2], ['0'] + ids[2:4], ['0'] + ids[4:]],
+                      server.requests)
+
+  def testTempIdsStayInOneBatch(self):
+    server = FakeRpcServer()
+    self.waveservice.set_http_post(server)
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a'])
+    blip_data = queue.wavelet_append_blip('w', 'b')
+    ids.append(list(queue)[-1].id)
+    ids.extend(self.queue_tags(queue, ['c', 'd']))
+    queue.document_append_markup('w', 'b', blip_data['blipId'], 'hi')
+    ids.append(list(queue)[-1].id)
+    ids.extend(self.queue_tags(queue, ['e']))
+    self.waveservice.make_rpc(queue)
+    self.assertEquals(sorted([['0'] + ids[:5], ['0'] + ids[5:]]),
+                      sorted(server.requests))
+
+  def testOperationsWithoutWaveletStayInOrder(self):
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'b'])
+    # Marking waves as read changes them without naming a wavelet.
+    ids.append(queue.new_operation('robot.folderAction',
+                                   modifyHow='markAsRead').id)
+    ids.extend(self.queue_tags(queue, ['c', 'd']))
+    server = FakeRpcServer(delays={ids[1]: 0.05, ids[3]: 0.05})
+    self.waveservice.set_http_post(server)
+    self.waveservice.make_rpc(queue)
+    self.assertEquals([['0'] + ids[:2], ['0'] + ids[2:4], ['0'] + ids[4:]],
+                      server.requests)
+
+  def testCoalesceOperations(self):
+    server = FakeRpcServer()
+    service = waveservice.WaveService(http_post=server,
+                                      coalesce_operations=True)
+    queue = ops.OperationQueue()
+    queue.document_append_markup('w', 'a', 'b+1', 'gone')
+    delete_id = queue.blip_delete('w', 'a', 'b+1').id
+    result = service.make_rpc(queue)
+    self.assertEquals([['0', delete_id]], server.requests)
+    self.assertEquals(['0', delete_id], [record['id'] for record in result])
+
+  def testFailedBatch(self):
+    queue = ops.OperationQueue()
+    ids = self.queue_tags(queue, ['a', 'a', 'b', 'b', 'a'])
+    server = FakeRpcServer(fail_ids=[ids[0]])
+    self.waveservice.set_http_post(server)
+    try:
+      self.waveservice.make_rpc(queue)
+      self.fail('Expected a BatchRpcError')
+    except errors.BatchRpcError, e:
+      # The last batch depends on the failed first one and is not sent.
+      self.assertEquals(ids[:2] + ids[4:], e.failed_operation_ids)
+      self.assertEquals(['0'] + ids[2:4],
+                        [record['id'] for record in e.results])
+    self.assertEquals(2, len(server.requests))
+
+  def testFetchWavelets(self):
+    requests = []
+
+    def http_post(url, data, headers):
+      request = simplejson.loads(data)
+      requests.append(request)
+      result = []
+      for op in request:
+        wave_id = op['params'].get('waveId')
+        if wave_id == 'example.com!missing':
+          result.append({'id': op['id'],
+                         'error': {'code': 404, 'message': 'not found'}})
+        elif wave_id:
+          data = simplejson.loads(testdata.json_string)
+          data['wavelet']['waveId'] = wave_id
+          result.append({'id': op['id'], 'data': data})
+      # The server doesn't have to answer in order.
+      result.reverse()
+      return 200, simplejson.dumps(result)
+
+    self.waveservice.set_http_post(http_post)
+    self.waveservice.MAX_BATCH_OPERATIONS = 100
+    result = self.waveservice.fetch_wavelets(
+        [('example.com!w1', None),
+         ('example.com!missing', 'example.com!conv+root'),
+         ('example.com!w2', 'example.com!conv+root')])
+    self.assertEquals(1, len(requests))
+    self.assertEquals('example.com!conv+root',
+                      requests[0][1]['params']['waveletId'])
+    self.assertEquals('example.com!w1', result[0].wave_id)
+    self.assertTrue(isinstance(result[1], errors.RpcError))
+    self.assertEquals('example.com!w2', result[2].wave_id)
+    self.assertFalse(result[0].get_operation_queue() is
+                     result[2].get_operation_queue())
+
+  def testSearchPages(self):
+    requests = []
+
+    def http_post(url, data, headers):
+      request = simplejson.loads(data)
+      requests.append(request)
+      result = []
+      for op in request:
+        if op['method'] == 'wave.robot.search':
+          index = op['params']['index']
+          digests = [{'waveId': 'w%d' % i, 'title': 'Wave %d' % i,
+                      'blipCount': 1, 'unreadCount': 0}
+                     for i in range(index, min(index + 2, 5))]
+          result.append({'id': op['id'], 'data': {'searchResults': {
+              'query': 'in:inbox', 'numResults': 5, 'digests': digests}}})
+      return 200, simplejson.dumps(result)
+
+    self.waveservice.set_http_post(http_post)
+    pages = self.waveservice.search_pages('in:inbox', index=2, num_results=2,
+                                          num_pages=3)
+    # One request per page.
+    self.assertEquals(3, len(requests))
+    self.assertEquals([['w2', 'w3'], ['w4'], []],
+                      [[d.wave_id for d in page.digests] for page in pages])
+    self.assertEquals(5, pages[0].num_results)
+
+  def testSearchPagesOverlap(self):
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def http_post(url, data, headers):
+      lock.acquire()
+      in_flight[0] += 1
+      in_flight[1] = max(in_flight)
+      lock.release()
+      time.sleep(0.05)
+      lock.acquire()
+      in_flight[0] -= 1
+      lock.release()
+      return 200, simplejson.dumps([
+          {'id': op['id'], 'data': {'searchResults': {
+              'query': 'q', 'numResults': 0, 'digests': []}}}
+          for op in simplejson.loads(data)])
+
+    self.waveservice.set_http_post(http_post)
+    self.waveservice.search_pages('q', num_results=2, num_pages=4)
+    self.assertEquals(4, in_flight[1])
+
+
+class TestRpcSigning(unittest.TestCase):
+  """Tests the signatures of rpcs."""
+
+  def setUp(self):
+    self.waveservice = waveservice.WaveService(consumer_key='key',
+                                               consumer_secret='s&cret')
+    self.waveservice.set_access_token(
+        oauth.OAuthToken('token/1', 'token secret'))
+
+  def verify(self, headers, token):
+    """Checks headers the way the oauth library would on the server."""
+    request = oauth.OAuthRequest.from_request(
+        'POST', self.waveservice._server_rpc_base, headers=headers)
+    signature = request.get_parameter('oauth_signature')
+    self.assertEquals('key', request.get_parameter('oauth_consumer_key'))
+    self.assertEquals('HMAC-SHA1',
+                      request.get_parameter('oauth_signature_method'))
+    self.assertTrue(waveservice.WaveService.SIGNATURE_METHOD.check_signature(
+        request, self.waveservice._consumer, token, signature))
+
+  def testSignerMatchesOAuthRequest(self):
+    signer = self.waveservice._rpc_signer()
+    token = self.waveservice._access_token
+    request = oauth.OAuthRequest.from_consumer_and_token(
+        self.waveservice._consumer, token=token, http_method='POST',
+        http_url=self.waveservice._server_rpc_base,
+        parameters={'oauth_nonce': '12345678', 'oauth_timestamp': 1271000000})
+    request.sign_request(waveservice.WaveService.SIGNATURE_METHOD,
+                         self.waveservice._consumer, token)
+    self.assertEquals(request.get_parameter('oauth_signature'),
+                      signer.build_signature('12345678', 1271000000))
+
+  def testRpcHeadersVerify(self):
+    headers = self.waveservice._rpc_headers('[]')
+    self.assertEquals('application/json', headers['Content-Type'])
+    self.verify(headers, self.waveservice._access_token)
+
+  def testSignerIsReplacedWithToken(self):
+    signer = self.waveservice._rpc_signer()
+    self.assertTrue(signer is self.waveservice._rpc_signer())
+    token = oauth.OAuthToken('other', 'other secret')
+    self.waveservice.set_access_token(token)
+    self.assertFalse(signer is self.waveservice._rpc_signer())
+    self.verify(self.waveservice._rpc_headers('[]'), token)
+
+  def testUnauthorizedSigner(self):
+    self.waveservice._access_token = None
+    self.verify(self.waveservice._rpc_headers('[]'), None)
 
 
 if __name__ == '__main__':
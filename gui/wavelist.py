@@ -24,6 +24,9 @@ from gui import rel_to_abs
 
 withcontact = re.compile("with[ :](\S*)")
 pageregex = re.compile(" ?::(\d+)")
+allpagesregex = re.compile(" ?::all")
+# Pages shown at once by an ::all query
+ALL_PAGES = 5
 
 def getContactsFromQuery(query):
 	return withcontact.findall(query)
@@ -105,6 +108,14 @@ class WaveList(webgui.browserWindow):
 		if query == "": 
 			query="in:inbox"
 		query, page = getPageFromQuery(query, page)
+		if allpagesregex.search(query):
+			query = allpagesregex.sub("", query)
+			def callback(items):
+				self.send("clearList()")
+				self.recv_query(items)
+				self.send("pullSelection(); checkSelect()")
+			self.registry.Network.query_pages(callback, query, startpage=page, pages=ALL_PAGES, errcallback=self.loaderror)
+			return
 		if "::contacts" in query:
 			def callback(contactList):
 				self.send("clearList()")
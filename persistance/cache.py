@@ -289,13 +289,13 @@ class DocumentCache(Cache):
 	''' Cache for storing wave documents. '''
 
 	def __init__(self):
-		super(type(self), self).__init__("documents")
+		Cache.__init__(self, "documents")
 
 class UserCache(Cache):
 	''' Cache for participant profiles, such as (but not limited to) your contacts.'''
 
 	def __init__(self):
-		super(type(self), self).__init__("contacts")
+		Cache.__init__(self, "contacts")
 
 class OutboundCache(Cache):
 	''' A class for storing locally-generated operations until it's verified that
@@ -304,4 +304,4 @@ class OutboundCache(Cache):
 	and your changes will simply be synced next time you get online.'''
 
 	def __init__(self):
-		super(type(self), self).__init__("documents")
+		Cache.__init__(self, "documents")